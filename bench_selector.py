@@ -0,0 +1,199 @@
+"""SmartSelector 基准测试：在本机模拟一组边缘节点，测量优选耗时、探测次数、CPU/线程占用与选择准确度
+
+节点地址取自 198.18.0.0/15 (RFC 2544 基准测试网段)，实际连接被映射到子进程中的回环监听端口；
+延迟、抖动与丢包在 connect 钩子中注入，黑洞节点映射到积压队列已满的监听端口 (SYN 被丢弃，真实超时)。
+
+    python bench_selector.py                          # 默认规模 10,100,1000,10000，结果写入 bench_selector.json
+    python bench_selector.py -n 10 100 -e async thread -r 3 -o out.json --opt top_k=8 --opt samples=5
+"""
+import sys
+import os
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import platform
+import threading
+import multiprocessing
+from datetime import datetime
+
+from ech_core import SmartSelector
+
+LIVE_PORTS = 8   # 分散到多个监听端口，避免大规模测试时回环四元组耗尽
+
+# ==================== 模拟节点 ====================
+class Endpoint:
+    __slots__ = ("addr", "base", "jitter", "loss", "blackhole")
+    def __init__(self, addr, base, jitter=0.0, loss=0.0, blackhole=False):
+        self.addr = addr; self.base = base; self.jitter = jitter; self.loss = loss; self.blackhole = blackhole
+    def as_dict(self): return {k: getattr(self, k) for k in self.__slots__}
+
+def make_fleet(n, seed, blackhole=0.05, lossy=0.1):
+    """生成 n 个节点：大部分正常，少量丢包/黑洞，另有若干延迟极低但高丢包的"陷阱"节点和一个真实最优节点"""
+    rng = random.Random(seed); fleet = []
+    for i in range(n):
+        addr = f"198.{18 + (i >> 16)}.{(i >> 8) & 255}.{i & 255}"
+        base = rng.uniform(30, 300)
+        ep = Endpoint(addr, base, jitter=rng.uniform(0, 0.2) * base)
+        r = rng.random()
+        if r < blackhole: ep.blackhole = True
+        elif r < blackhole + lossy: ep.loss = rng.choice((0.3, 0.6))
+        fleet.append(ep)
+    idx = rng.sample(range(n), min(n, 1 + max(1, n // 200)))
+    best = fleet[idx[0]]; best.base, best.jitter, best.loss, best.blackhole = 20.0, 1.0, 0.0, False
+    for i in idx[1:]:  # 陷阱：首轮可能测出 10ms，但复测丢包严重
+        ep = fleet[i]; ep.base, ep.jitter, ep.loss, ep.blackhole = 10.0, 5.0, 0.6, False
+    return fleet
+
+def expected_ms(e):
+    # 期望建连耗时：丢包按一次 1 秒 SYN 重传计
+    return float('inf') if e.blackhole else e.base + e.loss * 1000
+
+# ==================== 回环监听 (子进程) ====================
+def serve(conn):
+    import selectors
+    sel = selectors.DefaultSelector(); live = []
+    for _ in range(LIVE_PORTS):
+        s = socket.socket(); s.bind(("127.0.0.1", 0)); s.listen(4096); s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ); live.append(s)
+    # 黑洞：积压队列设为 0 且从不 accept，先占满队列，之后的 SYN 会被内核丢弃
+    bh = socket.socket(); bh.bind(("127.0.0.1", 0)); bh.listen(0); fill = []
+    for _ in range(4):
+        c = socket.socket(); c.setblocking(False)
+        try: c.connect(bh.getsockname())
+        except (BlockingIOError, OSError): pass
+        fill.append(c)
+    time.sleep(0.2)
+    conn.send(([s.getsockname()[1] for s in live], bh.getsockname()[1]))
+    while not conn.poll(0):
+        for key, _ in sel.select(0.1):
+            try:
+                while True: c, _ = key.fileobj.accept(); c.close()
+            except (BlockingIOError, OSError): pass
+
+class Fleet:
+    """启动监听子进程，并把 SmartSelector 的 connect 钩子替换为按节点参数注入延迟的版本"""
+    def __init__(self, fleet, seed):
+        self.by_addr = {e.addr: e for e in fleet}; self.rng = random.Random(seed ^ 0x5EED)
+        self.probes = 0; self._lock = threading.Lock()
+        self._pipe, child = multiprocessing.Pipe()
+        self.proc = multiprocessing.Process(target=serve, args=(child,), daemon=True); self.proc.start()
+        self.live, self.bh = self._pipe.recv()
+
+    def _plan(self, target, port, timeout):
+        # 返回 (映射后的回环目标, 附加延迟秒, 是否丢包超时)
+        host, _ = SmartSelector.split_target(target, port)
+        ep = self.by_addr.get(host)
+        if ep is None: raise OSError(f"unknown endpoint {host}")
+        with self._lock:
+            self.probes += 1
+            delay = max(0.0, self.rng.gauss(ep.base, ep.jitter)) / 1000; lost = self.rng.random() < ep.loss
+        if lost: delay += 1.0  # SYN 丢失后约 1 秒重传
+        real = f"127.0.0.1:{self.bh}" if ep.blackhole else f"127.0.0.1:{self.live[hash(host) % len(self.live)]}"
+        return real, delay, delay > timeout
+
+    def install(self):
+        self._orig = (SmartSelector.__dict__['_aopen'], SmartSelector.__dict__['_connect'])
+        aopen, connect = SmartSelector._aopen, SmartSelector._connect
+
+        async def sim_aopen(target, port, timeout):
+            real, delay, to = self._plan(target, port, timeout)
+            if to: await asyncio.sleep(timeout); raise asyncio.TimeoutError()
+            s, lat = await aopen(real, port, timeout)
+            await asyncio.sleep(delay); return s, lat + delay * 1000
+
+        def sim_connect(target, port=443, timeout=1.0):
+            real, delay, to = self._plan(target, port, timeout)
+            if to: time.sleep(timeout); raise socket.timeout()
+            lat = connect(real, port, timeout)
+            time.sleep(delay); return lat + delay * 1000
+
+        SmartSelector._aopen = staticmethod(sim_aopen); SmartSelector._connect = staticmethod(sim_connect)
+
+    def close(self):
+        SmartSelector._aopen, SmartSelector._connect = self._orig
+        try: self._pipe.send(None)
+        except Exception: pass
+        self.proc.join(2)
+        if self.proc.is_alive(): self.proc.terminate()
+
+# ==================== 测量 ====================
+class Sampler(threading.Thread):
+    """后台采样线程数峰值"""
+    def __init__(self):
+        super().__init__(daemon=True); self.peak = threading.active_count(); self._halt = threading.Event()
+    def run(self):
+        while not self._halt.wait(0.005): self.peak = max(self.peak, threading.active_count())
+    def stop(self): self._halt.set(); self.join(); return self.peak - 1  # 不计采样线程自身
+
+def max_rss_kb():
+    try:
+        import resource
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r // 1024 if sys.platform == 'darwin' else r
+    except Exception: return None
+
+def run_once(fleet, seed, engine, opts):
+    sim = Fleet(fleet, seed); sim.install(); report = {}
+    text = "\n".join(e.addr + ":443" for e in fleet)
+    try:
+        smp = Sampler(); smp.start()
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        target, lat = SmartSelector.pick_best(text, None, report, None, engine=engine, **opts)
+        wall, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+        threads = smp.stop()
+    finally: sim.close()
+    best = min(fleet, key=expected_ms); by_addr = sim.by_addr
+    chosen = by_addr.get(SmartSelector.split_target(target)[0]) if target else None
+    eff = expected_ms(chosen) if chosen else None
+    return {
+        "size": len(fleet), "engine": engine, "wall_s": round(wall, 3), "cpu_s": round(cpu, 3),
+        "probes": sim.probes, "threads_peak": threads, "max_rss_kb": max_rss_kb(),
+        "chosen": target, "chosen_lat_ms": round(lat, 1) if target else None,
+        "chosen_endpoint": chosen.as_dict() if chosen else None,
+        "best": best.addr, "best_expected_ms": expected_ms(best), "hit": bool(chosen and chosen.addr == best.addr),
+        "regret_ms": round(eff - expected_ms(best), 1) if chosen and not chosen.blackhole else None,
+        "rank": sum(1 for e in fleet if expected_ms(e) < eff) + 1 if chosen and not chosen.blackhole else None,
+        "retested": len(report.get('scores') or []),
+    }
+
+def parse_opt(s):
+    k, _, v = s.partition("=")
+    try: v = json.loads(v)
+    except ValueError: pass
+    return k, v
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="SmartSelector 模拟节点基准测试")
+    ap.add_argument('-n', '--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000], help="节点规模")
+    ap.add_argument('-e', '--engines', nargs='+', default=["async"], choices=["async", "thread"])
+    ap.add_argument('-r', '--repeat', type=int, default=1)
+    ap.add_argument('-s', '--seed', type=int, default=1)
+    ap.add_argument('--blackhole', type=float, default=0.05, help="黑洞节点比例")
+    ap.add_argument('--lossy', type=float, default=0.1, help="丢包节点比例")
+    ap.add_argument('--opt', action='append', default=[], type=parse_opt, help="传给 pick_best 的参数，如 top_k=8")
+    ap.add_argument('-o', '--out', default="bench_selector.json", help="结果 JSON 路径，- 表示标准输出")
+    a = ap.parse_args(argv)
+
+    opts = dict(a.opt); runs = []
+    for n in a.sizes:
+        for engine in a.engines:
+            for r in range(a.repeat):
+                seed = a.seed + r
+                res = run_once(make_fleet(n, seed, a.blackhole, a.lossy), seed, engine, opts); res["seed"] = seed
+                runs.append(res)
+                print(f"n={n:<6} {engine:<6} #{r}  {res['wall_s']:7.3f}s  cpu {res['cpu_s']:6.3f}s  probes {res['probes']:<6} "
+                      f"threads {res['threads_peak']:<3} hit={res['hit']} rank={res['rank']} regret={res['regret_ms']}ms", file=sys.stderr)
+    out = {"meta": {"time": datetime.now().isoformat(timespec='seconds'), "python": platform.python_version(),
+                    "platform": platform.platform(), "cpus": os.cpu_count(), "opts": {**SmartSelector.DEFAULTS, **opts},
+                    "blackhole": a.blackhole, "lossy": a.lossy},
+           "runs": runs}
+    if a.out == "-": json.dump(out, sys.stdout, indent=2, ensure_ascii=False); print()
+    else:
+        with open(a.out, 'w', encoding='utf-8') as f: json.dump(out, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""ech-workers 隧道端到端基准测试：SOCKS5/HTTP 客户端 -> 核心 -> WebSocket 隧道 -> Worker -> 目标
+
+本机子进程中运行 _worker.js 的离线替身 (同样的 CONNECT/CONNECTED/CLOSE 协议) 和一个回声/收发目标；
+核心按 WorkerThread 的方式启动 (CoreRunner.build_cmd + ProcessManager)，另加 -noech 与 -ca 指向临时自签证书。
+逐级增加并发连接，测量建连速率、首字节时间 (p50/p99)、持续吞吐，以及核心内存和 goroutine 的增长。
+
+    python bench_tunnel.py                                  # 默认并发 1,8,32,128，结果写入 bench_tunnel.json
+    python bench_tunnel.py -c 1 16 64 -d 5 --mb 64 -o -
+    python bench_tunnel.py --core ./ech-workers --baseline last.json   # 与上次结果对比，退化超过阈值时返回 1
+
+替身是单进程 Python 实现，吞吐上限受其限制；结果用于同一台机器上不同核心版本的对比，不代表线上性能。
+"""
+import sys
+import os
+import json
+import time
+import base64
+import socket
+import asyncio
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+from ech_core import CoreRunner, ProcessManager, SmartSelector, CORE_PATH
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+SNI = "bench.local"
+CHUNK = 64 << 10
+
+# ==================== 证书 ====================
+def make_cert(d):
+    """用 openssl 生成临时自签证书 (SAN: bench.local, 127.0.0.1)，返回 (证书, 私钥) 路径"""
+    crt, key = os.path.join(d, "cert.pem"), os.path.join(d, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+                    "-keyout", key, "-out", crt, "-days", "2", "-subj", f"/CN={SNI}",
+                    "-addext", f"subjectAltName=DNS:{SNI},IP:127.0.0.1"], check=True, capture_output=True)
+    return crt, key
+
+# ==================== Worker 替身与目标 (子进程) ====================
+class WS:
+    """最小 WebSocket 服务端帧读写 (RFC 6455)；客户端帧带掩码，服务端帧不带"""
+    def __init__(self, reader, writer): self.r = reader; self.w = writer
+
+    async def recv(self):
+        # 返回 (opcode, payload)；连接关闭时返回 (None, None)
+        op0, parts = None, []
+        while True:
+            try:
+                h = await self.r.readexactly(2); n = h[1] & 0x7f
+                if n == 126: n = int.from_bytes(await self.r.readexactly(2), 'big')
+                elif n == 127: n = int.from_bytes(await self.r.readexactly(8), 'big')
+                mask = await self.r.readexactly(4) if h[1] & 0x80 else None
+                data = await self.r.readexactly(n)
+            except (asyncio.IncompleteReadError, ConnectionError): return None, None
+            if mask and n:  # 大整数异或，比逐字节快得多
+                data = (int.from_bytes(data, 'big') ^ int.from_bytes((mask * (n // 4 + 1))[:n], 'big')).to_bytes(n, 'big')
+            op = h[0] & 0x0f
+            if op == 8: return None, None
+            if op == 9: self.send(10, data); continue
+            if op == 10: continue
+            if op: op0 = op
+            parts.append(data)
+            if h[0] & 0x80: return op0, b"".join(parts)
+
+    def send(self, op, data):
+        if isinstance(data, str): data = data.encode()
+        n = len(data)
+        head = bytes([0x80 | op, n]) if n < 126 else bytes([0x80 | op, 126]) + n.to_bytes(2, 'big') if n < 65536 else bytes([0x80 | op, 127]) + n.to_bytes(8, 'big')
+        self.w.write(head + data)
+
+async def relay(reader, writer, token):
+    """与 _worker.js 相同的会话协议: 文本 CONNECT:host:port|首帧 -> CONNECTED，之后二进制双向转发，CLOSE 结束"""
+    rw = pump = None
+    try:
+        head = (await reader.readuntil(b"\r\n\r\n")).decode('latin1').split("\r\n")
+        hdr = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in head[1:] if l)}
+        if hdr.get('upgrade', '').lower() != 'websocket': writer.write(b"HTTP/1.1 426 Upgrade Required\r\n\r\n"); return
+        if token and hdr.get('sec-websocket-protocol') != token: writer.write(b"HTTP/1.1 401 Unauthorized\r\n\r\n"); return
+        accept = base64.b64encode(hashlib.sha1(hdr['sec-websocket-key'].encode() + WS_GUID).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n" + (f"Sec-WebSocket-Protocol: {token}\r\n" if token else "") + "\r\n").encode())
+        ws = WS(reader, writer)
+
+        async def pump_remote(rr):
+            while chunk := await rr.read(CHUNK):
+                ws.send(2, chunk); await writer.drain()
+            ws.send(1, "CLOSE"); await writer.drain()
+
+        while True:
+            op, data = await ws.recv()
+            if op is None: break
+            if op == 1:
+                t = data.decode('utf-8', 'surrogateescape')
+                if t.startswith("CONNECT:"):
+                    addr, _, first = t[8:].partition("|"); host, port = SmartSelector.split_target(addr)
+                    try: rr, rw = await asyncio.open_connection(host, port)
+                    except OSError as e: ws.send(1, f"ERROR:{e}"); break
+                    if first: rw.write(first.encode('utf-8', 'surrogateescape'))
+                    ws.send(1, "CONNECTED"); pump = asyncio.ensure_future(pump_remote(rr))
+                elif t.startswith("DATA:") and rw: rw.write(t[5:].encode('utf-8', 'surrogateescape'))
+                elif t == "CLOSE": break
+            elif op == 2 and rw: rw.write(data); await rw.drain()
+            await writer.drain()
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, KeyError): pass
+    finally:
+        if pump: pump.cancel()
+        for w in (rw, writer):
+            if w: w.close()
+
+async def target(reader, writer, blob):
+    """测试目标: "P\\n" 回 1 字节；"D n\\n" 下发 n 字节；"U n\\n" 收满 n 字节后回 "K" """
+    try:
+        cmd, _, n = (await reader.readline()).decode().strip().partition(" ")
+        if cmd == "P": writer.write(b"p")
+        elif cmd == "D":
+            left = int(n)
+            while left > 0: writer.write(blob[:min(left, len(blob))]); left -= len(blob); await writer.drain()
+        elif cmd == "U":
+            left = int(n)
+            while left > 0 and (chunk := await reader.read(CHUNK)): left -= len(chunk)
+            writer.write(b"K")
+        await writer.drain()
+    except (OSError, ValueError, asyncio.IncompleteReadError): pass
+    finally: writer.close()
+
+def serve(conn, crt, key, token):
+    import ssl
+    async def run():
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER); ctx.load_cert_chain(crt, key)
+        blob = memoryview(bytes(CHUNK))
+        rs = await asyncio.start_server(lambda r, w: relay(r, w, token), "127.0.0.1", 0, ssl=ctx, backlog=4096)
+        ts = await asyncio.start_server(lambda r, w: target(r, w, blob), "127.0.0.1", 0, backlog=4096)
+        conn.send((rs.sockets[0].getsockname()[1], ts.sockets[0].getsockname()[1]))
+        loop = asyncio.get_running_loop()
+        while not await loop.run_in_executor(None, conn.poll, 0.5): pass
+    asyncio.run(run())
+
+# ==================== 核心 ====================
+def free_port():
+    with socket.socket() as s: s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+class Core:
+    """按 WorkerThread 的方式启动核心，后台读取输出并保存最近一次 [统计]"""
+    def __init__(self, exe, relay_port, crt, token):
+        self.listen = f"127.0.0.1:{free_port()}"
+        cfg = {"server": f"{SNI}:{relay_port}/bench", "listen": self.listen, "token": token, "routing": "global",
+               "metrics": {"enabled": True, "interval": 1, "port": 0}}
+        cmd = CoreRunner(cfg).build_cmd(f"127.0.0.1:{relay_port}"); cmd[0] = str(exe)
+        self.p = ProcessManager.start_process(cmd + ["-noech", "-ca", crt])
+        self.stats = {}; self.ready = threading.Event(); self.tail = []
+        threading.Thread(target=self._read, daemon=True).start()
+        if not self.ready.wait(15): raise RuntimeError("核心未能启动:\n" + "\n".join(self.tail[-20:]))
+
+    def _read(self):
+        for raw in iter(self.p.stdout.readline, b""):
+            t = raw.decode('utf-8', 'replace').rstrip()
+            if (i := t.find("[统计] ")) >= 0:
+                try: self.stats = json.loads(t[i + 5:])
+                except ValueError: pass
+                continue
+            self.tail = (self.tail + [t])[-50:]
+            if "服务器启动" in t: self.ready.set()
+
+    def rss_kb(self):
+        try:
+            with open(f"/proc/{self.p.pid}/status") as f:
+                return next(int(l.split()[1]) for l in f if l.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            try: import psutil; return psutil.Process(self.p.pid).memory_info().rss // 1024
+            except Exception: return None
+
+    def sample(self, wait=1.2):
+        # 等待下一行 [统计] (间隔 1 秒) 后返回内存与 goroutine 数
+        time.sleep(wait); s = self.stats
+        return {"rss_kb": self.rss_kb(), "heap": s.get("heap"), "goroutines": s.get("goroutines"), "active": s.get("active"),
+                "tunnels": s.get("tunnels"), "errors": s.get("errors"), "ws_dial_fails": s.get("ws_dial_fails")}
+
+    def close(self): ProcessManager.kill_current()
+
+# ==================== 客户端 ====================
+async def open_proxy(listen, proto, port):
+    """经核心建立到 127.0.0.1:port 的隧道，返回 (reader, writer)"""
+    host, lport = listen.rsplit(":", 1)
+    r, w = await asyncio.open_connection(host, int(lport))
+    if proto == "socks5":
+        w.write(b"\x05\x01\x00"); await r.readexactly(2)
+        w.write(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + port.to_bytes(2, 'big'))
+        rep = await r.readexactly(10)
+        if rep[1] != 0: w.close(); raise ConnectionError(f"SOCKS5 {rep[1]}")
+    else:
+        w.write(f"CONNECT 127.0.0.1:{port} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode())
+        head = await r.readuntil(b"\r\n\r\n")
+        if b" 200" not in head.split(b"\r\n", 1)[0]: w.close(); raise ConnectionError(head.split(b"\r\n", 1)[0].decode('latin1'))
+    return r, w
+
+def pct(vals, q):
+    vals = sorted(vals)
+    return round(SmartSelector._pct(vals, q), 2) if vals else None
+
+async def ramp_level(listen, port, proto, conc, secs, timeout):
+    """conc 个并发循环: 建隧道 -> 发 P -> 读 1 字节 -> 关闭；记录建隧道耗时与首字节时间"""
+    ttfb, setup, errs = [], [], 0; end = time.perf_counter() + secs
+
+    async def one():
+        nonlocal errs
+        while time.perf_counter() < end:
+            t0 = time.perf_counter(); w = None
+            try:
+                r, w = await asyncio.wait_for(open_proxy(listen, proto, port), timeout); t1 = time.perf_counter()
+                w.write(b"P\n"); await asyncio.wait_for(r.readexactly(1), timeout)
+                setup.append((t1 - t0) * 1000); ttfb.append((time.perf_counter() - t0) * 1000)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError): errs += 1
+            finally:
+                if w: w.close()
+
+    t0 = time.perf_counter(); await asyncio.gather(*(one() for _ in range(conc))); wall = time.perf_counter() - t0
+    return {"proto": proto, "concurrency": conc, "secs": round(wall, 2), "conns": len(ttfb), "errors": errs,
+            "conn_per_s": round(len(ttfb) / wall, 1), "setup_p50_ms": pct(setup, 0.5), "setup_p99_ms": pct(setup, 0.99),
+            "ttfb_p50_ms": pct(ttfb, 0.5), "ttfb_p99_ms": pct(ttfb, 0.99)}
+
+async def bulk(listen, port, proto, streams, total, up):
+    """streams 条隧道并行下载 (或上传) 共 total 字节，返回 MB/s"""
+    each = total // streams; blob = bytes(CHUNK)
+
+    async def one():
+        r, w = await open_proxy(listen, proto, port)
+        try:
+            if up:
+                w.write(f"U {each}\n".encode()); left = each
+                while left > 0: w.write(blob[:min(left, CHUNK)]); left -= CHUNK; await w.drain()
+                await r.readexactly(1)
+            else:
+                w.write(f"D {each}\n".encode()); got = 0
+                while got < each and (chunk := await r.read(CHUNK)): got += len(chunk)
+                if got < each: raise ConnectionError(f"只收到 {got}/{each} 字节")
+        finally: w.close()
+
+    t0 = time.perf_counter(); await asyncio.gather(*(one() for _ in range(streams))); wall = time.perf_counter() - t0
+    return {"proto": proto, "direction": "up" if up else "down", "streams": streams, "bytes": each * streams,
+            "secs": round(wall, 3), "mb_per_s": round(each * streams / wall / (1 << 20), 2)}
+
+# ==================== 汇总与对比 ====================
+# 对比基线时检查的指标: (键, 越大越好)
+CHECKS = (("conn_per_s", True), ("ttfb_p50_ms", False), ("ttfb_p99_ms", False), ("mb_per_s", True))
+
+def regressions(cur, base, tol):
+    """逐项对比相同配置的结果，返回超过容差的退化描述列表"""
+    key = lambda r: (r.get("proto"), r.get("concurrency"), r.get("direction"), r.get("streams"))
+    old = {key(r): r for r in base.get("levels", []) + base.get("bulk", [])}; out = []
+    for r in cur["levels"] + cur["bulk"]:
+        b = old.get(key(r))
+        if not b: continue
+        for k, higher in CHECKS:
+            if r.get(k) is None or not b.get(k): continue
+            change = (r[k] - b[k]) / b[k]
+            if (change < -tol) if higher else (change > tol):
+                out.append(f"{'/'.join(str(x) for x in key(r) if x is not None)} {k}: {b[k]} -> {r[k]} ({change:+.0%})")
+    g0, g1 = base.get("growth", {}).get("goroutines"), cur["growth"].get("goroutines")
+    if g0 is not None and g1 is not None and g1 > max(g0, 0) + 20: out.append(f"goroutine 增长: {g0} -> {g1}")
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ech-workers 隧道端到端基准测试 (离线 Worker 替身)")
+    ap.add_argument('-c', '--concurrency', type=int, nargs='+', default=[1, 8, 32, 128], help="逐级并发连接数")
+    ap.add_argument('-d', '--duration', type=float, default=3.0, help="每级持续秒数")
+    ap.add_argument('-p', '--protos', nargs='+', default=["http", "socks5"], choices=["http", "socks5"])
+    ap.add_argument('--mb', type=int, default=32, help="吞吐测试的总数据量 (MB)，0 跳过")
+    ap.add_argument('--streams', type=int, nargs='+', default=[1, 4], help="吞吐测试的并行隧道数")
+    ap.add_argument('--timeout', type=float, default=10.0, help="单次请求超时秒数")
+    ap.add_argument('--core', default=str(CORE_PATH), help="核心可执行文件 (默认为程序目录下的 ech-workers)")
+    ap.add_argument('--token', default="bench-token")
+    ap.add_argument('--baseline', help="上一次的结果 JSON；指标退化超过 --tolerance 时返回 1")
+    ap.add_argument('--tolerance', type=float, default=0.25, help="允许的相对退化比例")
+    ap.add_argument('-o', '--out', default="bench_tunnel.json", help="结果 JSON 路径，- 表示标准输出")
+    a = ap.parse_args(argv)
+
+    if not os.path.exists(a.core): print(f"核心不存在: {a.core}", file=sys.stderr); return 2
+    tmp = tempfile.TemporaryDirectory(); crt, key = make_cert(tmp.name)
+    pipe, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=serve, args=(child, crt, key, a.token), daemon=True); proc.start()
+    relay_port, target_port = pipe.recv(); core = None
+    try:
+        core = Core(a.core, relay_port, crt, a.token)
+        base = core.sample(); samples = [{"stage": "idle", **base}]; levels, bulks = [], []
+        for proto in a.protos:
+            for c in a.concurrency:
+                res = asyncio.run(ramp_level(core.listen, target_port, proto, c, a.duration, a.timeout))
+                res["core"] = core.sample(); levels.append(res)
+                print(f"{proto:<6} c={c:<4} {res['conn_per_s']:8.1f} conn/s  ttfb p50 {res['ttfb_p50_ms']}ms p99 {res['ttfb_p99_ms']}ms  "
+                      f"err {res['errors']}  goroutines {res['core']['goroutines']}  rss {res['core']['rss_kb']}KB", file=sys.stderr)
+        if a.mb > 0:
+            for s in a.streams:
+                for up in (False, True):
+                    res = asyncio.run(bulk(core.listen, target_port, a.protos[0], s, a.mb << 20, up)); bulks.append(res)
+                    print(f"{res['direction']:<4} x{s:<3} {res['mb_per_s']:8.2f} MB/s", file=sys.stderr)
+        end = core.sample(2.5); samples.append({"stage": "after", **end})
+    finally:
+        if core: core.close()
+        pipe.send(None); proc.join(3)
+        if proc.is_alive(): proc.terminate()
+        tmp.cleanup()
+
+    diff = lambda k: end[k] - base[k] if None not in (end.get(k), base.get(k)) else None
+    out = {"meta": {"time": datetime.now().isoformat(timespec='seconds'), "python": platform.python_version(),
+                    "platform": platform.platform(), "cpus": os.cpu_count(), "core": os.path.abspath(a.core),
+                    "duration": a.duration, "mb": a.mb},
+           "levels": levels, "bulk": bulks, "samples": samples,
+           "growth": {"rss_kb": diff("rss_kb"), "heap": diff("heap"), "goroutines": diff("goroutines")}}
+    code = 0
+    if a.baseline:
+        with open(a.baseline, encoding='utf-8') as f: regs = regressions(out, json.load(f), a.tolerance)
+        out["regressions"] = regs
+        for r in regs: print(f"⚠️ 退化 {r}", file=sys.stderr)
+        code = 1 if regs else 0
+    if a.out == "-": json.dump(out, sys.stdout, indent=2, ensure_ascii=False); print()
+    else:
+        with open(a.out, 'w', encoding='utf-8') as f: json.dump(out, f, indent=2, ensure_ascii=False)
+    return code
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,10 +4,12 @@ import (
 	"bufio"
 	"bytes"
 	"context"
+	"crypto/sha256"
 	"crypto/tls"
 	"crypto/x509"
 	"encoding/base64"
 	"encoding/binary"
+	"encoding/json"
 	"errors"
 	"flag"
 	"fmt"
@@ -19,8 +21,11 @@ import (
 	"os"
 	"path/filepath"
 	"reflect"
+	"runtime"
+	"sort"
 	"strings"
 	"sync"
+	"sync/atomic"
 	"time"
 
 	"github.com/gorilla/websocket"
@@ -36,6 +41,13 @@ var (
 	dnsServer   string
 	echDomain   string
 	routingMode string // 分流模式: "global", "bypass_cn", "none"
+	ctlStdin    bool   // 是否从标准输入读取控制命令
+	statsEvery  int    // 统计输出间隔（秒），0 表示关闭
+	routeTTL    int    // 分流结论缓存秒数，0 表示关闭
+	noECH       bool   // 测试模式：不使用 ECH，直接以普通 TLS 连接服务端
+	caFile      string // 额外信任的 CA 证书 (PEM)
+
+	serverIPMu sync.RWMutex
 
 	echListMu sync.RWMutex
 	echList   []byte
@@ -69,6 +81,11 @@ func init() {
 	flag.StringVar(&dnsServer, "dns", "dns.alidns.com/dns-query", "ECH 查询 DoH 服务器")
 	flag.StringVar(&echDomain, "ech", "cloudflare-ech.com", "ECH 查询域名")
 	flag.StringVar(&routingMode, "routing", "global", "分流模式: global(全局代理), bypass_cn(跳过中国大陆), none(不改变代理)")
+	flag.BoolVar(&ctlStdin, "ctl", false, "从标准输入读取控制命令 (IP <ip[:port]> 切换服务端 IP)")
+	flag.IntVar(&statsEvery, "stats", 0, "每隔 N 秒输出一行 [统计] JSON 计数，0 为关闭")
+	flag.IntVar(&routeTTL, "routecache", 300, "bypass_cn 模式下按域名缓存分流结论的秒数，0 为关闭")
+	flag.BoolVar(&noECH, "noech", false, "【仅供基准测试】不使用 ECH，以普通 TLS 连接服务端，SNI 明文可见，请勿用于日常代理")
+	flag.StringVar(&caFile, "ca", "", "【仅供基准测试】额外信任的 CA 证书文件 (PEM)，用于本地自签名测试服务端")
 }
 
 func main() {
@@ -78,9 +95,21 @@ func main() {
 		log.Fatal("必须指定服务端地址 -f\n\n示例:\n  ./client -l 127.0.0.1:1080 -f your-worker.workers.dev:443 -token your-token")
 	}
 
-	log.Printf("[启动] 正在获取 ECH 配置...")
-	if err := prepareECH(); err != nil {
-		log.Fatalf("[启动] 获取 ECH 配置失败: %v", err)
+	// 控制通道尽早启动，初始化期间收到的 IP 切换命令也能立即生效 (并行启动时 GUI 会在测速完成后发送)
+	if ctlStdin {
+		go runControlLoop()
+	}
+
+	if caFile != "" {
+		log.Printf("[警告] 已额外信任 CA 证书 %s（-ca 仅供基准测试）", caFile)
+	}
+	if noECH {
+		log.Printf("[警告] 已禁用 ECH（-noech 仅供基准测试）：服务端域名将以明文 SNI 发送，请勿用于日常代理")
+	} else {
+		log.Printf("[启动] 正在获取 ECH 配置...")
+		if err := prepareECH(); err != nil {
+			log.Fatalf("[启动] 获取 ECH 配置失败: %v", err)
+		}
 	}
 
 	// 加载中国IP列表（如果需要）
@@ -89,20 +118,29 @@ func main() {
 		ipv4Count := 0
 		ipv6Count := 0
 
-		if err := loadChinaIPList(); err != nil {
-			log.Printf("[警告] 加载中国IPv4列表失败: %v", err)
+		// 优先读取 GUI 生成的预编译索引，缺失、过期或校验失败时解析文本列表
+		if n4, n6, err := loadChinaIndex(); err == nil {
+			ipv4Count, ipv6Count = n4, n6
+			log.Printf("[加载] 已读取预编译索引 chn_ip.idx")
 		} else {
-			chinaIPRangesMu.RLock()
-			ipv4Count = len(chinaIPRanges)
-			chinaIPRangesMu.RUnlock()
-		}
+			if !os.IsNotExist(err) {
+				log.Printf("[加载] 预编译索引不可用 (%v)，改为解析文本列表", err)
+			}
+			if err := loadChinaIPList(); err != nil {
+				log.Printf("[警告] 加载中国IPv4列表失败: %v", err)
+			} else {
+				chinaIPRangesMu.RLock()
+				ipv4Count = len(chinaIPRanges)
+				chinaIPRangesMu.RUnlock()
+			}
 
-		if err := loadChinaIPV6List(); err != nil {
-			log.Printf("[警告] 加载中国IPv6列表失败: %v", err)
-		} else {
-			chinaIPV6RangesMu.RLock()
-			ipv6Count = len(chinaIPV6Ranges)
-			chinaIPV6RangesMu.RUnlock()
+			if err := loadChinaIPV6List(); err != nil {
+				log.Printf("[警告] 加载中国IPv6列表失败: %v", err)
+			} else {
+				chinaIPV6RangesMu.RLock()
+				ipv6Count = len(chinaIPV6Ranges)
+				chinaIPV6RangesMu.RUnlock()
+			}
 		}
 
 		if ipv4Count > 0 || ipv6Count > 0 {
@@ -119,6 +157,10 @@ func main() {
 		routingMode = "global"
 	}
 
+	if statsEvery > 0 {
+		go runStatsLoop(time.Duration(statsEvery) * time.Second)
+	}
+
 	runProxyServer(listenAddr)
 }
 
@@ -249,6 +291,78 @@ func downloadIPList(url, filePath string) error {
 	return nil
 }
 
+// 预编译索引 chn_ip.idx 由 GUI 从文本列表生成（排序合并后的起止地址数组），布局见 ech_core.ChinaIndex
+const (
+	chinaIndexMagic   = "ECHCNIDX"
+	chinaIndexVersion = 1
+	chinaIndexHeader  = 96
+)
+
+// chinaListPath 返回列表文件路径：优先程序目录，其次当前目录
+func chinaListPath(name string) string {
+	if exePath, err := os.Executable(); err == nil {
+		p := filepath.Join(filepath.Dir(exePath), name)
+		if _, err := os.Stat(p); err == nil {
+			return p
+		}
+	}
+	return name
+}
+
+// loadChinaIndex 整块读入预编译索引，校验魔数、长度、SHA-256 以及源列表文件的大小和修改时间
+func loadChinaIndex() (int, int, error) {
+	data, err := os.ReadFile(chinaListPath("chn_ip.idx"))
+	if err != nil {
+		return 0, 0, err
+	}
+	if len(data) < chinaIndexHeader || string(data[:8]) != chinaIndexMagic {
+		return 0, 0, errors.New("格式错误")
+	}
+	le := binary.LittleEndian
+	if v := le.Uint32(data[8:]); v != chinaIndexVersion {
+		return 0, 0, fmt.Errorf("版本 %d 不支持", v)
+	}
+	n4, n6 := int(le.Uint32(data[12:])), int(le.Uint32(data[16:]))
+	if n4 == 0 || len(data) != chinaIndexHeader+n4*8+n6*32 {
+		return 0, 0, errors.New("长度不符")
+	}
+	for i, name := range []string{"chn_ip.txt", "chn_ip_v6.txt"} {
+		size, mtime := int64(-1), int64(-1)
+		if info, err := os.Stat(chinaListPath(name)); err == nil {
+			size, mtime = info.Size(), info.ModTime().UnixNano()
+		}
+		if int64(le.Uint64(data[24+i*16:])) != size || int64(le.Uint64(data[32+i*16:])) != mtime {
+			return 0, 0, fmt.Errorf("%s 已更新", name)
+		}
+	}
+	h := sha256.New()
+	h.Write(data[:64])
+	h.Write(data[chinaIndexHeader:])
+	if !bytes.Equal(h.Sum(nil), data[64:96]) {
+		return 0, 0, errors.New("校验失败")
+	}
+
+	body := data[chinaIndexHeader:]
+	v4 := make([]ipRange, n4)
+	for i := range v4 {
+		v4[i] = ipRange{start: le.Uint32(body[i*4:]), end: le.Uint32(body[(n4+i)*4:])}
+	}
+	body = body[n4*8:]
+	v6 := make([]ipRangeV6, n6)
+	for i := range v6 {
+		copy(v6[i].start[:], body[i*16:])
+		copy(v6[i].end[:], body[(n6+i)*16:])
+	}
+
+	chinaIPRangesMu.Lock()
+	chinaIPRanges = v4
+	chinaIPRangesMu.Unlock()
+	chinaIPV6RangesMu.Lock()
+	chinaIPV6Ranges = v6
+	chinaIPV6RangesMu.Unlock()
+	return n4, n6, nil
+}
+
 // loadChinaIPList 从程序目录加载中国IP列表
 func loadChinaIPList() error {
 	// 获取可执行文件所在目录
@@ -323,13 +437,7 @@ func loadChinaIPList() error {
 	}
 
 	// 按起始IP排序
-	for i := 0; i < len(ranges)-1; i++ {
-		for j := i + 1; j < len(ranges); j++ {
-			if ranges[i].start > ranges[j].start {
-				ranges[i], ranges[j] = ranges[j], ranges[i]
-			}
-		}
-	}
+	sort.Slice(ranges, func(i, j int) bool { return ranges[i].start < ranges[j].start })
 
 	chinaIPRangesMu.Lock()
 	chinaIPRanges = ranges
@@ -426,13 +534,7 @@ func loadChinaIPV6List() error {
 	}
 
 	// 按起始IP排序
-	for i := 0; i < len(ranges)-1; i++ {
-		for j := i + 1; j < len(ranges); j++ {
-			if compareIPv6(ranges[i].start, ranges[j].start) > 0 {
-				ranges[i], ranges[j] = ranges[j], ranges[i]
-			}
-		}
-	}
+	sort.Slice(ranges, func(i, j int) bool { return compareIPv6(ranges[i].start, ranges[j].start) < 0 })
 
 	chinaIPV6RangesMu.Lock()
 	chinaIPV6Ranges = ranges
@@ -441,39 +543,235 @@ func loadChinaIPV6List() error {
 	return nil
 }
 
-// shouldBypassProxy 根据分流模式判断是否应该绕过代理（直连）
-func shouldBypassProxy(targetHost string) bool {
+// shouldBypassProxy 根据分流模式判断是否应该绕过代理（直连），同时返回判定原因
+func shouldBypassProxy(targetHost string) (bool, string) {
 	if routingMode == "none" {
 		// "不改变代理"模式：所有流量都直连
-		return true
+		return true, "直连模式"
 	}
 	if routingMode == "global" {
 		// "全局代理"模式：所有流量都走代理
-		return false
+		return false, "全局代理"
 	}
 	if routingMode == "bypass_cn" {
 		// "跳过中国大陆"模式：检查是否是中国IP
 		// 先尝试解析为IP
 		if ip := net.ParseIP(targetHost); ip != nil {
-			return isChinaIP(targetHost)
+			if isChinaIP(targetHost) {
+				return true, "中国IP"
+			}
+			return false, "非中国IP"
 		}
-		// 如果是域名，先解析IP
-		ips, err := net.LookupIP(targetHost)
-		if err != nil {
-			// 解析失败，默认走代理
-			return false
+		// 如果是域名，先解析IP（结论按域名缓存）
+		return lookupRoute(targetHost)
+	}
+	// 未知模式，默认走代理
+	return false, "未知分流模式"
+}
+
+// resolveRoute 解析域名并判定，有一个解析结果是中国IP就直连
+func resolveRoute(host string) (bool, string, error) {
+	ips, err := lookupIP(host)
+	if err != nil {
+		// 解析失败，默认走代理
+		return false, "解析失败", err
+	}
+	for _, ip := range ips {
+		if isChinaIP(ip.String()) {
+			return true, "解析到中国IP " + ip.String(), nil
 		}
-		// 检查所有解析到的IP，如果有一个是中国IP，就直连
-		for _, ip := range ips {
-			if isChinaIP(ip.String()) {
-				return true
+	}
+	// 都不是中国IP，走代理
+	return false, fmt.Sprintf("解析到 %d 个非中国IP", len(ips)), nil
+}
+
+// getServerIP 返回当前指定的服务端 IP（可能被控制命令修改）
+func getServerIP() string {
+	serverIPMu.RLock()
+	defer serverIPMu.RUnlock()
+	return serverIP
+}
+
+// setServerIP 修改服务端 IP，返回旧值；只影响之后新建的连接
+func setServerIP(ip string) string {
+	serverIPMu.Lock()
+	defer serverIPMu.Unlock()
+	old := serverIP
+	serverIP = ip
+	return old
+}
+
+// runControlLoop 逐行读取标准输入中的控制命令（由 GUI 通过管道发送）
+func runControlLoop() {
+	scanner := bufio.NewScanner(os.Stdin)
+	for scanner.Scan() {
+		fields := strings.Fields(scanner.Text())
+		if len(fields) == 0 {
+			continue
+		}
+		switch strings.ToUpper(fields[0]) {
+		case "IP":
+			newIP := ""
+			if len(fields) > 1 {
+				newIP = fields[1]
 			}
+			old := setServerIP(newIP)
+			log.Printf("[控制] 服务端 IP 已切换: %s -> %s", old, newIP)
+		default:
+			log.Printf("[控制] 未知命令: %s", fields[0])
 		}
-		// 都不是中国IP，走代理
-		return false
 	}
-	// 未知模式，默认走代理
-	return false
+}
+
+// ======================== 分流缓存 ========================
+
+// 浏览器会对同一批域名并发开出几十个连接，每个连接都先做一次 DNS 解析再判定分流太慢；
+// 这里按域名缓存判定结论：同一域名的并发连接只解析一次，解析失败也缓存较短时间，
+// 热门域名在即将过期时后台预取。标准库解析不返回记录 TTL，缓存时间由 -routecache 指定
+const (
+	routeCacheMax     = 4096             // 最多缓存的域名数
+	routeNegTTL       = 30 * time.Second // 解析失败结论的缓存时间
+	routePrefetchHits = 3                // 命中次数达到该值的域名在剩余时间不足 1/10 时预取
+)
+
+// routeVerdict 一个域名的分流结论；ready 关闭后只读（hits/refreshing 为原子量）
+type routeVerdict struct {
+	direct     bool
+	reason     string
+	expires    time.Time
+	ttl        time.Duration // 解析成功时的缓存时长；解析失败的结论为 0，不参与预取
+	ready      chan struct{}
+	hits       atomic.Int32
+	refreshing atomic.Bool
+}
+
+var (
+	routeCacheMu sync.Mutex
+	routeCache   = make(map[string]*routeVerdict)
+	lookupIP     = net.LookupIP // 测试时替换
+)
+
+// lookupRoute 带缓存的域名分流判定
+func lookupRoute(host string) (bool, string) {
+	if routeTTL <= 0 {
+		direct, reason, _ := resolveRoute(host)
+		return direct, reason
+	}
+	host = strings.ToLower(strings.TrimSuffix(host, "."))
+	routeCacheMu.Lock()
+	v, ok := routeCache[host]
+	if ok {
+		select {
+		case <-v.ready:
+			ok = time.Now().Before(v.expires)
+		default: // 其他连接正在解析，等待其结果
+		}
+	}
+	if !ok {
+		v = &routeVerdict{ready: make(chan struct{})}
+		putRoute(host, v)
+		routeCacheMu.Unlock()
+		stats.routeMisses.Add(1)
+		fillRoute(v, host)
+		return v.direct, v.reason
+	}
+	routeCacheMu.Unlock()
+	<-v.ready
+	stats.routeHits.Add(1)
+	// 只预取解析成功的结论：失败结论的缓存时间本就很短，到期后由下一个连接重新解析，避免 DNS 故障期间反复后台解析
+	if v.ttl > 0 && v.hits.Add(1) >= routePrefetchHits && time.Until(v.expires) < v.ttl/10 && v.refreshing.CompareAndSwap(false, true) {
+		go prefetchRoute(host)
+	}
+	return v.direct, v.reason + ", 缓存"
+}
+
+// fillRoute 解析并写入结论，随后唤醒等待者
+func fillRoute(v *routeVerdict, host string) {
+	direct, reason, err := resolveRoute(host)
+	ttl := time.Duration(routeTTL) * time.Second
+	if err == nil {
+		v.ttl = ttl
+	} else {
+		ttl = routeNegTTL
+	}
+	v.direct, v.reason, v.expires = direct, reason, time.Now().Add(ttl)
+	close(v.ready)
+}
+
+// prefetchRoute 后台重新解析热门域名，完成后替换旧结论（旧结论在此期间继续可用）
+func prefetchRoute(host string) {
+	v := &routeVerdict{ready: make(chan struct{})}
+	fillRoute(v, host)
+	stats.routePrefetches.Add(1)
+	routeCacheMu.Lock()
+	putRoute(host, v)
+	routeCacheMu.Unlock()
+}
+
+// putRoute 写入缓存，调用方需持有 routeCacheMu；已满时先清理过期项，仍满则随机淘汰
+func putRoute(host string, v *routeVerdict) {
+	if _, exists := routeCache[host]; !exists && len(routeCache) >= routeCacheMax {
+		now := time.Now()
+		for k, e := range routeCache {
+			select {
+			case <-e.ready:
+				if now.After(e.expires) {
+					delete(routeCache, k)
+				}
+			default:
+			}
+		}
+		for k := range routeCache {
+			if len(routeCache) < routeCacheMax {
+				break
+			}
+			delete(routeCache, k)
+		}
+	}
+	routeCache[host] = v
+}
+
+func routeCacheLen() int64 {
+	routeCacheMu.Lock()
+	defer routeCacheMu.Unlock()
+	return int64(len(routeCache))
+}
+
+// ======================== 运行统计 ========================
+
+// 全部为原子计数，热路径上每个连接只增加几次原子操作
+var stats struct {
+	conns       atomic.Int64 // 累计接入连接
+	active      atomic.Int64 // 当前活动连接
+	tunnels     atomic.Int64 // 当前活动的代理隧道
+	proxied     atomic.Int64 // 累计经代理的请求
+	direct      atomic.Int64 // 累计分流直连的请求
+	errors      atomic.Int64 // 累计失败的请求
+	wsDialFails atomic.Int64 // WebSocket 建连失败次数
+	bytesUp     atomic.Int64 // 客户端 -> 远端字节数
+	bytesDown   atomic.Int64 // 远端 -> 客户端字节数
+
+	routeHits       atomic.Int64 // 分流结论缓存命中
+	routeMisses     atomic.Int64 // 分流结论缓存未命中（需要解析）
+	routePrefetches atomic.Int64 // 热门域名后台预取次数
+}
+
+func runStatsLoop(every time.Duration) {
+	ticker := time.NewTicker(every)
+	defer ticker.Stop()
+	var m runtime.MemStats
+	for range ticker.C {
+		runtime.ReadMemStats(&m)
+		b, _ := json.Marshal(map[string]int64{
+			"conns": stats.conns.Load(), "active": stats.active.Load(), "tunnels": stats.tunnels.Load(),
+			"proxied": stats.proxied.Load(), "direct": stats.direct.Load(), "errors": stats.errors.Load(),
+			"ws_dial_fails": stats.wsDialFails.Load(), "bytes_up": stats.bytesUp.Load(), "bytes_down": stats.bytesDown.Load(),
+			"route_hits": stats.routeHits.Load(), "route_misses": stats.routeMisses.Load(),
+			"route_prefetches": stats.routePrefetches.Load(), "route_cached": routeCacheLen(),
+			"goroutines": int64(runtime.NumGoroutine()), "heap": int64(m.HeapAlloc),
+		})
+		log.Printf("[统计] %s", b)
+	}
 }
 
 func isNormalCloseError(err error) bool {
@@ -527,10 +825,36 @@ func getECHList() ([]byte, error) {
 	return echList, nil
 }
 
+var (
+	rootsOnce sync.Once
+	roots     *x509.CertPool
+	rootsErr  error
+)
+
+// rootCAs 返回系统根证书，并加入 -ca 指定的证书（只加载一次）
+func rootCAs() (*x509.CertPool, error) {
+	rootsOnce.Do(func() {
+		roots, rootsErr = x509.SystemCertPool()
+		if rootsErr != nil {
+			rootsErr = fmt.Errorf("加载系统根证书失败: %w", rootsErr)
+			return
+		}
+		if caFile != "" {
+			pem, err := os.ReadFile(caFile)
+			if err != nil {
+				rootsErr = fmt.Errorf("读取 CA 证书失败: %w", err)
+			} else if !roots.AppendCertsFromPEM(pem) {
+				rootsErr = errors.New("CA 证书格式无效")
+			}
+		}
+	})
+	return roots, rootsErr
+}
+
 func buildTLSConfigWithECH(serverName string, echList []byte) (*tls.Config, error) {
-	roots, err := x509.SystemCertPool()
+	pool, err := rootCAs()
 	if err != nil {
-		return nil, fmt.Errorf("加载系统根证书失败: %w", err)
+		return nil, err
 	}
 
 	if echList == nil || len(echList) == 0 {
@@ -540,7 +864,7 @@ func buildTLSConfigWithECH(serverName string, echList []byte) (*tls.Config, erro
 	config := &tls.Config{
 		MinVersion: tls.VersionTLS13,
 		ServerName: serverName,
-		RootCAs:    roots,
+		RootCAs:    pool,
 	}
 
 	// 使用反射设置 ECH 字段（ECH 是核心功能，必须设置成功）
@@ -741,7 +1065,7 @@ func queryDoHForProxy(dnsQuery []byte) ([]byte, error) {
 	}
 
 	// 如果指定了 IP，使用自定义 Dialer
-	if serverIP != "" {
+	if serverIP := getServerIP(); serverIP != "" {
 		transport.DialContext = func(ctx context.Context, network, addr string) (net.Conn, error) {
 			// [修改] 如果 serverIP 已经包含端口（如 1.2.3.4:8080），直接使用
 			if _, _, err := net.SplitHostPort(serverIP); err == nil {
@@ -811,18 +1135,28 @@ func dialWebSocketWithECH(maxRetries int) (*websocket.Conn, error) {
 	wsURL := fmt.Sprintf("wss://%s:%s%s", host, port, path)
 
 	for attempt := 1; attempt <= maxRetries; attempt++ {
-		echBytes, echErr := getECHList()
-		if echErr != nil {
-			if attempt < maxRetries {
-				refreshECH()
-				continue
+		var tlsCfg *tls.Config
+		if noECH {
+			pool, err := rootCAs()
+			if err != nil {
+				return nil, err
+			}
+			tlsCfg = &tls.Config{MinVersion: tls.VersionTLS13, ServerName: host, RootCAs: pool}
+		} else {
+			echBytes, echErr := getECHList()
+			if echErr != nil {
+				if attempt < maxRetries {
+					refreshECH()
+					continue
+				}
+				return nil, echErr
 			}
-			return nil, echErr
-		}
 
-		tlsCfg, tlsErr := buildTLSConfigWithECH(host, echBytes)
-		if tlsErr != nil {
-			return nil, tlsErr
+			var tlsErr error
+			tlsCfg, tlsErr = buildTLSConfigWithECH(host, echBytes)
+			if tlsErr != nil {
+				return nil, tlsErr
+			}
 		}
 
 		dialer := websocket.Dialer{
@@ -836,7 +1170,7 @@ func dialWebSocketWithECH(maxRetries int) (*websocket.Conn, error) {
 			HandshakeTimeout: 10 * time.Second,
 		}
 
-		if serverIP != "" {
+		if serverIP := getServerIP(); serverIP != "" {
 			dialer.NetDial = func(network, address string) (net.Conn, error) {
 				// [修改] 如果 serverIP 已经包含端口（如 1.2.3.4:8080），直接使用
 				if _, _, err := net.SplitHostPort(serverIP); err == nil {
@@ -880,8 +1214,8 @@ func runProxyServer(addr string) {
 
 	log.Printf("[代理] 服务器启动: %s (支持 SOCKS5 和 HTTP)", addr)
 	log.Printf("[代理] 后端服务器: %s", serverAddr)
-	if serverIP != "" {
-		log.Printf("[代理] 使用固定 IP: %s", serverIP)
+	if ip := getServerIP(); ip != "" {
+		log.Printf("[代理] 使用固定 IP: %s", ip)
 	}
 
 	for {
@@ -897,6 +1231,9 @@ func runProxyServer(addr string) {
 
 func handleConnection(conn net.Conn) {
 	defer conn.Close()
+	stats.conns.Add(1)
+	stats.active.Add(1)
+	defer stats.active.Add(-1)
 
 	clientAddr := conn.RemoteAddr().String()
 	conn.SetDeadline(time.Now().Add(30 * time.Second))
@@ -1322,7 +1659,13 @@ const (
 	modeHTTPProxy   = 3 // HTTP 普通代理（GET/POST等）
 )
 
-func handleTunnel(conn net.Conn, target, clientAddr string, mode int, firstFrame string) error {
+func handleTunnel(conn net.Conn, target, clientAddr string, mode int, firstFrame string) (err error) {
+	defer func() {
+		if err != nil {
+			stats.errors.Add(1)
+		}
+	}()
+
 	// 解析目标地址
 	targetHost, _, err := net.SplitHostPort(target)
 	if err != nil {
@@ -1330,19 +1673,25 @@ func handleTunnel(conn net.Conn, target, clientAddr string, mode int, firstFrame
 	}
 
 	// 检查是否应该绕过代理（直连）
-	if shouldBypassProxy(targetHost) {
-		log.Printf("[分流] %s -> %s (直连，绕过代理)", clientAddr, target)
+	direct, reason := shouldBypassProxy(targetHost)
+	if direct {
+		log.Printf("[分流] %s -> %s (直连，绕过代理) [%s]", clientAddr, target, reason)
+		stats.direct.Add(1)
 		return handleDirectConnection(conn, target, clientAddr, mode, firstFrame)
 	}
 
 	// 走代理
-	log.Printf("[分流] %s -> %s (通过代理)", clientAddr, target)
+	log.Printf("[分流] %s -> %s (通过代理) [%s]", clientAddr, target, reason)
+	stats.proxied.Add(1)
 	wsConn, err := dialWebSocketWithECH(2)
 	if err != nil {
+		stats.wsDialFails.Add(1)
 		sendErrorResponse(conn, mode)
 		return err
 	}
 	defer wsConn.Close()
+	stats.tunnels.Add(1)
+	defer stats.tunnels.Add(-1)
 
 	var mu sync.Mutex
 
@@ -1379,6 +1728,7 @@ func handleTunnel(conn net.Conn, target, clientAddr string, mode int, firstFrame
 
 	// 发送连接请求
 	connectMsg := fmt.Sprintf("CONNECT:%s|%s", target, firstFrame)
+	stats.bytesUp.Add(int64(len(firstFrame)))
 	mu.Lock()
 	err = wsConn.WriteMessage(websocket.TextMessage, []byte(connectMsg))
 	mu.Unlock()
@@ -1427,6 +1777,7 @@ func handleTunnel(conn net.Conn, target, clientAddr string, mode int, firstFrame
 				return
 			}
 
+			stats.bytesUp.Add(int64(n))
 			mu.Lock()
 			err = wsConn.WriteMessage(websocket.BinaryMessage, buf[:n])
 			mu.Unlock()
@@ -1457,6 +1808,7 @@ func handleTunnel(conn net.Conn, target, clientAddr string, mode int, firstFrame
 				done <- true
 				return
 			}
+			stats.bytesDown.Add(int64(len(msg)))
 		}
 	}()
 
@@ -1500,6 +1852,7 @@ func handleDirectConnection(conn net.Conn, target, clientAddr string, mode int,
 		if _, err := targetConn.Write([]byte(firstFrame)); err != nil {
 			return err
 		}
+		stats.bytesUp.Add(int64(len(firstFrame)))
 	}
 
 	// 双向转发
@@ -1507,13 +1860,15 @@ func handleDirectConnection(conn net.Conn, target, clientAddr string, mode int,
 
 	// Client -> Target
 	go func() {
-		io.Copy(targetConn, conn)
+		n, _ := io.Copy(targetConn, conn)
+		stats.bytesUp.Add(n)
 		done <- true
 	}()
 
 	// Target -> Client
 	go func() {
-		io.Copy(conn, targetConn)
+		n, _ := io.Copy(conn, targetConn)
+		stats.bytesDown.Add(n)
 		done <- true
 	}()
 
@@ -0,0 +1,75 @@
+package main
+
+import (
+	"errors"
+	"net"
+	"sync/atomic"
+	"testing"
+	"time"
+)
+
+// stubLookup 替换 DNS 解析并重置分流缓存，返回解析调用计数
+func stubLookup(t *testing.T, ips []net.IP, err error) *atomic.Int32 {
+	t.Helper()
+	var calls atomic.Int32
+	oldLookup, oldTTL := lookupIP, routeTTL
+	lookupIP = func(string) ([]net.IP, error) {
+		calls.Add(1)
+		return ips, err
+	}
+	routeTTL = 300
+	routeCacheMu.Lock()
+	routeCache = make(map[string]*routeVerdict)
+	routeCacheMu.Unlock()
+	t.Cleanup(func() { lookupIP, routeTTL = oldLookup, oldTTL })
+	return &calls
+}
+
+// expireSoon 把已缓存结论的剩余时间改为 d
+func expireSoon(host string, d time.Duration) {
+	routeCacheMu.Lock()
+	routeCache[host].expires = time.Now().Add(d)
+	routeCacheMu.Unlock()
+}
+
+func TestRouteFailedVerdictNotPrefetched(t *testing.T) {
+	calls := stubLookup(t, nil, errors.New("no such host"))
+	before := stats.routePrefetches.Load()
+	for i := 0; i < 20; i++ {
+		if direct, _ := lookupRoute("down.example"); direct {
+			t.Fatal("解析失败时应走代理")
+		}
+	}
+	expireSoon("down.example", time.Second) // 低于 routeTTL/10，旧逻辑下会不停预取
+	for i := 0; i < 20; i++ {
+		lookupRoute("down.example")
+	}
+	time.Sleep(50 * time.Millisecond)
+	if n := calls.Load(); n != 1 {
+		t.Fatalf("解析失败的结论被重复解析 %d 次", n)
+	}
+	if n := stats.routePrefetches.Load() - before; n != 0 {
+		t.Fatalf("解析失败的结论触发了 %d 次预取", n)
+	}
+}
+
+func TestRouteHotVerdictPrefetched(t *testing.T) {
+	calls := stubLookup(t, []net.IP{net.ParseIP("192.0.2.1")}, nil)
+	lookupRoute("hot.example")
+	expireSoon("hot.example", time.Second)
+	for i := 0; i < routePrefetchHits; i++ {
+		lookupRoute("hot.example")
+	}
+	for deadline := time.Now().Add(time.Second); calls.Load() < 2 && time.Now().Before(deadline); {
+		time.Sleep(5 * time.Millisecond)
+	}
+	if n := calls.Load(); n != 2 {
+		t.Fatalf("热门域名应预取一次，实际解析 %d 次", n)
+	}
+	routeCacheMu.Lock()
+	left := time.Until(routeCache["hot.example"].expires)
+	routeCacheMu.Unlock()
+	if left < time.Duration(routeTTL-5)*time.Second {
+		t.Fatalf("预取后的结论未续期: 剩余 %v", left)
+	}
+}
@@ -0,0 +1,2286 @@
+"""ECH Workers 客户端核心：优选算法、测速历史、进程管理及无界面运行模式，不依赖 PyQt"""
+import sys
+import json
+import os
+import subprocess
+import time
+import socket
+import atexit
+import threading
+import collections
+import ipaddress
+import random
+import urllib.parse
+import base64
+import contextlib
+import itertools
+import re
+from pathlib import Path
+from datetime import datetime
+
+# ==================== 0. 路径与环境 ====================
+def resource_path(relative_path):
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, relative_path)
+    return os.path.join(os.path.abspath("."), relative_path)
+
+def get_app_path():
+    if getattr(sys, 'frozen', False):
+        return Path(sys.executable).parent
+    return Path(__file__).parent.absolute()
+
+class _LazyModule:
+    """首次访问属性时才导入模块，缩短无界面模式的启动时间"""
+    def __init__(self, name): self._name = name; self._mod = None
+    def __getattr__(self, k):
+        if self._mod is None:
+            import importlib; self._mod = importlib.import_module(self._name)
+        return getattr(self._mod, k)
+
+asyncio = _LazyModule('asyncio'); ssl = _LazyModule('ssl'); statistics = _LazyModule('statistics')
+futures = _LazyModule('concurrent.futures')
+
+APP_ROOT = get_app_path()
+CONFIG_FILE = APP_ROOT / "config.json"
+HISTORY_FILE = APP_ROOT / "probe_history.json"
+GEO_CACHE_FILE = APP_ROOT / "geo_cache.json"
+TRACE_FILE = APP_ROOT / "start_traces.json"
+ICON_PATH = resource_path("icon.ico")
+CORE_EXE_NAME = "ech-workers.exe" if sys.platform == 'win32' else "ech-workers"
+CORE_PATH = APP_ROOT / CORE_EXE_NAME
+
+
+# ==================== 3. 进程管理 ====================
+class ProcessManager:
+    _current_proc = None
+    _pool = {}   # 多核心模式下的附加进程 {槽位: Popen}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start_process(cmd, slot=None):
+        with ProcessManager._lock:
+            if slot is None: ProcessManager._kill_unsafe()
+            else: ProcessManager._kill_proc(ProcessManager._pool.pop(slot, None))
+            try:
+                si = None
+                if sys.platform == 'win32':
+                    si = subprocess.STARTUPINFO(); si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                p = subprocess.Popen(
+                    cmd, 
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, 
+                    stderr=subprocess.STDOUT, 
+                    startupinfo=si, 
+                    bufsize=0,
+                    creationflags=0x08000000 if sys.platform=='win32' else 0
+                )
+                if slot is None: ProcessManager._current_proc = p
+                else: ProcessManager._pool[slot] = p
+                return p
+            except Exception: return None
+
+    @staticmethod
+    def send_ctl(line, slot=None):
+        # 向以 -ctl 启动的核心发送控制命令，成功返回 True
+        with ProcessManager._lock:
+            p = ProcessManager._current_proc if slot is None else ProcessManager._pool.get(slot)
+            if not p or p.poll() is not None or not p.stdin: return False
+            try: p.stdin.write((line.strip() + "\n").encode()); p.stdin.flush(); return True
+            except Exception: return False
+
+    @staticmethod
+    def kill_current():
+        with ProcessManager._lock:
+            ProcessManager._kill_unsafe()
+
+    @staticmethod
+    def _kill_unsafe():
+        ProcessManager._kill_proc(ProcessManager._current_proc); ProcessManager._current_proc = None
+        for k in list(ProcessManager._pool): ProcessManager._kill_proc(ProcessManager._pool.pop(k))
+
+    @staticmethod
+    def _kill_proc(p):
+        if p:
+            try: p.terminate()
+            except: pass
+            if sys.platform == 'win32' and p.pid:
+                try: subprocess.run(['taskkill', '/F', '/T', '/PID', str(p.pid)], 
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=0x08000000)
+                except: pass
+            try: p.kill()
+            except: pass
+
+atexit.register(ProcessManager.kill_current)
+
+# ==================== 4. 注册表/自启 ====================
+class AutoStartManager:
+    KEY_PATH = r"Software\Microsoft\Windows\CurrentVersion\Run"
+    APP_KEY = "ECHWorkersClient"
+    @staticmethod
+    def get_command():
+        if getattr(sys, 'frozen', False): return f'"{sys.executable}" -autostart'
+        return f'"{sys.executable}" "{APP_ROOT / "gui.py"}" -autostart'
+    @staticmethod
+    def set_autostart(enable=True):
+        if sys.platform != 'win32': return
+        import winreg
+        try:
+            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, AutoStartManager.KEY_PATH, 0, winreg.KEY_SET_VALUE)
+            if enable: winreg.SetValueEx(key, AutoStartManager.APP_KEY, 0, winreg.REG_SZ, AutoStartManager.get_command())
+            else: 
+                try: winreg.DeleteValue(key, AutoStartManager.APP_KEY)
+                except: pass
+            winreg.CloseKey(key)
+        except: pass
+    @staticmethod
+    def check_status():
+        if sys.platform != 'win32': return False
+        import winreg
+        try:
+            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, AutoStartManager.KEY_PATH, 0, winreg.KEY_READ)
+            val, _ = winreg.QueryValueEx(key, AutoStartManager.APP_KEY)
+            winreg.CloseKey(key); return True if val else False
+        except: return False
+
+# ==================== 5. 核心算法 ====================
+class Tracer:
+    """记录一次启动/停止周期内各阶段的耗时区间，可导出为 Chrome trace-event JSON (chrome://tracing / Perfetto)
+    track 为时间线名称，缺省为当前线程名；由核心日志解析出的区间记在 core / core#N 上"""
+    MAX_EVENTS = 5000
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled; self.t0 = time.perf_counter(); self.wall = time.time()
+        self.events = []; self.open = {}; self.done = set(); self.tracks = {}; self.dropped = 0; self._lock = threading.Lock()
+
+    def now(self): return int((time.perf_counter() - self.t0) * 1e6)
+
+    @staticmethod
+    def _track(track): return track or threading.current_thread().name
+
+    def _add(self, ev, track):
+        # 调用方持锁；超过上限只计数，避免大规模扫描时追踪本身占用过多内存
+        if len(self.events) >= self.MAX_EVENTS: self.dropped += 1; return
+        ev['tid'] = self.tracks.setdefault(track, len(self.tracks) + 1); self.events.append(ev)
+
+    def complete(self, name, ts, dur, cat="start", track=None, **args):
+        if not self.enabled: return
+        with self._lock: self._add({"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": 1, "args": args}, self._track(track))
+
+    @contextlib.contextmanager
+    def _span(self, name, cat, track, args):
+        ts = self.now()
+        try: yield args
+        finally: self.complete(name, ts, self.now() - ts, cat, track, **args)
+
+    def span(self, name, cat="start", track=None, **args):
+        """with tr.span("probe", n=10) as a: ...; 可在块内向 a 写入附加参数"""
+        return self._span(name, cat, self._track(track), args) if self.enabled else contextlib.nullcontext(args)
+
+    def begin(self, name, cat="start", track=None, once=False, **args):
+        if not self.enabled: return
+        key = (name, self._track(track))
+        with self._lock:
+            if key in self.open or (once and key in self.done): return
+            self.open[key] = (self.now(), cat, args)
+
+    def end(self, name, track=None, **args):
+        """结束 begin 打开的区间，返回毫秒数；未打开时返回 None"""
+        if not self.enabled: return None
+        key = (name, self._track(track))
+        with self._lock:
+            b = self.open.pop(key, None)
+            if b is None: return None
+            ts, cat, a = b; dur = self.now() - ts; self.done.add(key)
+            self._add({"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": 1, "args": {**a, **args}}, key[1])
+        return dur / 1000
+
+    def instant(self, name, track=None, **args):
+        if not self.enabled: return
+        with self._lock: self._add({"name": name, "cat": "mark", "ph": "i", "s": "t", "ts": self.now(), "pid": 1, "args": args}, self._track(track))
+
+    def close(self):
+        for name, track in list(self.open): self.end(name, track, unfinished=True)
+
+    def phases(self):
+        """按阶段名汇总耗时 (ms)；探测类事件 (cat=probe) 并发执行，只统计次数与最大值"""
+        out = {}
+        with self._lock: evs = [e for e in self.events if e['ph'] == 'X']
+        for e in evs:
+            ms = e['dur'] / 1000
+            if e['cat'] == 'probe':
+                out[f"{e['name']}.n"] = out.get(f"{e['name']}.n", 0) + 1; out[f"{e['name']}.max"] = max(out.get(f"{e['name']}.max", 0), ms)
+            else: out[e['name']] = out.get(e['name'], 0) + ms
+        return {k: round(v, 1) for k, v in out.items()}
+
+    def chrome(self, label=""):
+        with self._lock:
+            meta = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": label or "ech"}}]
+            meta += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": t, "args": {"name": n}} for n, t in self.tracks.items()]
+            return {"traceEvents": meta + list(self.events), "displayTimeUnit": "ms",
+                    "otherData": {"start": datetime.fromtimestamp(self.wall).isoformat(timespec='seconds'), "dropped": self.dropped}}
+
+NOTRACE = Tracer(enabled=False)
+
+class TraceStore:
+    """最近 keep 次启动的追踪记录 [{time, label, total, phases, trace}]，用于导出与前后对比"""
+    def __init__(self, path=TRACE_FILE, keep=20):
+        self.path = Path(path); self.keep = keep; self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: self.items = json.load(f)
+        except: self.items = []
+
+    def add(self, tracer, label=""):
+        tracer.close()
+        e = {"time": datetime.fromtimestamp(tracer.wall).isoformat(timespec='seconds'), "label": label,
+             "total": round((time.perf_counter() - tracer.t0) * 1000, 1), "phases": tracer.phases(), "trace": tracer.chrome(label)}
+        with self._lock:
+            self.items.append(e); del self.items[:-max(1, self.keep)]
+            d = json.dumps(self.items, ensure_ascii=False)
+        try: ConfigManager._write(self.path, d)
+        except OSError: pass
+        return e
+
+    def export(self, path, idx=-1):
+        with open(path, 'w', encoding='utf-8') as f: json.dump(self.items[idx]['trace'], f, ensure_ascii=False)
+
+    def compare(self, a=-2, b=-1):
+        """两次启动的逐阶段耗时对比 (默认上一次与最近一次)，返回文本行列表"""
+        A, B = self.items[a], self.items[b]; fmt = lambda v: "--" if v is None else f"{v:.0f}"
+        lines = [f"{'阶段':<18}{A['time'][5:]:>16}{B['time'][5:]:>16}{'变化':>8}"]
+        for k in dict.fromkeys([*A['phases'], *B['phases']]):
+            va, vb = A['phases'].get(k), B['phases'].get(k)
+            lines.append(f"{k:<18}{fmt(va):>16}{fmt(vb):>16}{(f'{vb - va:+.0f}' if None not in (va, vb) else ''):>8}")
+        return lines
+
+class Resolver:
+    """测速共用的 DNS 缓存: 域名 -> 全部 A/AAAA 地址，ttl 秒后过期 (解析失败缓存 neg_ttl 秒)，最多保留 max_hosts 个域名
+    getaddrinfo 不返回记录 TTL，ttl 为统一上限；同一域名的并发解析只发起一次"""
+    def __init__(self, ttl=300, neg_ttl=30, max_hosts=4096):
+        self.ttl = ttl; self.neg_ttl = neg_ttl; self.max_hosts = max_hosts; self.hits = self.misses = 0
+        self._cache = collections.OrderedDict(); self._inflight = {}; self._lock = threading.Lock()
+
+    @staticmethod
+    def key(host): return host.lower().rstrip(".")
+
+    def get(self, host):
+        """已缓存且未过期时返回 (地址列表, 解析耗时 ms)，否则返回 None"""
+        host = self.key(host)
+        with self._lock:
+            e = self._cache.get(host)
+            if e and e[0] > time.monotonic(): self._cache.move_to_end(host); self.hits += 1; return e[1], e[2]
+        return None
+
+    def resolve(self, host):
+        """阻塞解析，返回 (地址列表, 解析耗时 ms)；解析失败时地址列表为空"""
+        if (r := self.get(host)) is not None: return r
+        host = self.key(host)
+        with self._lock:
+            ev = self._inflight.get(host); owner = ev is None
+            if owner: ev = self._inflight[host] = threading.Event(); self.misses += 1
+        if not owner: ev.wait(); return self.get(host) or ([], 0.0)
+        t0 = time.perf_counter()
+        try: addrs = list(dict.fromkeys(i[4][0] for i in socket.getaddrinfo(host, None, socket.AF_UNSPEC, socket.SOCK_STREAM)))
+        except (OSError, UnicodeError): addrs = []
+        ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            self._cache[host] = (time.monotonic() + (self.ttl if addrs else self.neg_ttl), addrs, ms); self._cache.move_to_end(host)
+            while len(self._cache) > self.max_hosts: self._cache.popitem(last=False)
+            del self._inflight[host]
+        ev.set(); return addrs, ms
+
+    async def aresolve(self, host, timeout=None):
+        if (r := self.get(host)) is not None: return r
+        return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, self.resolve, host), timeout)
+
+    def prefetch(self, hosts, workers=32):
+        """并发解析一批域名，返回 {域名: (地址列表, 耗时 ms)}"""
+        hosts = list(dict.fromkeys(map(self.key, hosts)))
+        if len(hosts) <= 1: return {h: self.resolve(h) for h in hosts}
+        with futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts)))) as ex:
+            return dict(zip(hosts, ex.map(self.resolve, hosts)))
+
+class Anytime:
+    """随时可取结果的测速汇总: 每个探测完成即计入并更新领先者 (leader 回调按 interval 秒节流)
+    已有 good_k 个候选不超过 good_ms、全部候选都已开始探测，且最后开始的探测也已进行 good_ms 时置位 enough：
+    此时仍未完成的探测不可能进入前 good_k 名，调用方据此提前结束并立即取消它们
+    total 为预计的探测数 (expect 累加，close 后不再增加)，每个探测真正开始连接时调用 begin"""
+    POLL = 0.02  # 已满足 good_k 后检查是否可以结束的间隔 (秒)
+
+    def __init__(self, good_ms=0, good_k=0, leader=None, interval=0.25):
+        self.good_ms = good_ms; self.good_k = good_k; self.leader = leader; self.interval = interval
+        self.results = []; self.best = None; self.good = 0; self.enough = False; self.cut = 0
+        self.total = self.started = 0; self.closed = False; self.last = 0.0; self._lk = threading.Lock()
+        self._shown = 0.0; self._hit = False
+
+    def expect(self, n=1):
+        with self._lk: self.total += n
+
+    def close(self): self.closed = True
+
+    def begin(self):
+        with self._lk: self.started += 1; self.last = time.monotonic()
+
+    @property
+    def hit(self): return self.good_ms > 0 and 0 < self.good_k <= self.good
+
+    def add(self, res):
+        moved = False
+        for t, lat in (res if isinstance(res, list) else [res]):
+            self.results.append((t, lat))
+            if lat >= 5000: continue
+            if self.best is None or lat < self.best[1]: self.best = (t, lat); moved = True
+            if lat <= self.good_ms: self.good += 1
+        first = self.hit and not self._hit; self._hit = self._hit or first
+        if moved and self.leader and (first or time.monotonic() - self._shown >= self.interval):
+            self._shown = time.monotonic(); self.leader(*self.best, len(self.results))
+
+    def due(self, left=None):
+        """下一次检查前最多等待的秒数 (None 为不限)；可以提前结束时置位 enough 并返回 0"""
+        if self.hit:
+            with self._lk: all_started = self.closed and self.started >= self.total; last = self.last
+            if all_started and (s := last + self.good_ms / 1000 - time.monotonic()) <= 0:
+                self.enough = True; return 0
+            wait = max(0.0, s) if all_started else self.POLL
+            left = wait if left is None else min(left, wait)
+        return left
+
+    def watch(self, task):
+        task.add_done_callback(lambda t: None if t.cancelled() or t.exception() else self.add(t.result())); return task
+
+    async def wait(self, tasks, deadline=None):
+        """等待任务全部完成、enough 或超过 deadline 秒，未完成的任务立即取消"""
+        loop = asyncio.get_running_loop(); end = loop.time() + deadline if deadline else None; pending = set(tasks)
+        while pending:
+            left = None if end is None else end - loop.time()
+            if left is not None and left <= 0: break
+            if (t := self.due(left)) == 0: break
+            _, pending = await asyncio.wait(pending, timeout=t, return_when=asyncio.FIRST_COMPLETED)
+        for t in pending: t.cancel()
+        if pending: await asyncio.gather(*pending, return_exceptions=True)
+        self.cut += len(pending)
+
+class SmartSelector:
+    FAIL = 99999
+    trace = NOTRACE  # 当前启动周期的 Tracer，由 CoreRunner 设置
+    resolver = Resolver()  # 测速共用的 DNS 缓存
+    # 探测参数默认值，可被配置方案中的 "probe" 字段覆盖
+    # engine: async(非阻塞并发) / thread(线程池回退)；deadline: 整轮扫描的全局截止时间(秒)
+    # top_k/samples/retest_timeout/sample_gap: 复测阶段；fast_ms: 首轮低于该延迟且单独确认无丢包时跳过完整复测
+    # tail_weight/loss_penalty/timeout_penalty: 复测评分权重 (毫秒)
+    DEFAULTS = {"engine": "async", "concurrency": 256, "timeout": 1.0, "deadline": 10.0,
+                "top_k": 5, "samples": 3, "retest_timeout": 1.5, "sample_gap": 0.05, "fast_ms": 15,
+                "tail_weight": 0.5, "loss_penalty": 300, "timeout_penalty": 200,
+                "probe_budget": 2000, "cidr_samples": 2, "dual_stack": True, "dns_workers": 32,
+                "good_ms": 120, "good_k": 5,
+                "mode": "tcp", "hs_top": 8, "hs_samples": 2, "hs_timeout": 3.0, "tls_verify": True, "cafile": None,
+                "server": "", "token": "",
+                "bw_top": 0, "bw_url": "https://speed.cloudflare.com/__down?bytes=8000000", "bw_bytes": 4 << 20,
+                "bw_total": 16 << 20, "bw_time": 3.0, "bw_weight": 0.5}
+    # probe_budget: CIDR/地址段自适应搜索的总探测次数上限；cidr_samples: 首轮每个 /24 的采样数
+    # dual_stack: 域名候选同时展开 AAAA 地址 (关闭时只保留 IPv4)；dns_workers: 测速前并发解析域名的线程数
+    # good_ms/good_k: 首轮已有 good_k 个候选不超过 good_ms 时提前结束并取消其余探测 (good_ms 为 0 关闭)
+    # mode: tcp(仅 TCP 连接) / handshake(TCP 初筛后对前 hs_top 个按 TCP+TLS+WebSocket 升级总耗时排序)
+    # server/token: 握手测速使用的 Worker 地址 (host[:port][/path]) 与令牌，由工作线程按当前方案填入
+    # bw_top: 对评分前 N 名做带宽测试 (0 关闭)；bw_url: 测速下载地址 (http/https)；bw_bytes/bw_time: 单个候选的字节/时间上限
+    # bw_total: 所有候选合计字节上限；bw_weight: 吞吐量权重，评分乘以 (最快吞吐/本候选吞吐)^bw_weight
+
+    @staticmethod
+    def parse_list(ip_text):
+        # 文本或逐行可迭代对象；完全相同的行只保留一个
+        lines = ip_text.split('\n') if isinstance(ip_text, str) else ip_text
+        return list(dict.fromkeys(t for l in lines if (t := l.strip()) and not t.startswith("#")))
+
+    HOST_RE = re.compile(r"^(?=.*[a-z])[a-z0-9-]+(\.[a-z0-9-]+)+$")
+    SEP_RE = re.compile(r"[\s,;|]+")
+
+    @staticmethod
+    def normalize(token):
+        """规范化单个候选: IP 统一格式 (443 端口省略)，CIDR 取网络地址，域名转小写；无法识别时返回 None"""
+        if b := SmartSelector.parse_block(token):
+            s, e, ver, port = b; A = ipaddress.IPv4Address if ver == 4 else ipaddress.IPv6Address
+            nets = list(ipaddress.summarize_address_range(A(s), A(e)))
+            body = str(nets[0]) if len(nets) == 1 else f"{A(s)}-{A(e)}"
+            return body if port == 443 else f"[{body}]:{port}" if ver == 6 else f"{body}:{port}"
+        host, port = SmartSelector.split_target(token)
+        try: a = ipaddress.ip_address(host); return SmartSelector.fmt_addr(int(a), a.version, port)
+        except ValueError: pass
+        host = host.lower().rstrip(".")
+        if not SmartSelector.HOST_RE.match(host) or not 0 < port < 65536: return None
+        return host if port == 443 else f"{host}:{port}"
+
+    @staticmethod
+    def normalize_line(line):
+        # 一行中可能有多个候选 (空格/逗号分隔，如测速工具导出的 CSV)，# 之后为注释
+        for tok in SmartSelector.SEP_RE.split(line.split("#", 1)[0]):
+            if tok and (c := SmartSelector.normalize(tok)): yield c
+
+    @staticmethod
+    def split_target(target, port=443):
+        # 支持 host / host:port / [v6]:port / 裸 IPv6
+        if target.startswith("["):
+            host, _, rest = target[1:].partition("]")
+            if rest.startswith(":") and rest[1:].isdigit(): port = int(rest[1:])
+            return host, port
+        if target.count(":") == 1:
+            host, p = target.rsplit(":", 1)
+            if p.isdigit(): return host, int(p)
+        return target, port
+
+    @staticmethod
+    def parse_block(line):
+        """解析 CIDR (104.16.0.0/13[:port]) 或地址段 (a-b / 1.2.3.10-50)，返回 (起始, 结束, 版本, 端口)；普通目标返回 None"""
+        body, port = line, 443
+        if body.startswith("["):
+            body, _, rest = body[1:].partition("]")
+            if rest.startswith(":") and rest[1:].isdigit(): port = int(rest[1:])
+        elif body.count(":") == 1:
+            b, p = body.rsplit(":", 1)
+            if p.isdigit(): body, port = b, int(p)
+        try:
+            if "/" in body:
+                n = ipaddress.ip_network(body.strip(), strict=False)
+                return int(n.network_address), int(n.broadcast_address), n.version, port
+            if "-" in body:
+                a, b = (x.strip() for x in body.split("-", 1)); start = ipaddress.ip_address(a)
+                if b.isdigit() and start.version == 4 and int(b) < 256: end = ipaddress.IPv4Address(int(start) & ~0xff | int(b))
+                else: end = ipaddress.ip_address(b)
+                if end.version == start.version and int(end) >= int(start): return int(start), int(end), start.version, port
+        except ValueError: pass
+        return None
+
+    @staticmethod
+    def fmt_addr(n, ver, port=443):
+        a = ipaddress.IPv4Address(n) if ver == 4 else ipaddress.IPv6Address(n)
+        if ver == 6: return f"[{a}]:{port}"
+        return str(a) if port == 443 else f"{a}:{port}"
+
+    @staticmethod
+    def split_blocks(lines):
+        raw, blocks = [], []
+        for l in lines:
+            b = SmartSelector.parse_block(l)
+            (blocks if b else raw).append(b or l)
+        return raw, blocks
+
+    @staticmethod
+    def matcher(ip_text):
+        """返回判断目标是否属于该列表 (含 CIDR/地址段) 的函数；历史记录保存的是域名展开后的地址，域名候选按其解析结果匹配"""
+        raw, blocks = SmartSelector.split_blocks(SmartSelector.parse_list(ip_text)); lits = set(raw) | set(SmartSelector.expand(raw))
+        def match(t):
+            if t in lits: return True
+            host, port = SmartSelector.split_target(t)
+            try: n = int(ipaddress.ip_address(host))
+            except ValueError: return False
+            return any(s <= n <= e and p == port for s, e, _, p in blocks)
+        return match
+
+    @staticmethod
+    def search_blocks(blocks, o, callback_msg=None):
+        """在大网段中自适应搜索: 首轮每个 /24 (IPv6 为 /120) 采样少量地址，之后每轮保留较快的一半网段并加倍采样，
+        总探测数不超过 probe_budget；返回全部探测结果 [(target, lat)]"""
+        budget, per, rng = o['probe_budget'], max(1, o['cidr_samples']), random.Random()
+        sizes = [(e >> 8) - (s >> 8) + 1 for s, e, _, _ in blocks]; total = sum(sizes)
+        n0 = max(len(blocks), budget // (2 * per))
+        live = []
+        for i, nb in enumerate(sizes):
+            k = min(nb, max(1, round(n0 * nb / total)))
+            picks = rng.sample(range(nb), k) if nb <= 1 << 30 else list({rng.randrange(nb) for _ in range(k)})
+            live += [(i, j) for j in picks]
+        results, used, rnd = {}, 0, 0
+        while live and used < budget:
+            quota = per << rnd; owner = {}
+            for bi, j in live:
+                s, e, ver, port = blocks[bi]
+                base = ((s >> 8) + j) << 8; lo, hi = max(s, base), min(e, base | 0xff); span = hi - lo + 1
+                pool = range(lo, hi + 1) if span <= quota * 2 else (lo + rng.randrange(span) for _ in range(quota * 3))
+                picked = 0
+                for n in pool:
+                    t = SmartSelector.fmt_addr(n, ver, port)
+                    if t in results or t in owner: continue
+                    owner[t] = (bi, j); picked += 1
+                    if picked >= quota: break
+            targets = list(owner)[:budget - used]
+            if not targets: break
+            if callback_msg: callback_msg(f"网段测速 第{rnd + 1}轮 ({len(live)} 段)...")
+            res = SmartSelector.probe_many(targets, 443, o['timeout'], o['concurrency'], o['deadline'], o['engine'])
+            used += len(targets); best = {}
+            for t, lat in res:
+                results[t] = lat
+                if lat < 5000: best[owner[t]] = min(best.get(owner[t], lat), lat)
+            ranked = sorted(best, key=best.get)
+            if len(ranked) <= 1 and rnd > 0: break
+            live = ranked[:max(1, (len(ranked) + 1) // 2)]; rnd += 1
+        return list(results.items())
+
+    @staticmethod
+    def is_ip(host):
+        try: ipaddress.ip_address(host); return True
+        except ValueError: return False
+
+    @staticmethod
+    def _addr(host):
+        # 连接地址: IP 字面量直接使用，域名取共享缓存中的第一个地址 (未缓存时解析，不计入延迟)
+        if SmartSelector.is_ip(host): return host
+        if (r := SmartSelector.resolver.get(host)) is None:
+            with SmartSelector.trace.span("dns", "probe", host=host): r = SmartSelector.resolver.resolve(host)
+        if not r[0]: raise socket.gaierror(socket.EAI_NONAME, f"无法解析 {host}")
+        return r[0][0]
+
+    @staticmethod
+    def addr_targets(addrs, port, o):
+        # 解析结果 -> 候选目标 (保留端口)；dual_stack 关闭时丢弃 IPv6 地址
+        out = []
+        for a in addrs:
+            ip = ipaddress.ip_address(a.split("%")[0])
+            if ip.version == 4 or o['dual_stack']: out.append(SmartSelector.fmt_addr(int(ip), ip.version, port))
+        return out
+
+    @staticmethod
+    def cached_targets(t, o=None):
+        # 域名候选在解析缓存中的地址候选 (未缓存或解析失败时为空，不触发解析)；IP 候选返回自身
+        h, port = SmartSelector.split_target(t)
+        if SmartSelector.is_ip(h): return [t]
+        r = SmartSelector.resolver.get(h)
+        return SmartSelector.addr_targets(r[0], port, {**SmartSelector.DEFAULTS, **(o or {})}) if r else []
+
+    @staticmethod
+    def expand(targets, o=None, dns=None):
+        """把域名候选展开为全部 A/AAAA 地址，每个地址作为独立候选；域名在测速前并发解析 (共享缓存)
+        dns 字典记录 {域名: (地址数, 解析耗时 ms)}，解析时间不计入连接延迟；解析失败的域名原样保留"""
+        o = {**SmartSelector.DEFAULTS, **(o or {})}
+        split = {t: SmartSelector.split_target(t) for t in targets}
+        names = [h for h, _ in split.values() if not SmartSelector.is_ip(h)]
+        if not names: return list(targets)
+        with SmartSelector.trace.span("resolve", "select", hosts=len(names)) as a:
+            res = SmartSelector.resolver.prefetch(names, o['dns_workers']); out = []
+            for t, (h, port) in split.items():
+                if SmartSelector.is_ip(h): out.append(t); continue
+                addrs, ms = res[Resolver.key(h)]; exp = SmartSelector.addr_targets(addrs, port, o)
+                if dns is not None: dns[Resolver.key(h)] = (len(exp), round(ms, 1))
+                out += exp or [t]
+            out = list(dict.fromkeys(out)); a['addrs'] = len(out)
+        return out
+
+    @staticmethod
+    def _connect(target, port=443, timeout=1.0):
+        # 阻塞 connect，返回毫秒延迟；失败时抛出异常 (socket.timeout 表示超时)
+        real_host, real_port = SmartSelector.split_target(target, port)
+        ip = SmartSelector._addr(real_host)
+        with socket.socket(socket.AF_INET6 if ":" in ip else socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            t0 = time.perf_counter()
+            s.connect((ip, real_port))
+            return (time.perf_counter() - t0) * 1000
+
+    @staticmethod
+    def tcp_ping(target, port=443, timeout=1.0):
+        try: return (target, SmartSelector._connect(target, port, timeout))
+        except: return (target, SmartSelector.FAIL)
+
+    @staticmethod
+    async def _aopen(target, port, timeout):
+        # 非阻塞 connect：解析在 loop 的执行器中完成，计时只覆盖 connect 本身；返回 (socket, 毫秒)
+        loop = asyncio.get_running_loop()
+        host, real_port = SmartSelector.split_target(target, port)
+        if SmartSelector.is_ip(host): ip = host  # IP 字面量无需解析
+        else:
+            if (r := SmartSelector.resolver.get(host)) is None:
+                with SmartSelector.trace.span("dns", "probe", host=host): r = await SmartSelector.resolver.aresolve(host, timeout)
+            if not r[0]: raise socket.gaierror(socket.EAI_NONAME, f"无法解析 {host}")
+            ip = r[0][0]
+        addr = (ip, real_port)
+        s = socket.socket(socket.AF_INET6 if ":" in ip else socket.AF_INET, socket.SOCK_STREAM); s.setblocking(False)
+        try:
+            t0 = time.perf_counter()
+            await asyncio.wait_for(loop.sock_connect(s, addr), timeout)
+            return s, (time.perf_counter() - t0) * 1000
+        except BaseException: s.close(); raise
+
+    @staticmethod
+    async def _aconnect(target, port, timeout):
+        s, lat = await SmartSelector._aopen(target, port, timeout)
+        s.close(); return lat
+
+    @staticmethod
+    async def _aping(target, port, timeout, sem, acc=None):
+        async with sem:
+            if acc: acc.begin()
+            try: return (target, await SmartSelector._aconnect(target, port, timeout))
+            except Exception: return (target, SmartSelector.FAIL)
+
+    @staticmethod
+    async def _aprobe_many(targets, port, timeout, concurrency, deadline, acc=None):
+        acc = acc or Anytime(); sem = asyncio.Semaphore(max(1, concurrency)); acc.expect(len(targets)); acc.close()
+        tasks = [acc.watch(asyncio.ensure_future(SmartSelector._aping(t, port, timeout, sem, acc))) for t in targets]
+        if not tasks: return []
+        await acc.wait(tasks, deadline)
+        return acc.results
+
+    @staticmethod
+    def probe_stream(lines, o, skip=None, callback_msg=None, dns=None, acc=None):
+        """边读取边测速: lines 为逐行产出候选的迭代器 (可能来自网络下载)，在后台线程中读取，每批候选立即加入探测
+        域名候选解析后对全部地址测速 (解析耗时记入 dns，见 expand)；acc (Anytime) 只有在读完全部候选后才可能提前结束
+        返回 (已探测目标, 地址段, [(target, lat)], 被历史跳过的数量)"""
+        acc = acc or Anytime(); stop = threading.Event()
+        async def run():
+            loop = asyncio.get_running_loop(); q = asyncio.Queue(); sem = asyncio.Semaphore(max(1, o['concurrency']))
+            def post(x):
+                try: loop.call_soon_threadsafe(q.put_nowait, x)
+                except RuntimeError: pass  # 事件循环已结束
+            def feed():
+                batch = []
+                try:
+                    for l in lines:
+                        if stop.is_set(): continue  # 测速已结束: 继续读完来源以便外置缓存完整写入，但不再测速
+                        batch.append(l)
+                        if len(batch) >= 256: post(batch); batch = []
+                    if batch and not stop.is_set(): post(batch)
+                finally: post(None)
+            threading.Thread(target=feed, daemon=True, name="cand_reader").start()
+            raw, blocks, skipped, tasks, shown = [], [], [], [], time.monotonic()
+            async def ping_name(t):
+                h, port = SmartSelector.split_target(t)
+                try: addrs, ms = await SmartSelector.resolver.aresolve(h, o['timeout'] * 2)
+                except asyncio.TimeoutError: addrs, ms = [], o['timeout'] * 2000
+                exp = SmartSelector.addr_targets(addrs, port, o)
+                if dns is not None: dns[Resolver.key(h)] = (len(exp), round(ms, 1))
+                if skip: exp = [x for x in exp if not skip(x)] or exp  # 历史按地址记录，域名解析后再跳过长期失败的地址
+                exp = exp or [t]; acc.expect(len(exp) - 1)  # 域名先按 1 个探测计入，解析后补足
+                return await asyncio.gather(*(SmartSelector._aping(x, 443, o['timeout'], sem, acc) for x in exp))
+            def ping(t):
+                acc.expect()
+                return acc.watch(asyncio.ensure_future(SmartSelector._aping(t, 443, o['timeout'], sem, acc) if SmartSelector.is_ip(SmartSelector.split_target(t)[0]) else ping_name(t)))
+            while (batch := await q.get()) is not None:
+                r, b = SmartSelector.split_blocks(batch); blocks += b
+                for t in r:
+                    if skip and skip(t): skipped.append(t)
+                    else: raw.append(t); tasks.append(ping(t))
+                if callback_msg and time.monotonic() - shown >= 1: shown = time.monotonic(); callback_msg(f"正在测速 ({len(raw)}，读取中)...")
+            if not raw and skipped: raw, skipped = skipped, []; tasks = [ping(t) for t in raw]  # 全部被跳过时仍然测速
+            acc.close()
+            if callback_msg and raw: callback_msg(f"正在测速 ({len(raw)})...")
+            if not tasks: return raw, blocks, [], len(skipped)
+            await acc.wait(tasks, o['deadline'])
+            return raw, blocks, acc.results, len(skipped)
+        try: return asyncio.run(run())
+        finally: stop.set()
+
+    @staticmethod
+    def _probe_threaded(targets, port, timeout, workers, deadline, acc=None):
+        acc = acc or Anytime(); acc.expect(len(targets)); acc.close()
+        def ping(ip): acc.begin(); return SmartSelector.tcp_ping(ip, port, timeout)
+        ex = futures.ThreadPoolExecutor(max_workers=max(1, min(len(targets), workers)))
+        f_map = [ex.submit(ping, ip) for ip in targets]; pending = set(f_map)
+        end = None if deadline is None else time.monotonic() + deadline
+        try:
+            while pending:
+                left = None if end is None else end - time.monotonic()
+                if left is not None and left <= 0: break
+                if (t := acc.due(left)) == 0: break
+                done, pending = futures.wait(pending, timeout=t, return_when=futures.FIRST_COMPLETED)
+                for f in done:
+                    try: acc.add(f.result())
+                    except Exception: pass
+        finally:
+            acc.cut += sum(1 for f in f_map if not f.done())
+            ex.shutdown(wait=False, cancel_futures=True)
+        return acc.results
+
+    @staticmethod
+    def probe_many(targets, port=443, timeout=1.0, concurrency=256, deadline=None, engine="async", acc=None):
+        """批量 TCP 测速，返回 [(target, lat)]；超过 deadline 或 acc 已满足提前结束条件时，未完成的目标不出现在结果中"""
+        if engine == "async":
+            try: return asyncio.run(SmartSelector._aprobe_many(targets, port, timeout, concurrency, deadline, acc))
+            except Exception: pass  # 事件循环不可用时回退到线程池
+        return SmartSelector._probe_threaded(targets, port, timeout, min(concurrency, 64), deadline, acc)
+
+    @staticmethod
+    def _pct(vals, q):
+        # 线性插值分位数，vals 需已排序
+        if len(vals) == 1: return vals[0]
+        k = (len(vals) - 1) * q; i = int(k)
+        return vals[i] + (vals[min(i + 1, len(vals) - 1)] - vals[i]) * (k - i)
+
+    @staticmethod
+    def score_samples(target, samples, fails=0, timeouts=0, o=None):
+        """复测评分: p50 + 尾延迟权重*(p90-p50) + 丢包惩罚 + 超时惩罚，返回评分明细；全部失败时返回 None"""
+        o = {**SmartSelector.DEFAULTS, **(o or {})}
+        ok = sorted(samples); total = len(ok) + fails + timeouts
+        if not ok: return None
+        p50, p90 = SmartSelector._pct(ok, 0.5), SmartSelector._pct(ok, 0.9)
+        loss = (fails + timeouts) / total; to_ratio = timeouts / total
+        score = p50 + o['tail_weight'] * (p90 - p50) + o['loss_penalty'] * loss + o['timeout_penalty'] * to_ratio
+        return {"target": target, "p50": round(p50, 1), "p90": round(p90, 1), "avg": round(statistics.mean(ok), 1),
+                "jitter": round(statistics.pstdev(ok), 1), "loss": round(loss, 3), "timeouts": timeouts,
+                "samples": total, "score": round(score, 1)}
+
+    @staticmethod
+    def _sample_blocking(target, port, n, timeout, gap):
+        ok, fails, tos = [], 0, 0
+        for i in range(n):
+            try: ok.append(SmartSelector._connect(target, port, timeout))
+            except socket.timeout: tos += 1
+            except Exception: fails += 1
+            if i < n - 1: time.sleep(gap)
+        return ok, fails, tos
+
+    @staticmethod
+    async def _asample(target, port, n, timeout, gap, sem):
+        ok, fails, tos = [], 0, 0
+        for i in range(n):
+            async with sem:
+                try: ok.append(await SmartSelector._aconnect(target, port, timeout))
+                except asyncio.TimeoutError: tos += 1
+                except Exception: fails += 1
+            if i < n - 1: await asyncio.sleep(gap)
+        return ok, fails, tos
+
+    @staticmethod
+    def retest(top, o):
+        """并发复测 [(target, 首轮延迟或 None)]，每个候选内部串行采样；返回按评分升序的明细列表"""
+        n, to, gap = o['samples'], o['retest_timeout'], o['sample_gap']
+        targets = [t for t, _ in top]
+        async def run():
+            sem = asyncio.Semaphore(max(1, o['concurrency']))
+            return await asyncio.gather(*[SmartSelector._asample(t, 443, n, to, gap, sem) for t in targets])
+        raw = None
+        if o['engine'] == "async":
+            try: raw = asyncio.run(run())
+            except Exception: pass
+        if raw is None:
+            with futures.ThreadPoolExecutor(max_workers=max(1, min(len(targets), 64))) as ex:
+                raw = list(ex.map(lambda t: SmartSelector._sample_blocking(t, 443, n, to, gap), targets))
+        scored = []
+        for (t, first), (ok, fails, tos) in zip(top, raw):
+            r = SmartSelector.score_samples(t, ([first] if first is not None else []) + ok, fails, tos, o)
+            if r: scored.append(r)
+        scored.sort(key=lambda x: x['score'])
+        return scored
+
+    @staticmethod
+    def parse_server(server):
+        # 与核心 parseServerAddr 一致: host:port/path，端口缺省 443
+        server, path = server.strip(), "/"
+        if "/" in server: server, path = server.split("/", 1); path = "/" + path
+        host, port = SmartSelector.split_target(server, 443)
+        return host, port, path
+
+    @staticmethod
+    def tls_context(o):
+        ctx = ssl.create_default_context(cafile=o.get('cafile') or None)
+        ctx.minimum_version = ssl.TLSVersion.TLSv1_3  # 与核心一致
+        if not o.get('tls_verify', True): ctx.check_hostname = False; ctx.verify_mode = ssl.CERT_NONE
+        return ctx
+
+    @staticmethod
+    async def _ahandshake(target, o, ctx):
+        """经 target 建立到 Worker 的隧道，分别计时 TCP 连接、TLS 握手 (SNI=Worker 域名) 与 WebSocket 升级"""
+        host, port, path = SmartSelector.parse_server(o['server']); to = o['hs_timeout']
+        s, tcp = await SmartSelector._aopen(target, port, to)
+        writer = None
+        try:
+            t0 = time.perf_counter()
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(sock=s, ssl=ctx, server_hostname=host), to)
+            tls = (time.perf_counter() - t0) * 1000
+            key = base64.b64encode(os.urandom(16)).decode()
+            req = (f"GET {path} HTTP/1.1\r\nHost: {host if port == 443 else f'{host}:{port}'}\r\nUpgrade: websocket\r\n"
+                   f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+                   + (f"Sec-WebSocket-Protocol: {o['token']}\r\n" if o.get('token') else "") + "\r\n")
+            t0 = time.perf_counter(); writer.write(req.encode())
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), to)
+            ws = (time.perf_counter() - t0) * 1000
+            status = head.split(b" ", 2)[1] if b" " in head else b""
+            if status != b"101": raise ConnectionError(f"WebSocket 升级失败: HTTP {status.decode(errors='replace')}")
+            return {"tcp": tcp, "tls": tls, "ws": ws, "total": tcp + tls + ws}
+        finally:
+            if writer: writer.close()
+            else: s.close()
+
+    @staticmethod
+    def handshake_rank(top, o):
+        """对 TCP 初筛后的候选做握手级测速，按首个可用隧道的总耗时评分；返回按评分升序的明细列表"""
+        ctx = SmartSelector.tls_context(o)
+        async def one(t, sem):
+            ok, fails, tos, parts = [], 0, 0, []
+            for i in range(max(1, o['hs_samples'])):
+                async with sem:
+                    try: r = await SmartSelector._ahandshake(t, o, ctx); ok.append(r['total']); parts.append(r)
+                    except asyncio.TimeoutError: tos += 1
+                    except Exception: fails += 1
+            return t, ok, fails, tos, parts
+        async def run():
+            sem = asyncio.Semaphore(max(1, min(o['concurrency'], 64)))
+            return await asyncio.gather(*[one(t, sem) for t, _ in top])
+        scored = []
+        for t, ok, fails, tos, parts in asyncio.run(run()):
+            r = SmartSelector.score_samples(t, ok, fails, tos, o)
+            if not r: continue
+            for k in ("tcp", "tls", "ws"): r[k] = round(statistics.median(p[k] for p in parts), 1)
+            scored.append(r)
+        scored.sort(key=lambda x: x['score'])
+        return scored
+
+    @staticmethod
+    async def _abandwidth(target, o, ctx, cap):
+        """经 target 下载 bw_url，返回 {bytes, ttfb(ms), bps}；在 cap 字节或 bw_time 秒后停止"""
+        u = urllib.parse.urlsplit(o['bw_url']); tls = u.scheme == "https"
+        host, _ = SmartSelector.split_target(target)  # 只取候选地址，端口以 bw_url 为准 (候选端口是 Worker 的 HTTPS 端口)
+        s, _ = await SmartSelector._aopen(f"[{host}]" if ":" in host else host, u.port or (443 if tls else 80), o['hs_timeout'])
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(sock=s, ssl=ctx if tls else None,
+                                                                            server_hostname=u.hostname if tls else None), o['hs_timeout'])
+            path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {u.netloc}\r\nUser-Agent: Mozilla/5.0\r\nConnection: close\r\n\r\n".encode())
+            t0 = time.perf_counter()
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), o['hs_timeout'])
+            t1 = time.perf_counter(); ttfb = (t1 - t0) * 1000
+            if b" 200 " not in head.split(b"\r\n", 1)[0] + b" ": raise ConnectionError("HTTP 状态异常")
+            got, end = 0, t1 + o['bw_time']
+            while got < cap:
+                left = end - time.perf_counter()
+                if left <= 0: break
+                try: chunk = await asyncio.wait_for(reader.read(65536), left)
+                except asyncio.TimeoutError: break
+                if not chunk: break
+                got += len(chunk)
+            dur = max(time.perf_counter() - t1, 1e-3)
+            return {"bytes": got, "ttfb": round(ttfb, 1), "bps": got / dur}
+        finally:
+            if writer: writer.close()
+            else: s.close()
+
+    @staticmethod
+    def bandwidth_test(targets, o):
+        """并发测试多个候选的下载吞吐，单个候选字节上限为 min(bw_bytes, bw_total/N)；返回 {target: 结果}"""
+        if not targets: return {}
+        cap = max(1, min(o['bw_bytes'], o['bw_total'] // len(targets)))
+        ctx = SmartSelector.tls_context(o)
+        async def one(t):
+            try: return t, await SmartSelector._abandwidth(t, o, ctx, cap)
+            except Exception: return t, None
+        async def run(): return await asyncio.gather(*[one(t) for t in targets])
+        return {t: r for t, r in asyncio.run(run()) if r}
+
+    @staticmethod
+    def apply_bandwidth(scored, o):
+        """对评分前 bw_top 名做带宽测试，按吞吐量调整评分后重新排序；未能测速的候选排在最后"""
+        head, tail = scored[:o['bw_top']], scored[o['bw_top']:]
+        try: bw = SmartSelector.bandwidth_test([r['target'] for r in head], o)
+        except Exception: return scored
+        best = max((r['bps'] for r in bw.values()), default=0)
+        for r in head:
+            b = bw.get(r['target'])
+            if b and b['bps'] > 0:
+                r.update(bps=round(b['bps']), ttfb=b['ttfb'], score=round(r['score'] * (best / b['bps']) ** o['bw_weight'], 1))
+            else: r.update(bps=0)
+        head.sort(key=lambda x: (x['bps'] == 0, x['score']))
+        return head + tail
+
+    @staticmethod
+    def pick_best(ip_text, callback_msg=None, report=None, history=None, leader=None, **opts):
+        """返回 (最优目标, 延迟ms)；传入 report 字典时写入复测评分明细 report['scores']
+        ip_text 可以是文本、行列表或逐行产出的迭代器 (外置/在线候选列表，边读取边测速)
+        history 为 ProbeHistory.bind() 的结果时跳过长期失败的候选并记录本轮测速结果
+        leader(target, lat, 已完成数) 在首轮测速中领先者变化时回调；满足 good_ms/good_k 时提前结束，report['cutoff'] 记录原因"""
+        o = {**SmartSelector.DEFAULTS, **opts}; tr = SmartSelector.trace; dns = {}
+        acc = Anytime(o['good_ms'], o['good_k'], leader)
+        if not isinstance(ip_text, (str, list)) and o['engine'] == "async":
+            with tr.span("stream", "select") as a:
+                raw, blocks, results, skipped = SmartSelector.probe_stream(ip_text, o, history.skip if history else None, callback_msg, dns, acc)
+                a.update(n=len(raw), blocks=len(blocks), ok=sum(1 for _, lat in results if lat < 5000))
+            if report is not None: report['skipped'] = skipped; report['streamed'] = len(raw) + skipped
+            if not raw and not blocks: return None, 0
+        else:
+            with tr.span("parse", "select"): raw, blocks = SmartSelector.split_blocks(SmartSelector.parse_list(ip_text))
+            if not raw and not blocks: return None, 0
+            raw = SmartSelector.expand(raw, o, dns)
+            if dns and callback_msg: callback_msg(f"已解析 {len(dns)} 个域名 → {len(raw)} 个候选")
+            if history and len(raw) > 1:
+                live = [t for t in raw if not history.skip(t)]
+                if report is not None: report['skipped'] = len(raw) - len(live)
+                if live: raw = live
+            if len(raw) == 1 and not blocks: return SmartSelector.tcp_ping(raw[0], 443, 2.0)
+
+            results = []
+            if raw:
+                if callback_msg: callback_msg(f"正在测速 ({len(raw)})...")
+                with tr.span("probe", "select", n=len(raw), engine=o['engine']) as a:
+                    results = SmartSelector.probe_many(raw, 443, o['timeout'], o['concurrency'], o['deadline'], o['engine'], acc)
+                    a['ok'] = sum(1 for _, lat in results if lat < 5000)
+        if blocks:
+            with tr.span("search", "select", blocks=len(blocks)) as a: found = SmartSelector.search_blocks(blocks, o, callback_msg); a['probed'] = len(found)
+            results += found
+            if report is not None: report['searched'] = len(found)
+        if report is not None and dns: report['dns'] = dns
+        if report is not None and acc.cut: report['cutoff'] = {"reason": "good" if acc.enough else "deadline", "done": len(acc.results), "cancelled": acc.cut,
+                                                    "good_ms": o['good_ms'], "good_k": o['good_k']}
+        if history: history.record_many(results)
+        candidates = [(ip, lat) for ip, lat in results if lat < 5000]
+        
+        if not candidates: return (raw[0], 0) if raw else (None, 0)
+        candidates.sort(key=lambda x: x[1])
+        scored = None
+        if o['mode'] == "handshake" and o['server']:
+            if callback_msg: callback_msg("握手测速...")
+            try:
+                with tr.span("handshake", "select", n=min(len(candidates), max(1, o['hs_top']))):
+                    scored = SmartSelector.handshake_rank(candidates[:max(1, o['hs_top'])], o) or None
+            except Exception: scored = None  # 事件循环不可用或全部失败时退回普通复测
+        top = candidates[:max(1, o['top_k'])]
+        if scored is None and top[0][1] < o['fast_ms'] and not o['bw_top']:
+            # 首轮极快的候选先单独复测，无丢包且仍快于 fast_ms 才跳过完整复测 (偶尔测出低延迟的高丢包节点不会被直接采用)
+            with tr.span("confirm", "select"): r = SmartSelector.retest(top[:1], {**o, 'samples': max(o['samples'], 5)})
+            if r and r[0]['loss'] == 0 and r[0]['p50'] < o['fast_ms']: scored = r
+        if scored is None:
+            if callback_msg: callback_msg("复测稳定性...")
+            with tr.span("retest", "select", n=len(top)): scored = SmartSelector.retest(top, o)
+        if scored and o['bw_top'] > 0:
+            if callback_msg: callback_msg("带宽测试...")
+            with tr.span("bandwidth", "select", n=min(len(scored), o['bw_top'])): scored = SmartSelector.apply_bandwidth(scored, o)
+        if report is not None: report['scores'] = scored
+        return (scored[0]['target'], scored[0]['p50']) if scored else top[0]
+
+class CandidateImporter:
+    """从本地文件或 HTTP(S) 地址流式读取候选列表：逐行规范化、去重后立即产出，读取完成后可写入外置文件"""
+    def __init__(self, sources, timeout=15, log_fn=None):
+        self.sources = list(sources); self.timeout = timeout; self.log = log_fn or (lambda *a: None)
+        self.count = 0; self.failed = []
+
+    def _open(self, src):
+        if hasattr(src, 'read'): return src  # 已打开的文本流 (如粘贴内容)
+        if src.startswith(("http://", "https://")):
+            import io, urllib.request
+            req = urllib.request.Request(src, headers={"User-Agent": "Mozilla/5.0"})
+            return io.TextIOWrapper(urllib.request.urlopen(req, timeout=self.timeout), encoding='utf-8', errors='replace')
+        p = Path(src)
+        return open(p if p.is_absolute() else APP_ROOT / p, 'r', encoding='utf-8', errors='replace')
+
+    def stream(self, tee=None):
+        """逐个产出候选；tee 为外置文件路径，全部读完且至少一个来源成功时原子替换该文件"""
+        seen = set(); out = tmp = None
+        if tee:
+            tee = Path(tee); tee.parent.mkdir(parents=True, exist_ok=True); tmp = tee.with_name(tee.name + '.tmp')
+            out = open(tmp, 'w', encoding='utf-8')
+        try:
+            for src in self.sources:
+                name = getattr(src, 'name', None) or (src if isinstance(src, str) else "粘贴内容"); n0 = self.count
+                try:
+                    with self._open(src) as f:
+                        for line in f:
+                            for c in SmartSelector.normalize_line(line):
+                                if c in seen: continue
+                                seen.add(c); self.count += 1
+                                if out: out.write(c + "\n")
+                                yield c
+                    self.log(f"📥 {name}: {self.count - n0} 个候选", "#94a3b8")
+                except (OSError, ValueError) as e:
+                    self.failed.append(name); self.log(f"⚠️ 读取候选来源失败 {name}: {e}", "#fbbf24")
+            if out:
+                out.close()
+                if len(self.failed) < len(self.sources): os.replace(tmp, tee)
+        finally:
+            if out and not out.closed: out.close()
+            if tmp and tmp.exists():
+                try: tmp.unlink()
+                except OSError: pass
+
+class CandidateList:
+    """方案的全部候选: 编辑框文本 ip_list + 导入文件 profiles/<id>.import.txt (粘贴/本地文件) + 在线来源 ip_sources
+    大列表只存放在外置文件中，不经过编辑框；在线来源缓存于 profiles/<id>.sources.txt，
+    超过 sources_ttl 秒未更新时，启动测速会边下载边探测并刷新缓存"""
+    def __init__(self, cfg, store_dir=None, log_fn=None):
+        self.text = cfg.get('ip_list', '') or ''; self.sources = cfg.get('ip_sources') or []
+        self.ttl = cfg.get('sources_ttl', 86400); self.log = log_fn
+        d = Path(store_dir or APP_ROOT / "profiles"); pid = cfg.get('id', '')
+        self.store = d / f"{pid}.import.txt"; self.cache = d / f"{pid}.sources.txt"
+
+    @property
+    def external(self): return bool(self.sources) or self.store.exists()
+
+    @property
+    def stale(self):
+        if not self.sources: return False
+        try: return time.time() - self.cache.stat().st_mtime > self.ttl
+        except OSError: return True
+
+    def __bool__(self): return bool(self.text.strip()) or self.external
+    def __iter__(self): return self.lines()
+
+    @staticmethod
+    def read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for l in f:
+                    if l := l.strip(): yield l
+        except OSError: return
+
+    def _dedup(self, *parts):
+        seen = set()
+        for c in itertools.chain(SmartSelector.parse_list(self.text), *parts):
+            if c not in seen: seen.add(c); yield c
+
+    def lines(self):
+        """已保存的候选 (不访问网络)，用于历史匹配、临时 IP 与固定 IP"""
+        return self._dedup(self.read(self.store), self.read(self.cache) if self.sources else ())
+
+    def stream(self):
+        """启动测速使用: 在线来源已过期时边下载边产出，同时刷新缓存"""
+        return self._dedup(self.read(self.store), self.refresh()) if self.stale else self.lines()
+
+    def refresh(self):
+        imp = CandidateImporter(self.sources, log_fn=self.log); yield from imp.stream(tee=self.cache)
+        if len(imp.failed) == len(imp.sources): yield from self.read(self.cache)  # 来源全部失败时沿用上次的缓存
+
+    def count(self):
+        return sum(1 for _ in self.read(self.store)) + (sum(1 for _ in self.read(self.cache)) if self.sources else 0)
+
+class ProfileScan:
+    """多方案对比测速: 所有方案的候选在同一个事件循环中按轮转顺序排队，共用一个全局并发上限，
+    每个候选采样 samples 次并按复测规则评分；结果分批通过 on_rows 回调输出 (行为 dict)"""
+    DEFAULTS = {"concurrency": 256, "samples": 3, "timeout": 1.0, "sample_gap": 0.05,
+                "max_targets": 20000, "block_samples": 64, "batch_secs": 0.25}
+    # max_targets: 单个方案最多测速的候选数；block_samples: 每个 CIDR/地址段随机抽取的地址数
+
+    def __init__(self, profiles, store_dir=None, opts=None, on_rows=None, log_fn=None):
+        self.profiles = profiles; self.store_dir = store_dir; self.o = {**self.DEFAULTS, **(opts or {})}
+        self.on_rows = on_rows or (lambda rows: None); self.log = log_fn or (lambda *a: None)
+        self.total = 0; self.finished = 0; self._loop = None; self._main_task = None
+
+    def targets(self, prof):
+        raw, blocks = SmartSelector.split_blocks(CandidateList(prof, self.store_dir).lines())
+        rng = random.Random(); cap = self.o['max_targets']; out = raw[:cap]
+        for s, e, ver, port in blocks:
+            if len(out) >= cap: break
+            k = min(e - s + 1, self.o['block_samples'], cap - len(out))
+            picks = rng.sample(range(s, e + 1), k) if e - s < 1 << 30 else {rng.randint(s, e) for _ in range(k)}
+            out += [SmartSelector.fmt_addr(n, ver, port) for n in picks]
+        return out
+
+    async def _one(self, prof, t, sem):
+        o = self.o
+        ok, fails, tos = await SmartSelector._asample(t, 443, o['samples'], o['timeout'], o['sample_gap'], sem)
+        r = SmartSelector.score_samples(t, ok, fails, tos, o) or {"target": t, "p50": None, "p90": None, "jitter": None,
+                                                                  "loss": 1.0, "timeouts": tos, "samples": fails + tos, "score": SmartSelector.FAIL}
+        return {**r, "pid": prof['id'], "profile": prof.get('name', '')}
+
+    async def _main(self):
+        sem = asyncio.Semaphore(max(1, self.o['concurrency'])); lists = []
+        for prof in self.profiles:
+            ts = self.targets(prof); lists.append([(prof, t) for t in ts])
+            self.log(f"方案 {prof.get('name', '')}: {len(ts)} 个候选", "#94a3b8")
+        order = [x for grp in itertools.zip_longest(*lists) for x in grp if x]  # 轮转排队，大列表不会挤占其他方案
+        self.total = len(order)
+        tasks = [asyncio.ensure_future(self._one(p, t, sem)) for p, t in order]
+        pending, batch, last = set(tasks), [], time.monotonic()
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self.o['batch_secs'], return_when=asyncio.FIRST_COMPLETED)
+                batch += [t.result() for t in done]; self.finished += len(done)
+                if batch and (not pending or time.monotonic() - last >= self.o['batch_secs']):
+                    self.on_rows(batch); batch, last = [], time.monotonic()
+        finally:
+            for t in pending: t.cancel()
+            if pending: await asyncio.gather(*pending, return_exceptions=True)
+            if batch: self.on_rows(batch)
+
+    def run(self):
+        async def main():
+            self._loop = asyncio.get_running_loop(); self._main_task = asyncio.current_task()
+            await self._main()
+        try: asyncio.run(main())
+        except asyncio.CancelledError: pass
+
+    def stop(self):
+        if self._loop and self._main_task:
+            try: self._loop.call_soon_threadsafe(self._main_task.cancel)
+            except RuntimeError: pass  # 事件循环已结束
+
+class ChinaIndex:
+    """中国 IP 段预编译索引 chn_ip.idx，与核心共用：排序合并后的起止地址数组，核心启动时整块读入即可二分查找
+    布局 (小端): 魔数 ECHCNIDX | 版本 u32 | IPv4 段数 u32 | IPv6 段数 u32 | 保留 u32 | 两个源文件各 (大小 i64, 修改时间 ns i64)
+    | 保留 8 字节 | SHA-256 (前 64 字节 + 数据区)；数据区依次为 IPv4 起点/终点 (u32)、IPv6 起点/终点 (16 字节大端)
+    源文件大小或修改时间与记录不一致时视为过期，核心会退回解析文本列表"""
+    MAGIC = b"ECHCNIDX"; VERSION = 1; HEADER = 96
+    SOURCES = ("chn_ip.txt", "chn_ip_v6.txt")
+
+    def __init__(self, base=None):
+        self.base = Path(base or APP_ROOT); self.v4s = self.v4e = self.v6s = self.v6e = ()
+
+    def locate(self, name):
+        # 与核心一致：优先程序目录，其次当前目录
+        p = self.base / name
+        return p if p.exists() else Path(name)
+
+    @property
+    def path(self):
+        p = self.locate("chn_ip.idx")
+        return p if p.exists() else self.locate(self.SOURCES[0]).parent / "chn_ip.idx"
+
+    def fingerprint(self):
+        out = []
+        for name in self.SOURCES:
+            try: st = self.locate(name).stat(); out += [st.st_size, st.st_mtime_ns]
+            except OSError: out += [-1, -1]
+        return out
+
+    @staticmethod
+    def merge(ranges):
+        out = []
+        for s, e in sorted(ranges):
+            if out and s <= out[-1][1] + 1: out[-1][1] = max(out[-1][1], e)
+            else: out.append([s, e])
+        return out
+
+    def parse(self, name, ver):
+        ranges = []
+        try:
+            with open(self.locate(name), 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) < 2 or parts[0].startswith("#"): continue
+                    try: a, b = ipaddress.ip_address(parts[0]), ipaddress.ip_address(parts[1])
+                    except ValueError: continue
+                    if a.version == b.version == ver and 0 < int(a) <= int(b): ranges.append((int(a), int(b)))
+        except OSError: pass
+        return self.merge(ranges)
+
+    def build(self):
+        """从文本列表生成索引并原子写入，返回 (IPv4 段数, IPv6 段数)"""
+        import array, struct, hashlib
+        fp = self.fingerprint(); v4, v6 = self.parse(self.SOURCES[0], 4), self.parse(self.SOURCES[1], 6)
+        s4, e4 = array.array('I', (r[0] for r in v4)), array.array('I', (r[1] for r in v4))
+        if sys.byteorder == 'big': s4.byteswap(); e4.byteswap()
+        body = s4.tobytes() + e4.tobytes() + b"".join(r[0].to_bytes(16, 'big') for r in v6) + b"".join(r[1].to_bytes(16, 'big') for r in v6)
+        head = struct.pack("<8sIIII4q8x", self.MAGIC, self.VERSION, len(v4), len(v6), 0, *fp)
+        data = head + hashlib.sha256(head + body).digest() + body
+        path = self.path; tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f: f.write(data); f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self._set(v4, v6); return len(v4), len(v6)
+
+    def load(self):
+        """读取并校验索引，成功返回 True；未检查是否过期 (见 stale)"""
+        import struct, hashlib
+        try: data = self.path.read_bytes()
+        except OSError: return False
+        if len(data) < self.HEADER or data[:8] != self.MAGIC: return False
+        _, ver, n4, n6, _, *fp = struct.unpack_from("<8sIIII4q", data)
+        if ver != self.VERSION or len(data) != self.HEADER + n4 * 8 + n6 * 32: return False
+        if hashlib.sha256(data[:64] + data[self.HEADER:]).digest() != data[64:96]: return False
+        import array
+        a = array.array('I'); a.frombytes(data[self.HEADER:self.HEADER + n4 * 8])
+        if sys.byteorder == 'big': a.byteswap()
+        o = self.HEADER + n4 * 8; v6 = [int.from_bytes(data[o + i * 16:o + i * 16 + 16], 'big') for i in range(n6 * 2)]
+        self.fp = fp; self.v4s, self.v4e, self.v6s, self.v6e = a[:n4], a[n4:], v6[:n6], v6[n6:]
+        return True
+
+    def _set(self, v4, v6):
+        import array
+        self.fp = self.fingerprint()
+        self.v4s, self.v4e = array.array('I', (r[0] for r in v4)), array.array('I', (r[1] for r in v4))
+        self.v6s, self.v6e = [r[0] for r in v6], [r[1] for r in v6]
+
+    def stale(self): return self.fingerprint() != getattr(self, 'fp', None)
+
+    def ensure(self, log_fn=None):
+        """索引缺失、损坏或源列表已更新时重建；源列表都不存在时不生成"""
+        if self.load() and not self.stale(): return False
+        if all(x < 0 for x in self.fingerprint()): return False
+        t0 = time.perf_counter(); n4, n6 = self.build()
+        if log_fn: log_fn(f"🗂 中国 IP 索引已更新: {n4} 个 IPv4 段, {n6} 个 IPv6 段 ({(time.perf_counter() - t0) * 1000:.0f}ms)", "#94a3b8")
+        return True
+
+    def contains(self, ip):
+        import bisect
+        a = ipaddress.ip_address(ip); n = int(a)
+        s, e = (self.v4s, self.v4e) if a.version == 4 else (self.v6s, self.v6e)
+        i = bisect.bisect_right(s, n) - 1
+        return i >= 0 and n <= e[i]
+
+    def would_bypass(self, host, routing="bypass_cn"):
+        """与核心 shouldBypassProxy 一致的分流判断，返回 (是否直连, 解析到的 IP 列表)"""
+        if routing == "none": return True, []
+        if routing != "bypass_cn": return False, []
+        try: ips = [str(ipaddress.ip_address(host))]
+        except ValueError:
+            try: ips = list(dict.fromkeys(i[4][0] for i in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)))
+            except OSError: return False, []
+        return any(self.contains(ip.split('%')[0]) for ip in ips), ips
+
+class PacFile:
+    """由中国 IP 索引 (及可选的 chn_domain.txt 域名列表) 生成 PAC，让浏览器对国内流量直接直连，不再经过本地核心
+    IP 段按「与上一段终点的差值, 段长」编码为 36 进制字符串，PAC 首次调用时解码为数组后二分查找；IPv6 只比较前 48 位
+    各部分按源文件指纹缓存，列表变化时只重新编码变化的部分"""
+    DOMAINS = "chn_domain.txt"   # 每行一个域名，也支持 dnsmasq 的 server=/域名/IP 格式
+    TEMPLATE = r"""var P = %(proxy)s;
+var D4 = "%(v4)s";
+var D6 = "%(v6)s";
+var DOM = "%(dom)s";
+var S4, E4, S6, E6, DM;
+function unpack(d, s, e) { var a = d ? d.split(",") : [], x = 0; for (var i = 0; i + 1 < a.length; i += 2) { x += parseInt(a[i], 36); s.push(x); x += parseInt(a[i + 1], 36); e.push(x); } }
+function init() { S4 = []; E4 = []; S6 = []; E6 = []; DM = {}; unpack(D4, S4, E4); unpack(D6, S6, E6); var d = DOM ? DOM.split(",") : []; for (var i = 0; i < d.length; i++) DM[d[i]] = 1; }
+function hit(s, e, n) { var lo = 0, hi = s.length - 1, k = -1; while (lo <= hi) { var m = (lo + hi) >> 1; if (s[m] <= n) { k = m; lo = m + 1; } else hi = m - 1; } return k >= 0 && n <= e[k]; }
+function v4(ip) { var p = ip.split("."); return p[0] * 16777216 + p[1] * 65536 + p[2] * 256 + +p[3]; }
+function v6(ip) { var h = ip.split("::"), a = h[0] ? h[0].split(":") : [], b = h.length > 1 && h[1] ? h[1].split(":") : []; while (a.length + b.length < 8) a.push("0"); a = a.concat(b); return parseInt(a[0], 16) * 4294967296 + parseInt(a[1], 16) * 65536 + parseInt(a[2], 16); }
+function cn(ip) { ip = ip.split("%%")[0]; return ip.indexOf(":") >= 0 ? hit(S6, E6, v6(ip)) : /^\d+\.\d+\.\d+\.\d+$/.test(ip) && hit(S4, E4, v4(ip)); }
+function FindProxyForURL(url, host) {
+  if (!S4) init();
+  var h = host.toLowerCase(); if (h.charAt(0) == "[") h = h.slice(1, -1);
+  if (h.indexOf(":") >= 0 || /^\d+\.\d+\.\d+\.\d+$/.test(h)) return cn(h) ? "DIRECT" : P;  // IP 字面量先判断: IPv6 不含点，会被当成单标签主机名
+  if (isPlainHostName(h) || h == "localhost") return "DIRECT";
+  for (var d = h; ; d = d.slice(d.indexOf(".") + 1)) { if (DM.hasOwnProperty(d)) return "DIRECT"; if (d.indexOf(".") < 0) break; }
+  var r = typeof dnsResolveEx == "function" ? dnsResolveEx(h) : dnsResolve(h);
+  if (!r) return P;
+  r = r.split(";"); for (var i = 0; i < r.length; i++) if (r[i] && cn(r[i])) return "DIRECT";
+  return P;
+}
+"""
+
+    def __init__(self, idx=None, lock=None):
+        self.idx = idx or ChinaIndex(); self.lock = lock or threading.Lock(); self.parts = {}
+
+    @staticmethod
+    def pack(ranges):
+        # [(起点, 终点)] -> "差值,段长,..."；ranges 已排序且互不重叠
+        out, prev = [], 0
+        for s, e in ranges: out += [s - prev, e - s]; prev = e
+        return ",".join(PacFile.b36(n) for n in out)
+
+    @staticmethod
+    def b36(n):
+        d = "0123456789abcdefghijklmnopqrstuvwxyz"; s = ""
+        while True:
+            n, r = divmod(n, 36); s = d[r] + s
+            if not n: return s
+
+    def domains(self):
+        out = set()
+        try:
+            with open(self.idx.locate(self.DOMAINS), 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    t = line.split("#", 1)[0].strip().lower()
+                    if t.startswith("server=/"): t = t[8:].split("/", 1)[0]
+                    t = t.split()[0].strip(".") if t else ""
+                    if t and re.fullmatch(r"[a-z0-9.-]+", t): out.add(t)
+        except OSError: pass
+        return sorted(out)
+
+    def dom_fp(self):
+        try: st = self.idx.locate(self.DOMAINS).stat(); return (st.st_size, st.st_mtime_ns)
+        except OSError: return None
+
+    def _part(self, name, fp, make):
+        if (c := self.parts.get(name)) and c[0] == fp: return c[1]
+        self.parts[name] = (fp, v := make()); return v
+
+    def render(self, proxy, log_fn=None):
+        """返回 (版本号, PAC 文本)；proxy 为核心监听地址 host:port，源列表与 proxy 都未变化时直接返回上次结果"""
+        import hashlib
+        with self.lock:
+            if self.idx.stale(): self.idx.ensure(log_fn)
+            fp, dfp = tuple(getattr(self.idx, 'fp', ()) or ()), self.dom_fp()
+            if (last := self.parts.get("pac")) and last[0] == (fp, dfp, proxy): return last[1]
+            v4 = self._part("v4", fp, lambda: self.pack(zip(self.idx.v4s, self.idx.v4e)))
+            v6 = self._part("v6", fp, lambda: self.pack((s >> 80, e >> 80) for s, e in self.merge48(self.idx.v6s, self.idx.v6e)))
+            dom = self._part("dom", dfp, lambda: ",".join(self.domains()))
+            body = self.TEMPLATE % {"proxy": json.dumps(f"PROXY {proxy}"), "v4": v4, "v6": v6, "dom": dom}
+            out = (hashlib.sha1(body.encode()).hexdigest()[:10], body); self.parts["pac"] = ((fp, dfp, proxy), out)
+            return out
+
+    @staticmethod
+    def merge48(starts, ends):
+        # 截取前 48 位后相邻段可能重叠，先合并 (比较时仍按 128 位对齐到 /48 边界)
+        mask = ~((1 << 80) - 1)
+        return ChinaIndex.merge((s & mask, e & mask) for s, e in zip(starts, ends))
+
+# ==================== 6. 配置管理 ====================
+class ConfigManager:
+    """方案配置：按 id 建索引，修改后标记 dirty 并合并为一次延迟写入；写入采用临时文件 + 替换，避免中途崩溃损坏配置
+    过长的 ip_list 单独存放在 profiles/<id>.txt，config.json 中只保留文件引用"""
+    FLUSH_DELAY = 0.8      # 最后一次修改后多久写盘 (秒)
+    MAX_WAIT = 5.0         # 持续修改时最长的写盘间隔
+    INLINE_MAX = 4096      # ip_list 超过该长度时外置存储
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = Path(path); self.data = {"servers": [], "current": None}
+        self.dirty = False; self._index = {}; self._ext = {}; self._timer = None; self._first = 0
+        self._lock = threading.RLock(); self.load()
+        atexit.register(self.flush)
+
+    @property
+    def ext_dir(self): return self.path.parent / "profiles"
+
+    def load(self):
+        try:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f: self.data.update(json.load(f))
+            if not self.data.get('servers'): self.add_default(); return
+            dirty = False
+            for s in self.data['servers']:
+                if 'id' not in s: import uuid; s['id'] = str(uuid.uuid4()); dirty = True
+                if 'auto_best' not in s: s['auto_best'] = True; dirty = True
+                if ref := s.pop('ip_list_file', None):
+                    try: s['ip_list'] = (self.path.parent / ref).read_text(encoding='utf-8'); self._ext[s['id']] = hash(s['ip_list'])
+                    except OSError: s.setdefault('ip_list', '')
+            self.reindex()
+            if not self.data.get('current') and self.data['servers']: self.data['current'] = self.data['servers'][0]['id']; dirty = True
+            if dirty: self.save(now=True)
+        except:
+            # 配置损坏时先备份原文件再恢复默认，避免直接覆盖
+            try: os.replace(self.path, self.path.with_name(self.path.name + '.bak'))
+            except OSError: pass
+            self.add_default()
+
+    def reindex(self): self._index = {s['id']: s for s in self.data['servers']}
+
+    def save(self, now=False):
+        # 标记修改并安排延迟写盘；短时间内的多次修改只写一次
+        with self._lock:
+            if not self.dirty: self._first = time.monotonic()
+            self.dirty = True
+            if self._timer: self._timer.cancel(); self._timer = None
+            if not now:
+                delay = min(self.FLUSH_DELAY, max(0.0, self._first + self.MAX_WAIT - time.monotonic()))
+                self._timer = threading.Timer(delay, self.flush); self._timer.daemon = True; self._timer.start(); return
+        self.flush()
+
+    def flush(self):
+        # 在锁内深拷贝后再序列化，界面线程同时修改方案也不会打断写盘；写入成功后才清除 dirty，失败时稍后重试
+        import copy
+        with self._lock:
+            if self._timer: self._timer.cancel(); self._timer = None
+            if not self.dirty: return
+            try:
+                data = copy.deepcopy(self.data); ext = {}
+                for s in data['servers']:
+                    if len(s.get('ip_list') or '') > self.INLINE_MAX: ext[s['id']] = s.pop('ip_list'); s['ip_list_file'] = f"profiles/{s['id']}.txt"
+                text = json.dumps(data, indent=2, ensure_ascii=False)
+                for pid, ip in ext.items():  # 外置内容未变化时不重写
+                    if self._ext.get(pid) == hash(ip): continue
+                    self.ext_dir.mkdir(exist_ok=True); self._write(self.ext_dir / f"{pid}.txt", ip); self._ext[pid] = hash(ip)
+                self._write(self.path, text); self.dirty = False
+            except Exception:
+                self._timer = threading.Timer(self.MAX_WAIT, self.flush); self._timer.daemon = True; self._timer.start(); return
+            for pid in [p for p in self._ext if p not in ext]:  # 已删除或已缩短的方案
+                del self._ext[pid]
+                try: (self.ext_dir / f"{pid}.txt").unlink()
+                except OSError: pass
+
+    @staticmethod
+    def _write(path, text):
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f: f.write(text); f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def add_default(self):
+        import uuid; uid = str(uuid.uuid4())
+        self.data['servers'] = [{"id": uid, "name": "默认配置", "server": "", "listen": "127.0.0.1:30000", "token": "", "ip_list": "", "routing": "bypass_cn", "auto_best": True}]
+        self.data['current'] = uid; self.reindex(); self.save(now=True)
+    def get(self, pid): return self._index.get(pid)
+    def get_cur(self):
+        if s := self._index.get(self.data['current']): return s
+        if self.data['servers']: self.data['current'] = self.data['servers'][0]['id']; return self.data['servers'][0]
+        return {}
+    @contextlib.contextmanager
+    def edit(self):
+        """持有写盘锁修改当前方案，结束后安排保存: with cfg.edit() as s: s['name'] = ..."""
+        with self._lock: yield self.get_cur()
+        self.save()
+    def update_cur(self, val):
+        with self._lock:
+            s = self._index.get(val['id'])
+            if s is None: return
+            if s is not val: s.clear(); s.update(val)
+        self.save()
+    def add_new(self, name):
+        import uuid
+        with self._lock:
+            new = self.get_cur().copy(); new['id'] = str(uuid.uuid4()); new['name'] = name
+            self.data['servers'].append(new); self._index[new['id']] = new; self.data['current'] = new['id']
+        self.save()
+    def del_cur(self):
+        if len(self.data['servers']) <= 1: return
+        for ext in ("import", "sources"):
+            try: (self.ext_dir / f"{self.data['current']}.{ext}.txt").unlink()
+            except OSError: pass
+        with self._lock:
+            self.data['servers'] = [s for s in self.data['servers'] if s['id'] != self.data['current']]
+            self.reindex(); self.data['current'] = self.data['servers'][0]['id']
+        self.save()
+    def rename_cur(self, n):
+        with self.edit() as s: s['name'] = n
+
+class ProbeHistory:
+    """测速历史: {方案id: {候选: [时间戳, 平滑延迟ms, 成功权重, 失败权重, 连续失败次数]}}，权重按半衰期衰减"""
+    HALF_LIFE = 3 * 86400      # 成功/失败权重半衰期
+    MAX_AGE = 14 * 86400       # 超过该时间未更新的记录直接丢弃
+    SKIP_STREAK = 4            # 连续失败达到该次数后暂时跳过
+    RETRY_AFTER = 6 * 3600     # 被跳过的候选在该时间后重新参与测速
+    MAX_PER_PROFILE = 4096
+    MAX_TOTAL = 16384
+    ALPHA = 0.3                # 延迟 EWMA 系数
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = Path(path); self.data = {}; self.dirty = False; self._lock = threading.Lock(); self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: d = json.load(f)
+            if d.get('v') == 1: self.data = d.get('profiles', {})
+        except: self.data = {}
+        self._decay_all()
+
+    def _decay(self, e, now):
+        k = 0.5 ** (max(0, now - e[0]) / self.HALF_LIFE); e[2] *= k; e[3] *= k
+
+    def _decay_all(self):
+        now = time.time()
+        with self._lock:
+            for pid in list(self.data):
+                ents = self.data[pid]
+                for c in [c for c, e in ents.items() if now - e[0] > self.MAX_AGE]: del ents[c]
+                if not ents: del self.data[pid]
+
+    def record_many(self, pid, results):
+        now = time.time()
+        with self._lock:
+            ents = self.data.setdefault(pid, {})
+            for cand, lat in results:
+                e = ents.get(cand)
+                if e is None: e = ents[cand] = [now, -1, 0.0, 0.0, 0]
+                else: self._decay(e, now)
+                e[0] = now
+                if lat < 5000:
+                    e[1] = lat if e[1] < 0 else self.ALPHA * lat + (1 - self.ALPHA) * e[1]; e[2] += 1; e[4] = 0
+                else: e[3] += 1; e[4] += 1
+            self._evict(pid)
+            self.dirty = True
+
+    def _evict(self, pid):
+        # 先淘汰连续失败的旧记录，再淘汰最久未更新的
+        ents = self.data[pid]; over = len(ents) - self.MAX_PER_PROFILE
+        total = sum(len(v) for v in self.data.values())
+        over = max(over, total - self.MAX_TOTAL)
+        if over <= 0: return
+        for c in sorted(ents, key=lambda c: (ents[c][4] == 0, ents[c][0]))[:over]: del ents[c]
+
+    def skip(self, pid, cand):
+        e = self.data.get(pid, {}).get(cand)
+        return bool(e) and e[4] >= self.SKIP_STREAK and time.time() - e[0] < self.RETRY_AFTER
+
+    def best(self, pid, n=1):
+        """返回历史表现最好的 n 个 (候选, 平滑延迟)，按失败率加权排序"""
+        now = time.time(); out = []
+        with self._lock:
+            for c, e in self.data.get(pid, {}).items():
+                if e[1] < 0 or e[4] > 0: continue
+                k = 0.5 ** (max(0, now - e[0]) / self.HALF_LIFE); ok, bad = e[2] * k, e[3] * k
+                out.append((e[1] * (1 + bad / (ok + bad + 1e-9)), c, e[1]))
+        out.sort()
+        return [(c, lat) for _, c, lat in out[:n]]
+
+    def bind(self, pid): return _HistoryView(self, pid)
+
+    def prune(self, keep_ids):
+        with self._lock:
+            for pid in [p for p in self.data if p not in keep_ids]: del self.data[pid]; self.dirty = True
+
+    def save(self):
+        # 与 ConfigManager 相同: 锁内序列化并原子写入，写入成功后才清除 dirty，失败时留待下次保存
+        with self._lock:
+            if not self.dirty: return
+            d = {"v": 1, "profiles": {pid: {c: [int(e[0]), round(e[1], 1), round(e[2], 2), round(e[3], 2), e[4]] for c, e in ents.items()}
+                                      for pid, ents in self.data.items()}}
+            try: ConfigManager._write(self.path, json.dumps(d, separators=(',', ':'))); self.dirty = False
+            except OSError: pass
+
+class _HistoryView:
+    def __init__(self, store, pid): self.store = store; self.pid = pid
+    def save(self): self.store.save()
+    def skip(self, cand):
+        # 域名候选: 解析缓存中的地址全部被跳过时才跳过
+        if self.store.skip(self.pid, cand): return True
+        exp = SmartSelector.cached_targets(cand)
+        return bool(exp) and exp != [cand] and all(self.store.skip(self.pid, t) for t in exp)
+    def record_many(self, results): self.store.record_many(self.pid, results)
+    def best(self, n=1): return self.store.best(self.pid, n)
+
+class GeoCache:
+    """出口 IP 归属检测结果缓存: {边缘节点: [时间戳, 结果文本]}，同一节点在 TTL 内重复启动时不再请求外部接口"""
+    MAX_ENTRIES = 256
+
+    def __init__(self, path=GEO_CACHE_FILE):
+        self.path = Path(path); self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: self.data = json.load(f)
+        except: self.data = {}
+
+    def get(self, key, ttl):
+        with self._lock: e = self.data.get(key)
+        return e[1] if e and time.time() - e[0] < ttl else None
+
+    def put(self, key, text):
+        with self._lock:
+            self.data[key] = [int(time.time()), text]
+            for k in sorted(self.data, key=lambda k: self.data[k][0])[:max(0, len(self.data) - self.MAX_ENTRIES)]: del self.data[k]
+            try: ConfigManager._write(self.path, json.dumps(self.data, ensure_ascii=False))
+            except OSError: pass  # 缓存写入失败只影响下次启动是否重新检测
+
+class HealthMonitor(threading.Thread):
+    """运行期间定时复测当前 IP 与少量备选 IP，连续多轮超出阈值时切换到评分最好的备选"""
+    # interval: 检测间隔(秒)；max_latency / degrade_ratio: p50 超过 max(max_latency, 基线*degrade_ratio) 视为劣化
+    # max_loss: 丢包率阈值；bad_rounds: 连续劣化轮数；standby: 备选数量
+    DEFAULTS = {"enabled": True, "interval": 20, "samples": 3, "max_latency": 400, "degrade_ratio": 3.0,
+                "max_loss": 0.5, "bad_rounds": 2, "standby": 3}
+
+    def __init__(self, active, baseline, standby, switch_fn, log_fn, opts=None, probe_opts=None, state_fn=None):
+        super().__init__(daemon=True); self.state_fn = state_fn; self.flagged = False
+        self.o = {**self.DEFAULTS, **(opts or {})}
+        self.po = {**SmartSelector.DEFAULTS, **(probe_opts or {}), "samples": self.o['samples']}
+        self.active = active; self.baseline = baseline or 0; self.standby = [t for t in standby if t != active][:self.o['standby']]
+        self.switch_fn = switch_fn; self.log = log_fn; self.bad = 0; self._halt = threading.Event()
+
+    def stop(self): self._halt.set()
+
+    def set_active(self, active, baseline, standby=None):
+        self.active = active; self.baseline = baseline or 0; self.bad = 0
+        if standby is not None: self.standby = [t for t in standby if t != active][:self.o['standby']]
+
+    def degraded(self, r):
+        if r is None: return True
+        return r['loss'] > self.o['max_loss'] or r['p50'] > max(self.o['max_latency'], self.baseline * self.o['degrade_ratio'])
+
+    def run(self):
+        while not self._halt.wait(self.o['interval']):
+            active = self.active
+            scores = {r['target']: r for r in SmartSelector.retest([(t, None) for t in [active] + self.standby], self.po)}
+            if self._halt.is_set() or active != self.active: continue
+            cur = scores.get(active)
+            if not self.degraded(cur):
+                if self.flagged: self.flagged = False; self.state_fn and self.state_fn(False)
+                self.bad = 0; self.baseline = 0.8 * self.baseline + 0.2 * cur['p50'] if self.baseline else cur['p50']
+                continue
+            self.bad += 1
+            if self.bad < self.o['bad_rounds']: continue
+            if not self.flagged and self.state_fn: self.flagged = True; self.state_fn(True)
+            alts = sorted((scores[t] for t in self.standby if t in scores and not self.degraded(scores[t])), key=lambda r: r['score'])
+            if not alts or (cur and alts[0]['score'] >= cur['score']):
+                self.log(f"⚠️ 当前 IP {active} 质量下降，但没有更好的备选", "#fbbf24"); self.bad = 0; continue
+            new = alts[0]; before = f"{cur['p50']}ms/丢包{cur['loss']*100:.0f}%" if cur else "不可达"
+            t0 = time.perf_counter()
+            if not self.switch_fn(new['target'], new['p50']): continue
+            cost = (time.perf_counter() - t0) * 1000
+            after = SmartSelector.retest([(new['target'], None)], self.po)
+            after = f"{after[0]['p50']}ms/丢包{after[0]['loss']*100:.0f}%" if after else "不可达"
+            self.log(f"🔀 自动切换 {active} ({before}) -> {new['target']} ({after})，切换耗时 {cost:.0f}ms", "#10b981")
+            self.standby = [t for t in self.standby if t != new['target']] + [active]
+            self.active = new['target']; self.baseline = new['p50']; self.bad = 0
+            if self.flagged: self.flagged = False; self.state_fn and self.state_fn(False)
+
+class LogPipe:
+    """线程安全的日志环形缓冲：任意线程 push，界面定时 drain 批量渲染；可选同时写入日志文件"""
+    def __init__(self, maxlen=20000, spill_path=None, spill_max=5 << 20):
+        self.buf = collections.deque(maxlen=maxlen); self.dropped = 0; self._lock = threading.Lock()
+        self.spill_path = Path(spill_path) if spill_path else None; self.spill_max = spill_max; self._spill = None
+
+    def push(self, text, color=None):
+        line = (datetime.now().strftime("%H:%M:%S"), text, color)
+        with self._lock:
+            if len(self.buf) == self.buf.maxlen: self.dropped += 1
+            self.buf.append(line)
+            if self.spill_path: self._write_spill(line)
+
+    def drain(self):
+        with self._lock:
+            out, dropped = list(self.buf), self.dropped
+            self.buf.clear(); self.dropped = 0
+        return out, dropped
+
+    def _write_spill(self, line):
+        try:
+            if self._spill is None: self._spill = open(self.spill_path, 'a', encoding='utf-8')
+            self._spill.write(f"[{line[0]}] {line[1]}\n")
+            if self._spill.tell() > self.spill_max:  # 超过上限时轮转为 .1
+                self._spill.close(); os.replace(self.spill_path, self.spill_path.with_suffix(self.spill_path.suffix + '.1'))
+                self._spill = open(self.spill_path, 'a', encoding='utf-8')
+        except Exception: self.spill_path = None
+
+    def flush(self):
+        with self._lock:
+            if self._spill:
+                try: self._spill.flush()
+                except Exception: pass
+
+class Balancer(threading.Thread):
+    """多核心模式的本地前置监听：原样转发 TCP 流到各核心的内部端口 (SOCKS5/HTTP 均适用)
+    mode: least_conn 选活动连接最少的核心 (相同时轮流)；latency 按 (活动连接+1) x 延迟 加权选择"""
+    DOWN_SECS = 5   # 核心端口连接失败后暂停分配的时间
+
+    def __init__(self, listen, backends, mode="least_conn", log_fn=None):
+        super().__init__(daemon=True)
+        self.listen = listen; self.mode = mode; self.log = log_fn or (lambda *a: None)
+        self.backends = [{"addr": addr, "lat": lat or 1, "active": 0, "total": 0, "down_until": 0, "draining": False} for addr, lat in backends]
+        self.ready = threading.Event(); self.error = None; self._loop = None; self._halt = None
+
+    def pick(self, exclude=()):
+        now = time.monotonic()
+        live = [b for b in self.backends if b['down_until'] <= now and not b['draining'] and id(b) not in exclude]
+        if not live: live = [b for b in self.backends if b['down_until'] <= now and id(b) not in exclude]
+        if not live: return None
+        if self.mode == "latency": return min(live, key=lambda b: (b['active'] + 1) * b['lat'])
+        return min(live, key=lambda b: (b['active'], b['total']))
+
+    def drain(self, i, on=True): self.backends[i]['draining'] = on
+    def set_latency(self, i, lat):
+        if lat: self.backends[i]['lat'] = lat
+    def mark_up(self, i): self.backends[i]['down_until'] = 0
+
+    def snapshot(self):
+        return [{k: b[k] for k in ("active", "total", "lat", "draining")} for b in self.backends]
+
+    async def _pipe(self, r, w):
+        try:
+            while True:
+                d = await r.read(65536)
+                if not d: break
+                w.write(d); await w.drain()
+        except Exception: pass
+        finally:
+            try: w.close()
+            except Exception: pass
+
+    async def _handle(self, cr, cw):
+        tried = set()
+        while True:
+            b = self.pick(tried)
+            if b is None: cw.close(); return
+            tried.add(id(b))
+            try:
+                br, bw = await asyncio.wait_for(asyncio.open_connection(*b['addr']), 3); break
+            except Exception: b['down_until'] = time.monotonic() + self.DOWN_SECS
+        b['active'] += 1; b['total'] += 1
+        try: await asyncio.gather(self._pipe(cr, bw), self._pipe(br, cw))
+        finally: b['active'] -= 1
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop(); self._halt = asyncio.Event()
+        host, port = SmartSelector.split_target(self.listen, 30000)
+        try: server = await asyncio.start_server(self._handle, host, port, backlog=1024, reuse_address=True)
+        except Exception as e: self.error = e; self.ready.set(); return
+        self.ready.set()
+        async with server: await self._halt.wait()
+
+    def run(self): asyncio.run(self._main())
+
+    def stop(self):
+        if self._loop and self._halt:
+            try: self._loop.call_soon_threadsafe(self._halt.set)
+            except RuntimeError: pass
+
+class CoreStats:
+    """汇总核心输出的 [统计] 计数 (多核心模式按槽位分别保存)，并按采样间隔计算速率序列供界面绘制曲线"""
+    COUNTERS = ("conns", "proxied", "direct", "errors", "ws_dial_fails", "bytes_up", "bytes_down", "route_hits", "route_misses", "route_prefetches")
+    GAUGES = ("active", "tunnels", "goroutines", "heap", "route_cached")
+    SERIES = ("conn_rate", "active", "tunnels", "up_bps", "down_bps", "direct_ratio", "error_ratio", "route_hit_ratio")
+    HELP = {"conns": "接入连接总数", "proxied": "经代理的请求总数", "direct": "分流直连的请求总数", "errors": "失败的请求总数",
+            "ws_dial_fails": "WebSocket 建连失败次数", "bytes_up": "上行字节数", "bytes_down": "下行字节数",
+            "route_hits": "分流结论缓存命中次数", "route_misses": "分流结论缓存未命中次数", "route_prefetches": "热门域名分流结论预取次数",
+            "active": "活动连接数", "tunnels": "活动代理隧道数", "goroutines": "核心 goroutine 数", "heap": "核心堆内存字节数", "route_cached": "已缓存分流结论的域名数"}
+
+    def __init__(self, interval=2, keep=150):
+        self.interval = interval; self.slots = {}; self.series = {k: collections.deque(maxlen=keep) for k in self.SERIES}
+        self._lock = threading.Lock(); self._prev = None
+
+    def ingest(self, slot, d):
+        now = time.monotonic()
+        with self._lock:
+            self.slots[slot] = d
+            if self._prev and now - self._prev[0] < self.interval * 0.9: return
+            tot = self.total()
+            if self._prev:
+                dt = now - self._prev[0]; delta = {k: max(0, tot[k] - self._prev[1].get(k, 0)) for k in self.COUNTERS}  # 核心重启后计数归零
+                reqs = delta['proxied'] + delta['direct']; looks = delta['route_hits'] + delta['route_misses']
+                for k, v in (("conn_rate", delta['conns'] / dt), ("active", tot['active']), ("tunnels", tot['tunnels']),
+                             ("up_bps", delta['bytes_up'] / dt), ("down_bps", delta['bytes_down'] / dt),
+                             ("direct_ratio", delta['direct'] / reqs if reqs else 0), ("error_ratio", delta['errors'] / reqs if reqs else 0),
+                             ("route_hit_ratio", delta['route_hits'] / looks if looks else 0)):
+                    self.series[k].append(v)
+            self._prev = (now, tot)
+
+    def total(self):
+        return {k: sum(d.get(k, 0) for d in self.slots.values()) for k in self.COUNTERS + self.GAUGES}
+
+    def snapshot(self):
+        with self._lock: return {k: list(v) for k, v in self.series.items()}
+
+    def counts(self):
+        with self._lock: return self.total()
+
+    def prometheus(self):
+        with self._lock: slots = sorted(self.slots.items(), key=lambda kv: kv[0] if kv[0] is not None else -1)
+        out = []
+        for k in self.COUNTERS + self.GAUGES:
+            name = f"ech_{k}_total" if k in self.COUNTERS else f"ech_{k}"
+            out += [f"# HELP {name} {self.HELP[k]}", f"# TYPE {name} {'counter' if k in self.COUNTERS else 'gauge'}"]
+            out += [f'{name}{{core="{0 if slot is None else slot + 1}"}} {d.get(k, 0)}' for slot, d in slots]
+        return "\n".join(out) + "\n"
+
+class MetricsServer(threading.Thread):
+    """在回环地址上以 Prometheus 文本格式提供 /metrics"""
+    def __init__(self, stats, port, host="127.0.0.1"):
+        super().__init__(daemon=True)
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(h):
+                if h.path.split("?")[0] not in ("/metrics", "/"): h.send_error(404); return
+                body = stats.prometheus().encode()
+                h.send_response(200); h.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                h.send_header("Content-Length", str(len(body))); h.end_headers(); h.wfile.write(body)
+            def log_message(h, *a): pass
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+
+    def run(self): self.httpd.serve_forever(poll_interval=0.5)
+    def stop(self): self.httpd.shutdown(); self.httpd.server_close()
+
+class PacServer(threading.Thread):
+    """在回环地址上提供 /proxy.pac；每次请求检查源列表指纹，变化时增量重新生成，未变化时返回缓存"""
+    def __init__(self, pac, proxy, port=0, host="127.0.0.1", log_fn=None):
+        super().__init__(daemon=True, name="pac")
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        self.pac, self.proxy, self.log_fn = pac, proxy, log_fn
+        srv = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(h):
+                if h.path.split("?")[0] not in ("/proxy.pac", "/"): h.send_error(404); return
+                ver, body = srv.render(); body = body.encode()
+                if h.headers.get("If-None-Match") == f'"{ver}"': h.send_response(304); h.end_headers(); return
+                h.send_response(200); h.send_header("Content-Type", "application/x-ns-proxy-autoconfig")
+                h.send_header("ETag", f'"{ver}"'); h.send_header("Cache-Control", "no-cache")
+                h.send_header("Content-Length", str(len(body))); h.end_headers(); h.wfile.write(body)
+            def log_message(h, *a): pass
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+
+    def render(self): return self.pac.render(self.proxy, self.log_fn)
+    def url(self): return f"http://127.0.0.1:{self.port}/proxy.pac?v={self.render()[0]}"
+    def run(self): self.httpd.serve_forever(poll_interval=0.5)
+    def stop(self): self.httpd.shutdown(); self.httpd.server_close()
+
+# ==================== 7. 运行核心 ====================
+class CoreRunner:
+    """优选 IP 并运行核心进程；界面与无界面模式共用，日志和状态通过回调输出"""
+    SWITCH_RATIO = 0.8; SWITCH_MIN_MS = 10  # 后台测速结果需至少快 20% 且 10ms 才切换
+    # 多核心模式：size 个核心各用一个优选 IP 监听内部端口，balance 为 least_conn / latency；base_port 为 0 时自动分配
+    POOL_DEFAULTS = {"size": 1, "balance": "least_conn", "base_port": 0, "restart_delay": 3}
+    # 运行统计：enabled/interval 控制核心 -stats 输出 (界面曲线使用)；port 为本地 Prometheus 接口端口，默认 0 不开启，端口被占用时改用随机端口
+    METRICS_DEFAULTS = {"enabled": True, "interval": 2, "port": 0}
+    # 启动追踪：每次启动/停止周期记录各阶段耗时，保留最近 keep 次，可导出为 Chrome trace JSON
+    TRACE_DEFAULTS = {"enabled": True, "keep": 20}
+    # 核心启动日志 -> 追踪区间: (日志片段, B 开始 / B1 仅首次开始 / E 结束, 区间名)；core_init 在启动进程时开始
+    TRACE_MARKS = (("正在获取 ECH 配置", "B", "ech_fetch"), ("[ECH] 配置已加载", "E", "ech_fetch"),
+                   ("正在加载中国IP列表", "B", "china_list"), ("正在下载 IP 列表", "B", "download"), ("[下载] 已保存到", "E", "download"),
+                   ("个中国IPv4段", "E", "china_list"), ("未加载到任何中国IP列表", "E", "china_list"),
+                   ("服务器启动", "E", "core_init"), ("(通过代理)", "B1", "first_dial"), ("已连接:", "E", "first_dial"))
+
+    def __init__(self, cfg, history=None, logs=None, msg=None, status=None, latency=None, geo=None, error=None, scores=None, traces=None):
+        self.cfg = cfg; self.traces = traces; self.running = False; self.p = None; self._swap_lock = threading.Lock(); self.logs = logs
+        nop = lambda *a: None
+        self.msg = msg or nop; self.status = status or nop; self.latency = latency or nop
+        self.geo = geo or nop; self.error = error or nop; self.scores = scores or nop
+        self.monitor = None; self.standby = []; self.bw = {}; self.lats = {}
+        self.cores = []; self.monitors = []; self.balancer = None; self.ready = threading.Event(); self.measured = threading.Event(); self.ready_ms = None; self.edge = None
+        self.history = history.bind(cfg['id']) if history and cfg.get('id') else None
+        self.mo = {**self.METRICS_DEFAULTS, **(cfg.get('metrics') or {})}
+        self.stats = CoreStats(self.mo['interval']); self.metrics = None
+        self.pin = None  # (IP, 延迟, 备用列表)：使用对比测速的结果直接启动，跳过优选
+        self.store_dir = APP_ROOT / "profiles"  # 外置候选列表目录，与配置文件同目录
+        self.to = {**self.TRACE_DEFAULTS, **(cfg.get('trace') or {})}; self.trace = Tracer(self.to['enabled']); self._traced = set()
+    
+    def run(self):
+        self.running = True; SmartSelector.trace = self.trace
+        th = threading.current_thread(); name, th.name = th.name, "runner"  # 追踪时间线名称
+        try: self._run()
+        finally:
+            th.name = name; self.trace.end("stop", "runner")
+            if SmartSelector.trace is self.trace: SmartSelector.trace = NOTRACE
+            if self.to['enabled']: self.save_trace()
+
+    def save_trace(self):
+        store = self.traces or TraceStore(keep=self.to['keep']); store.keep = self.to['keep']
+        e = store.add(self.trace, self.cfg.get('name', ''))
+        ph = e['phases']; keys = [k for k in ("select", "spawn", "ech_fetch", "china_list", "core_init", "first_dial") if k in ph]
+        if keys: self.msg("⏱ 启动阶段: " + " · ".join(f"{k} {ph[k]:.0f}ms" for k in keys), "#94a3b8")
+
+    def _run(self):
+        if not CORE_PATH.exists(): 
+            self.msg(f"❌ 核心缺失: {CORE_EXE_NAME}", "#ef4444")
+            self.error("核心文件丢失"); return
+        
+        listen_addr = self.cfg.get('listen', '127.0.0.1:30000')
+        if ':' in listen_addr:
+             try:
+                 p = int(listen_addr.split(':')[-1]); s = socket.socket(); 
+                 if s.connect_ex(('127.0.0.1', p)) == 0: ProcessManager.kill_current()
+                 s.close()
+             except: pass
+        
+        ip_list = self.candidates(); sel_ip = None; warm = None; sel_lat = 0; spec = False
+        use_auto = self.cfg.get('auto_best', True)
+
+        if self.pin:
+            sel_ip, sel_lat, self.standby = self.pin[0], self.pin[1], list(self.pin[2]); self.lats[sel_ip] = sel_lat
+            self.msg(f"📌 使用对比测速结果: {sel_ip} ({sel_lat:.1f}ms)，跳过优选", "#6366f1")
+            self.latency(self.fmt_lat(sel_ip, sel_lat))
+        elif ip_list:
+            if use_auto:
+                if self.history and self.cfg.get('warm_start', True):
+                    with self.trace.span("warm_start") as a:
+                        match = SmartSelector.matcher(ip_list)  # 列表已修改时忽略不在其中的历史记录
+                        best = [b for b in self.history.best(8) if match(b[0])]
+                        warm = best[0] if best else None; self.standby = [b[0] for b in best[1:]]; self.lats.update(best); a['hit'] = bool(warm)
+                if warm:
+                    sel_ip = warm[0]
+                    self.msg(f"⚡ 快速启动: 使用历史最优 {sel_ip} ({warm[1]:.1f}ms)，后台重新测速", "#6366f1")
+                    self.latency(f"~{int(warm[1])}ms | {sel_ip}")
+                elif self.cfg.get('speculative', True) and self.pool_opts()['size'] <= 1 and (prov := self.provisional(ip_list)):
+                    # 没有历史记录时先用列表中的候选启动核心，测速与核心初始化并行进行
+                    sel_ip = prov; spec = True
+                    self.msg(f"⚡ 并行启动: 先以 {prov} 启动核心，同时进行测速", "#6366f1")
+                    self.latency(f"测速中 | {prov}")
+                else:
+                    self.status("...")
+                    best_ip, lat = self.select(ip_list, self.status, lambda t, ms, n: (self.status(f"测速中 · 已完成 {n}"), self.latency(f"领先 {ms:.0f}ms | {t}")))
+                    if best_ip:
+                        self.msg(f"✅ 优选结果: {best_ip} (Lat: {lat:.1f}ms)", "#10b981")
+                        self.latency(self.fmt_lat(best_ip, lat)); sel_ip = best_ip; sel_lat = lat
+                    else: 
+                        self.latency("优选失败")
+            else:
+                raw = SmartSelector.parse_list(ip_list)
+                if raw:
+                    b = SmartSelector.parse_block(raw[0])
+                    sel_ip = SmartSelector.fmt_addr(b[0], b[2], b[3]) if b else raw[0]
+                    self.msg(f"🔒 使用固定 IP: {sel_ip}", "#6366f1")
+                    self.latency(f"固定 | {sel_ip}")
+                else:
+                    self.latency("列表为空")
+        else: 
+            self.latency("直连模式 (Direct)")
+        
+        self.start_metrics()
+        pool = self.pool_opts()
+        targets = [sel_ip] + self.standby[:pool['size'] - 1] if sel_ip and use_auto and pool['size'] > 1 else []
+        self.status("运行中")
+        try:
+            if len(targets) > 1: self.run_pool(targets, listen_addr, pool)
+            elif (p := self.spawn(self.build_cmd(sel_ip))):
+                self.p = p; self.edge = sel_ip or "direct"
+                threading.Thread(target=self.check_geoip, args=(listen_addr,), name="geo", daemon=True).start()
+                if warm or spec: threading.Thread(target=self.background_probe, args=(ip_list, sel_ip, warm[1] if warm else None), name="bg_probe", daemon=True).start()
+                if sel_ip and use_auto: self.start_monitor(sel_ip, warm[1] if warm else sel_lat)
+                self.pump_output()
+            else: self.error("启动失败")
+        except Exception as e: self.msg(str(e), "#ef4444")
+        self.running = False
+        if self.metrics: self.metrics.stop(); self.metrics = None
+
+    def spawn(self, cmd, slot=None):
+        # 启动核心进程并开始该核心的 core_init 区间 (到监听日志为止)
+        track = "core" if slot is None else f"core#{slot + 1}"
+        with self.trace.span("spawn", slot=slot): p = ProcessManager.start_process(cmd, slot)
+        if p: self._traced.discard(track); self.trace.begin("core_init", "core", track)
+        return p
+
+    def pump_output(self, slot=None):
+        # 大块读取核心输出并自行切分行，避免逐行 readline + 逐行信号；slot 为多核心模式的核心序号
+        tail = b""; cur = (lambda: self.p) if slot is None else (lambda: self.cores[slot]['proc'])
+        while self.running:
+            proc = cur()
+            if proc is None: time.sleep(0.5); continue
+            try:
+                chunk = proc.stdout.read(65536)
+                if not chunk:
+                    # 后台切换 IP 时旧进程被结束，继续读取新进程的输出
+                    with self._swap_lock: swapped = cur() is not proc
+                    if swapped: tail = b""; continue
+                    if tail.strip(): self.core_line(tail.decode('utf-8', 'replace').strip(), slot); tail = b""
+                    if slot is None: break
+                    time.sleep(0.5); continue  # 由 run_pool 负责重启
+                lines = (tail + chunk).split(b"\n"); tail = lines.pop()
+                for l in lines:
+                    t = l.decode('utf-8', 'replace').strip()
+                    if t: self.core_line(t, slot)
+            except: break
+
+    def pool_opts(self):
+        return {**self.POOL_DEFAULTS, **(self.cfg.get('pool') or {})}
+
+    @staticmethod
+    def pool_ports(n, base=0):
+        if base: return [base + i for i in range(n)]
+        socks = [socket.socket() for _ in range(n)]
+        try:
+            for s in socks: s.bind(('127.0.0.1', 0))
+            return [s.getsockname()[1] for s in socks]
+        finally:
+            for s in socks: s.close()
+
+    def run_pool(self, targets, listen_addr, o):
+        n = len(targets); ports = self.pool_ports(n, o['base_port'])
+        self.cores = [{'ip': t, 'port': p, 'proc': None, 'retry_at': 0} for t, p in zip(targets, ports)]
+        for i, c in enumerate(self.cores):
+            c['proc'] = self.spawn(self.build_cmd(c['ip'], f"127.0.0.1:{c['port']}"), i)
+        if not any(c['proc'] for c in self.cores): self.error("启动失败"); return
+        self.balancer = Balancer(listen_addr, [(('127.0.0.1', c['port']), self.lats.get(c['ip'])) for c in self.cores], o['balance'], self.msg)
+        self.balancer.start(); self.balancer.ready.wait(5)
+        if self.balancer.error:
+            self.msg(f"❌ 本地监听 {listen_addr} 启动失败: {self.balancer.error}", "#ef4444"); self.error("启动失败"); return
+        self.msg(f"🧩 多核心模式: {n} 个核心 ({o['balance']})，对外监听 {listen_addr}", "#6366f1")
+        for i, c in enumerate(self.cores): self.msg(f"   #{i + 1} {c['ip']} -> 127.0.0.1:{c['port']}", "#94a3b8")
+        self.latency(self.fmt_pool())
+        self.edge = ",".join(c['ip'] for c in self.cores)
+        threading.Thread(target=self.check_geoip, args=(listen_addr, [('127.0.0.1', c['port']) for c in self.cores]), name="geo", daemon=True).start()
+        for i in range(n): threading.Thread(target=self.pump_output, args=(i,), daemon=True).start()
+        self.start_pool_monitors()
+        while self.running:
+            time.sleep(1)
+            for i, c in enumerate(self.cores):
+                p = c['proc']
+                if not self.running or (p and p.poll() is None) or time.monotonic() < c['retry_at']: continue
+                # 核心退出：暂停分配新连接并重启，成功后恢复
+                self.balancer.drain(i); c['retry_at'] = time.monotonic() + o['restart_delay']
+                self.msg(f"⚠️ 核心 #{i + 1} 已退出，重新启动", "#fbbf24")
+                if self.restart_core(c['ip'], i): self.balancer.mark_up(i); self.balancer.drain(i, False)
+        self.balancer.stop()
+
+    def start_pool_monitors(self):
+        o = {**HealthMonitor.DEFAULTS, **(self.cfg.get('health') or {})}
+        if not o['enabled']: return
+        spare = self.standby[len(self.cores) - 1:]
+        for i, c in enumerate(self.cores):
+            def switch(ip, lat, i=i): return ip not in (x['ip'] for x in self.cores) and self.retarget(ip, lat, i)
+            def state(bad, i=i):
+                # 劣化且没有可用备选时暂停向该核心分配新连接
+                self.balancer.drain(i, bad)
+                self.msg(f"{'⏸ 核心 #%d 质量下降，暂停分配新连接' if bad else '▶ 核心 #%d 已恢复'}" % (i + 1), "#fbbf24" if bad else "#10b981")
+            m = HealthMonitor(c['ip'], self.lats.get(c['ip']), spare, switch, self.msg, o, self.probe_opts(), state)
+            m.start(); self.monitors.append(m)
+
+    def fmt_pool(self):
+        return f"{len(self.cores)} 核心 | " + " / ".join(f"{int(self.lats[c['ip']])}ms" if self.lats.get(c['ip']) else "--" for c in self.cores)
+
+    def start_metrics(self):
+        if not self.mo['enabled'] or not self.mo['port']: return
+        try: self.metrics = MetricsServer(self.stats, self.mo['port'])
+        except OSError as e:
+            try: self.metrics = MetricsServer(self.stats, 0)
+            except OSError: self.msg(f"⚠️ 统计接口 127.0.0.1:{self.mo['port']} 启动失败: {e}", "#fbbf24"); return
+            self.msg(f"⚠️ 统计接口端口 {self.mo['port']} 不可用 ({e})，改用随机端口 {self.metrics.port}", "#fbbf24")
+        self.metrics.start(); self.msg(f"📈 统计接口: http://127.0.0.1:{self.metrics.port}/metrics", "#94a3b8")
+
+    def core_line(self, t, slot=None):
+        if (i := t.find("[统计] ")) >= 0:  # 统计行只汇总，不写入日志
+            try: self.stats.ingest(slot, json.loads(t[i + 5:]))
+            except ValueError: pass
+            return
+        track = "core" if slot is None else f"core#{slot + 1}"
+        if track not in self._traced: self.trace_line(t, track)
+        if slot is not None: t = f"[#{slot + 1}] {t}"
+        if not self.ready.is_set() and "服务器启动" in t: self.ready.set()
+        lt = t.lower()
+        c = "#10b981" if "connected" in lt else "#ef4444" if "error" in lt or "panic" in lt else "#94a3b8"
+        if "[分流]" in t and c == "#94a3b8": c = "#f59e0b" if "(直连" in t else "#818cf8"
+        if self.logs: self.logs.push(t, c)
+        else: self.msg(t, c)
+
+    def trace_line(self, t, track):
+        # 把核心启动日志转成追踪区间；首次隧道建立后该核心不再匹配
+        if not self.trace.enabled: self._traced.add(track); return
+        for mark, op, name in self.TRACE_MARKS:
+            if mark not in t: continue
+            if op == "E":
+                if self.trace.end(name, track) is not None and name == "first_dial": self._traced.add(track)
+            else: self.trace.begin(name, "core", track, once=op == "B1")
+
+    def build_cmd(self, sel_ip=None, listen=None):
+        cmd = [str(CORE_PATH)]
+        keys = {'-f':'server', '-l':'listen', '-token':'token', '-routing':'routing'}
+        for f, k in keys.items():
+            if v := (listen if k == 'listen' and listen else self.cfg.get(k)): cmd.extend([f, str(v).strip()])
+        
+        # [修改] 关键修正：不再剥离端口
+        # 因为新的 Go 核心代码已经更新，可以正确处理 IP:Port 格式
+        # 直接将用户优选出来的结果 (如 47.76.60.217:7548) 传给核心
+        if sel_ip:
+            cmd.extend(['-ip', sel_ip])
+        cmd.append('-ctl')  # 允许运行中通过 stdin 切换 IP
+        if self.mo['enabled']: cmd.extend(['-stats', str(self.mo['interval'])])
+        if 'route_cache' in self.cfg: cmd.extend(['-routecache', str(int(self.cfg['route_cache']))])  # 分流结论缓存秒数，0 关闭
+        return cmd
+
+    def probe_opts(self):
+        o = {'server': self.cfg.get('server', ''), 'token': self.cfg.get('token', ''), **(self.cfg.get('probe') or {})}
+        size = self.pool_opts()['size']
+        if size > 1:  # 多核心模式需要足够多的复测结果来分配给各核心
+            o['top_k'] = max(o.get('top_k', SmartSelector.DEFAULTS['top_k']), size + 2); o['fast_ms'] = 0
+        return o
+
+    def candidates(self):
+        # 有外置/在线候选时返回 CandidateList (测速时流式读取)，否则沿用编辑框文本
+        c = CandidateList(self.cfg, self.store_dir, self.msg)
+        if not c.external: return c.text
+        self.msg(f"📚 外置候选 {c.count()} 个" + (f"，在线来源 {len(c.sources)} 个" + ("，本次启动边下载边测速" if c.stale else "") if c.sources else ""), "#94a3b8")
+        return c
+
+    def select(self, ip_list, callback=None, leader=None):
+        report = {}; src = ip_list.stream() if isinstance(ip_list, CandidateList) else ip_list
+        with self.trace.span("select") as a:
+            best_ip, lat = SmartSelector.pick_best(src, callback, report, self.history, leader, **self.probe_opts()); a['best'] = best_ip
+            if self.history: self.history.save()
+        if report.get('streamed'): self.msg(f"📥 流式读取 {report['streamed']} 个候选", "#94a3b8")
+        if report.get('skipped'): self.msg(f"⏭ 跳过 {report['skipped']} 个长期失败的候选", "#94a3b8")
+        if report.get('searched'): self.msg(f"🔎 网段自适应搜索共探测 {report['searched']} 个地址", "#94a3b8")
+        if c := report.get('cutoff'):
+            why = f"已有 {c['good_k']} 个候选不超过 {c['good_ms']}ms" if c['reason'] == "good" else "到达截止时间"
+            self.msg(f"⏩ {why}，提前结束首轮测速 (完成 {c['done']}，取消 {c['cancelled']})", "#94a3b8")
+        if d := report.get('dns'):
+            self.msg(f"🌐 {len(d)} 个域名展开为 {sum(n for n, _ in d.values())} 个地址，解析耗时 最长 {max(ms for _, ms in d.values()):.0f}ms (不计入连接延迟)", "#94a3b8")
+        if best_ip:
+            self.emit_scores(report.get('scores'))
+            self.standby = [r['target'] for r in report.get('scores') or [] if r['target'] != best_ip]
+            self.lats.update({r['target']: r['p50'] for r in report.get('scores') or []}); self.lats[best_ip] = lat
+            self.bw.update({r['target']: r['bps'] for r in report.get('scores') or [] if r.get('bps')})
+        return best_ip, lat
+
+    def provisional(self, ip_list):
+        # 并行启动使用的临时 IP：列表中第一个未被历史跳过的候选；只有一个候选时无需并行
+        raw, blocks = SmartSelector.split_blocks(SmartSelector.parse_list(ip_list))
+        if len(raw) + len(blocks) < 2 and not blocks: return None
+        for t in raw:
+            if not (self.history and self.history.skip(t)): return t
+        if blocks: b = blocks[0]; return SmartSelector.fmt_addr(b[0], b[2], b[3])
+        return raw[0] if raw else None
+
+    def background_probe(self, ip_list, cur_ip, cur_lat=None):
+        # cur_lat 为 None 表示 cur_ip 是并行启动的临时 IP，以本轮测速结果为准 (未进入复测即视为更差)
+        t0 = time.monotonic(); best_ip, lat = self.select(ip_list); sel_ms = (time.monotonic() - t0) * 1000
+        if not self.running or not best_ip: return
+        spec = cur_lat is None
+        if spec: cur_lat = self.lats.get(cur_ip, SmartSelector.FAIL)
+        if best_ip != cur_ip and lat < cur_lat * self.SWITCH_RATIO and cur_lat - lat > self.SWITCH_MIN_MS:
+            self.msg(f"🔄 后台测速发现更优 IP: {best_ip} ({lat:.1f}ms)，替换 {cur_ip} ({self.fmt_ms(cur_lat)})", "#10b981")
+            if self.retarget(best_ip, lat): cur_ip, cur_lat = best_ip, lat
+        else:
+            self.msg(f"✅ 后台测速完成，保持 {cur_ip} (最优 {best_ip} {lat:.1f}ms)", "#10b981")
+            self.latency(self.fmt_lat(cur_ip, cur_lat))
+        if self.monitor: self.monitor.set_active(cur_ip, cur_lat, self.standby)
+        else: self.start_monitor(cur_ip, cur_lat)
+        if spec and self.measured.wait(30) and self.ready_ms is not None:
+            # 串行启动的耗时约为 测速 + 核心就绪，并行后约为两者中较长的一段
+            self.msg(f"⏱ 并行启动: 测速 {sel_ms:.0f}ms，核心就绪 {self.ready_ms:.0f}ms，比串行约节省 {min(sel_ms, self.ready_ms):.0f}ms", "#6366f1")
+
+    @staticmethod
+    def fmt_ms(lat): return "不可达" if lat >= SmartSelector.FAIL else f"{lat:.1f}ms"
+
+    def start_monitor(self, active, lat):
+        o = {**HealthMonitor.DEFAULTS, **(self.cfg.get('health') or {})}
+        if not o['enabled'] or not self.standby: return
+        self.monitor = HealthMonitor(active, lat, self.standby, self.retarget, self.msg, o, self.probe_opts())
+        self.monitor.start()
+
+    def retarget(self, sel_ip, lat=None, slot=None):
+        # 优先通过控制命令原地切换 (已有连接不中断)，失败时重启核心
+        with self._swap_lock:
+            ok = self.running and ProcessManager.send_ctl(f"IP {sel_ip}", slot)
+        if not ok:
+            if slot is not None: self.balancer.drain(slot)
+            ok = self.restart_core(sel_ip, slot)
+            if slot is not None: self.balancer.drain(slot, False)
+        if not ok: return False
+        if lat: self.lats[sel_ip] = lat
+        if slot is None: self.latency(self.fmt_lat(sel_ip, lat))
+        else: self.cores[slot]['ip'] = sel_ip; self.balancer.set_latency(slot, lat); self.latency(self.fmt_pool())
+        return True
+
+    def restart_core(self, sel_ip, slot=None):
+        with self._swap_lock:
+            if not self.running: return False
+            listen = f"127.0.0.1:{self.cores[slot]['port']}" if slot is not None else None
+            p = self.spawn(self.build_cmd(sel_ip, listen), slot)
+            if not p: return False
+            if slot is None: self.p = p
+            else: self.cores[slot]['proc'] = p
+        return True
+
+    def fmt_lat(self, ip, lat=None):
+        l = f"{int(lat)}ms" if lat is not None else "--"
+        return f"{l} | {self.bw[ip] / 1048576:.1f}MB/s | {ip}" if self.bw.get(ip) else f"{l} | {ip}"
+
+    def emit_scores(self, scores):
+        if not scores: return
+        lines = [f"#{i+1} {r['target']}  p50 {r['p50']}ms / p90 {r['p90']}ms  丢包 {r['loss']*100:.0f}%  超时 {r['timeouts']}  评分 {r['score']}"
+                 + (f"  (TCP {r['tcp']} + TLS {r['tls']} + WS {r['ws']})" if 'tls' in r else "")
+                 + (f"  吞吐 {r['bps'] / 1048576:.2f}MB/s 首字节 {r['ttfb']}ms" if r.get('bps') else "")
+                 for i, r in enumerate(scores)]
+        for l in lines: self.msg(f"   {l}", "#94a3b8")
+        self.scores("\n".join(lines))
+
+    # 出口检测：ttl 为缓存有效期 (秒)；sources 可替换为本地模拟接口，format 取 ipsb / ipip / ipinfo / plain
+    GEO_DEFAULTS = {"enabled": True, "ttl": 6 * 3600, "timeout": 8, "ready_timeout": 20, "sources": [
+        {"name": "IPIP", "url": "https://myip.ipip.net/json", "format": "ipip"},
+        {"name": "IPSB", "url": "https://api.ip.sb/geoip", "format": "ipsb"},
+        {"name": "INFO", "url": "https://ipinfo.io/json", "format": "ipinfo"}]}
+    GEO_FORMATS = {
+        "ipsb": lambda d: f"{d.get('country_code','')} {d.get('ip','')}",
+        "ipip": lambda d: f"{''.join(d.get('data',{}).get('location',[]))} {d.get('data',{}).get('ip','')}",
+        "ipinfo": lambda d: f"{d.get('country','')} {d.get('org','')} {d.get('ip','')}",
+        "plain": lambda d: f"{d.get('country', '')} {d.get('ip', '')}".strip(),
+    }
+
+    @staticmethod
+    def local_addr(listen_addr):
+        # 监听在全部地址时改为通过回环地址访问
+        host, port = SmartSelector.split_target(listen_addr.split("://")[-1], 30000)
+        return {'': '127.0.0.1', '0.0.0.0': '127.0.0.1', '::': '::1'}.get(host, host), port
+
+    def wait_ready(self, addrs, timeout=20):
+        """等待核心就绪：监听端口可连接或出现启动日志；返回自启动起的毫秒数，超时返回 None"""
+        t0 = time.monotonic()
+        while self.running and time.monotonic() - t0 < timeout:
+            if self.ready.wait(0.05) or any(self._accepts(a) for a in addrs):
+                self.ready_ms = (time.monotonic() - t0) * 1000; self.ready.set(); break
+        self.measured.set()
+        return self.ready_ms
+
+    @staticmethod
+    def _accepts(addr):
+        try: socket.create_connection(addr, 0.2).close(); return True
+        except OSError: return False
+
+    def check_geoip(self, listen_addr, addrs=None):
+        o = {**self.GEO_DEFAULTS, **(self.cfg.get('geo') or {})}
+        host, port = self.local_addr(listen_addr)
+        with self.trace.span("ready_wait"): ms = self.wait_ready(addrs or [(host, port)], o['ready_timeout'])
+        if not self.running: return
+        if ms is None: self.msg(f"⚠️ 核心在 {o['ready_timeout']} 秒内未就绪", "#fbbf24"); return
+        self.msg(f"🚀 核心已就绪，用时 {ms:.0f}ms", "#10b981")
+        if not o['enabled']: return
+
+        key = f"{self.cfg.get('server', '')}|{self.edge}"; cache = GeoCache()
+        if text := cache.get(key, o['ttl']):
+            self.trace.instant("geo_cached"); self.geo(text); self.msg(f"🌍 出口检测 (缓存):\n{text}", "#3b82f6"); return
+
+        import urllib.request
+        proxy_url = f"http://[{host}]:{port}" if ":" in host else f"http://{host}:{port}"
+        proxy_handler = urllib.request.ProxyHandler({'http': proxy_url, 'https': proxy_url})
+        opener = urllib.request.build_opener(proxy_handler)
+        opener.addheaders = [('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')]
+
+        results = {}
+        
+        def fetch(src):
+            try:
+                with opener.open(src['url'], timeout=o['timeout']) as res:
+                    results[src['name']] = self.GEO_FORMATS.get(src.get('format'), self.GEO_FORMATS['plain'])(json.loads(res.read().decode()))
+            except Exception:
+                results[src['name']] = "超时/失败"
+
+        with self.trace.span("geo", sources=len(o['sources'])), futures.ThreadPoolExecutor(max_workers=max(1, len(o['sources']))) as executor:
+            for src in o['sources']: executor.submit(fetch, src)
+        
+        final_text = "\n".join(f"{src['name']}: {results.get(src['name'], '--')}" for src in o['sources'])
+        if any(v != "超时/失败" for v in results.values()): cache.put(key, final_text)
+        
+        self.geo(final_text)
+        self.msg(f"🌍 多源检测完成:\n{final_text}", "#3b82f6")
+
+    def stop(self):
+        self.running = False; self.trace.begin("stop", track="runner")  # 到 run() 退出为止
+        for m in [self.monitor] + self.monitors:
+            if m: m.stop()
+        if self.balancer: self.balancer.stop()
+        if self.metrics: self.metrics.stop(); self.metrics = None
+        ProcessManager.kill_current()
+
+# ==================== 8. 无界面模式 ====================
+def find_profile(cfg, key):
+    return cfg.get(key) or next((s for s in cfg.data['servers'] if s.get('name') == key), None)
+
+def main(argv=None):
+    import argparse, signal
+    ap = argparse.ArgumentParser(prog="ech-headless", description="无界面运行：按配置优选 IP 并守护核心进程，日志输出到标准输出")
+    ap.add_argument('--headless', action='store_true', help=argparse.SUPPRESS)
+    ap.add_argument('-c', '--config', default=str(CONFIG_FILE), help="配置文件路径 (默认为程序目录下的 config.json)")
+    ap.add_argument('-p', '--profile', help="方案名称或 id (默认使用当前方案)")
+    ap.add_argument('--list', action='store_true', help="列出所有方案后退出")
+    ap.add_argument('--select-only', action='store_true', help="只执行优选并输出结果，不启动核心")
+    ap.add_argument('--scan', type=int, nargs='?', const=10, metavar='N', help="同时测速全部方案，输出每个方案前 N 名后退出")
+    ap.add_argument('--bypass', nargs='+', metavar='HOST', help="按方案的分流模式检测这些域名/IP 是否直连后退出")
+    ap.add_argument('--retry', type=float, default=5.0, help="核心异常退出后的重启间隔秒数，0 表示不重启")
+    ap.add_argument('--trace-export', metavar='PATH', help="把最近一次启动的阶段追踪导出为 Chrome trace JSON 后退出")
+    ap.add_argument('--trace-compare', action='store_true', help="对比最近两次启动的各阶段耗时后退出")
+    a = ap.parse_args(argv)
+
+    traces = TraceStore(Path(a.config).with_name(TRACE_FILE.name))
+    if a.trace_export or a.trace_compare:
+        if len(traces.items) < (2 if a.trace_compare else 1): print("启动追踪记录不足", file=sys.stderr); return 1
+        if a.trace_export: traces.export(a.trace_export); print(f"已导出: {a.trace_export}")
+        if a.trace_compare: print("\n".join(traces.compare()))
+        return 0
+
+    cfg = ConfigManager(a.config)
+    if a.list:
+        for s in cfg.data['servers']: print(f"{'*' if s['id'] == cfg.data.get('current') else ' '} {s['id']}  {s.get('name', '')}")
+        return 0
+    prof = find_profile(cfg, a.profile) if a.profile else cfg.get_cur()
+    if not prof: print(f"未找到方案: {a.profile}", file=sys.stderr); return 2
+
+    def log(t, c=None): print(f"[{datetime.now().strftime('%H:%M:%S')}] {t}", flush=True)
+
+    history = ProbeHistory(Path(a.config).with_name(HISTORY_FILE.name))
+    if a.scan is not None:
+        rows = []; ProfileScan(cfg.data['servers'], cfg.ext_dir, cfg.data.get('scan'), rows.extend, log).run()
+        for prof in cfg.data['servers']:
+            best = sorted((r for r in rows if r['pid'] == prof['id'] and r['p50'] is not None), key=lambda r: r['score'])
+            history.record_many(prof['id'], [(r['target'], r['p50'] if r['p50'] is not None else SmartSelector.FAIL) for r in rows if r['pid'] == prof['id']])
+            for r in best[:a.scan]: print(f"{prof.get('name', '')}\t{r['target']}\t{r['p50']}\t{r['jitter']}\t{r['loss'] * 100:.0f}%")
+        history.save(); return 0
+    if a.bypass:
+        idx = ChinaIndex(); idx.ensure(log) or idx.load()
+        for h in a.bypass:
+            direct, ips = idx.would_bypass(h, prof.get('routing', 'bypass_cn'))
+            print(f"{h}\t{'direct' if direct else 'proxy'}\t{','.join(ips)}")
+        return 0
+    if a.select_only:
+        r = CoreRunner(prof, history, msg=log); r.store_dir = cfg.ext_dir
+        best, lat = r.select(r.candidates(), log)
+        if not best: log("优选失败"); return 1
+        print(f"{best} {lat:.1f}"); return 0
+
+    runner = None; stopping = threading.Event()
+    def on_signal(*_):
+        stopping.set()
+        if runner: runner.stop()
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, 'SIGTERM'): signal.signal(signal.SIGTERM, on_signal)
+
+    log(f"方案: {prof.get('name', '')}  监听: {prof.get('listen', '')}")
+    if prof.get('routing', 'bypass_cn') == 'bypass_cn':
+        try: ChinaIndex().ensure(log)
+        except OSError as e: log(f"⚠️ 中国 IP 索引生成失败: {e}")
+    errors = []
+    while not stopping.is_set():
+        runner = CoreRunner(prof, history, msg=log, status=lambda t: log(f"状态: {t}"), latency=lambda t: log(f"节点: {t}"),
+                            error=errors.append, traces=traces)
+        runner.store_dir = cfg.ext_dir
+        runner.run(); history.save()
+        if stopping.is_set() or errors or a.retry <= 0: break
+        log(f"⚠️ 核心已退出，{a.retry:g} 秒后重新启动"); stopping.wait(a.retry)
+    for e in errors: log(f"❌ {e}")
+    ProcessManager.kill_current()
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
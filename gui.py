@@ -1,45 +1,28 @@
+import io
 import sys
-import json
 import os
-import subprocess
-import time
 import socket
-import concurrent.futures
-import atexit
-import winreg
 import threading
-import statistics
-import urllib.request
-from pathlib import Path
-from datetime import datetime
-
-# ==================== 0. 路径与环境 ====================
-def resource_path(relative_path):
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, relative_path)
-    return os.path.join(os.path.abspath("."), relative_path)
-
-def get_app_path():
-    if getattr(sys, 'frozen', False):
-        return Path(sys.executable).parent
-    return Path(__file__).parent.absolute()
-
-APP_ROOT = get_app_path()
-CONFIG_FILE = APP_ROOT / "config.json"
-ICON_PATH = resource_path("icon.ico")
-CORE_EXE_NAME = "ech-workers.exe"
-CORE_PATH = APP_ROOT / CORE_EXE_NAME
+import time
+
+from ech_core import APP_ROOT, ICON_PATH, ProcessManager, AutoStartManager, ConfigManager, ProbeHistory, LogPipe, CoreRunner, TraceStore, CandidateImporter, CandidateList, ProfileScan, SmartSelector, ChinaIndex, PacFile, PacServer
+
+# 无界面模式在导入 PyQt 之前分流，可在没有图形环境的 Linux 上运行
+if __name__ == '__main__' and '--headless' in sys.argv:
+    from ech_core import main as headless_main
+    sys.exit(headless_main())
 
 # ==================== 1. 依赖库 ====================
 try:
     from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                                   QHBoxLayout, QLabel, QLineEdit, QPushButton, 
-                                  QComboBox, QTextEdit, QPlainTextEdit, QFrame, QGridLayout, 
+                                  QComboBox, QPlainTextEdit, QFrame, QGridLayout, 
                                   QSystemTrayIcon, QMenu, QStackedWidget, 
                                   QInputDialog, QMessageBox, QSizePolicy, QListView,
-                                  QCheckBox)
-    from PyQt5.QtCore import (Qt, QThread, pyqtSignal, QTimer, QPoint, QSize, QObject)
-    from PyQt5.QtGui import (QColor, QFont, QPainter, QBrush, QPen, QRadialGradient, QIcon)
+                                  QCheckBox, QFileDialog, QTableView, QHeaderView, QAbstractItemView)
+    from PyQt5.QtCore import (Qt, QThread, pyqtSignal, QTimer, QPoint, QSize, QObject,
+                              QAbstractTableModel, QSortFilterProxyModel, QModelIndex, QEvent)
+    from PyQt5.QtGui import (QColor, QFont, QPainter, QBrush, QPen, QRadialGradient, QIcon, QTextCursor, QTextCharFormat)
 except ImportError:
     sys.exit(1)
 
@@ -54,186 +37,6 @@ PALETTE = {
     "border": "#cbd5e1", "btn_bg": "#f1f5f9"
 }
 
-# ==================== 3. 进程管理 ====================
-class ProcessManager:
-    _current_proc = None
-    _lock = threading.Lock()
-
-    @staticmethod
-    def start_process(cmd):
-        with ProcessManager._lock:
-            ProcessManager._kill_unsafe()
-            try:
-                si = subprocess.STARTUPINFO()
-                si.dwFlags |= subprocess.STARTF_USESHOWWINDOW if sys.platform=='win32' else 0
-                ProcessManager._current_proc = subprocess.Popen(
-                    cmd, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.STDOUT, 
-                    startupinfo=si, 
-                    bufsize=0,
-                    creationflags=0x08000000 if sys.platform=='win32' else 0
-                )
-                return ProcessManager._current_proc
-            except Exception: return None
-
-    @staticmethod
-    def kill_current():
-        with ProcessManager._lock:
-            ProcessManager._kill_unsafe()
-
-    @staticmethod
-    def _kill_unsafe():
-        p = ProcessManager._current_proc
-        if p:
-            try: p.terminate()
-            except: pass
-            if sys.platform == 'win32' and p.pid:
-                try: subprocess.run(['taskkill', '/F', '/T', '/PID', str(p.pid)], 
-                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=0x08000000)
-                except: pass
-            try: p.kill()
-            except: pass
-            ProcessManager._current_proc = None
-
-atexit.register(ProcessManager.kill_current)
-
-# ==================== 4. 注册表/自启 ====================
-class AutoStartManager:
-    KEY_PATH = r"Software\Microsoft\Windows\CurrentVersion\Run"
-    APP_KEY = "ECHWorkersClient"
-    @staticmethod
-    def get_command():
-        if getattr(sys, 'frozen', False): return f'"{sys.executable}" -autostart'
-        return f'"{sys.executable}" "{__file__}" -autostart'
-    @staticmethod
-    def set_autostart(enable=True):
-        if sys.platform != 'win32': return
-        try:
-            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, AutoStartManager.KEY_PATH, 0, winreg.KEY_SET_VALUE)
-            if enable: winreg.SetValueEx(key, AutoStartManager.APP_KEY, 0, winreg.REG_SZ, AutoStartManager.get_command())
-            else: 
-                try: winreg.DeleteValue(key, AutoStartManager.APP_KEY)
-                except: pass
-            winreg.CloseKey(key)
-        except: pass
-    @staticmethod
-    def check_status():
-        if sys.platform != 'win32': return False
-        try:
-            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, AutoStartManager.KEY_PATH, 0, winreg.KEY_READ)
-            val, _ = winreg.QueryValueEx(key, AutoStartManager.APP_KEY)
-            winreg.CloseKey(key); return True if val else False
-        except: return False
-
-# ==================== 5. 核心算法 ====================
-class SmartSelector:
-    @staticmethod
-    def tcp_ping(target, port=443, timeout=1.0):
-        s = None
-        try:
-            real_host = target
-            real_port = port
-            
-            # 支持 IP:Port 或 Domain:Port 格式解析
-            if ":" in target:
-                parts = target.rsplit(":", 1)
-                # 简单的 IPv4/域名 端口分离
-                if len(parts) == 2 and parts[1].isdigit():
-                    real_host = parts[0].strip("[]")
-                    real_port = int(parts[1])
-            
-            ip = socket.gethostbyname(real_host)
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(timeout)
-            t0 = time.perf_counter()
-            s.connect((ip, real_port))
-            lat = (time.perf_counter() - t0) * 1000
-            return (target, lat)
-        except: 
-            return (target, 99999)
-        finally:
-            if s: s.close()
-
-    @staticmethod
-    def pick_best(ip_text, callback_msg=None):
-        raw = [l.strip() for l in ip_text.split('\n') if l.strip() and not l.strip().startswith("#")]
-        if not raw: return None, 0
-        if len(raw) == 1: return SmartSelector.tcp_ping(raw[0], 443, 2.0)
-
-        if callback_msg: callback_msg.emit("正在测速...")
-        candidates = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(raw), 64)) as ex:
-            f_map = {ex.submit(SmartSelector.tcp_ping, ip, 443, 1.0): ip for ip in raw}
-            for f in concurrent.futures.as_completed(f_map):
-                try:
-                    ip, lat = f.result()
-                    if lat < 5000: candidates.append((ip, lat))
-                except: pass
-        
-        if not candidates: return raw[0], 0 
-        candidates.sort(key=lambda x: x[1])
-        top = candidates[:5]
-        if top[0][1] < 15: return top[0]
-
-        if callback_msg: callback_msg.emit("复测稳定性...")
-        scored = []
-        for ip, first_lat in top:
-            samples = [first_lat]
-            for _ in range(3):
-                _, l = SmartSelector.tcp_ping(ip, 443, 1.5)
-                if l < 5000: samples.append(l)
-                time.sleep(0.05)
-            if not samples: continue
-            avg = statistics.mean(samples)
-            jit = statistics.stdev(samples) if len(samples) > 1 else 0
-            scored.append((ip, avg, avg + jit * 1.5))
-        
-        scored.sort(key=lambda x: x[2])
-        return (scored[0][0], scored[0][1]) if scored else top[0]
-
-# ==================== 6. 配置管理 ====================
-class ConfigManager:
-    def __init__(self):
-        self.data = {"servers": [], "current": None}; self.load()
-    def load(self):
-        try:
-            if CONFIG_FILE.exists():
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f: self.data.update(json.load(f))
-            if not self.data.get('servers'): self.add_default(); return
-            dirty = False
-            for s in self.data['servers']:
-                if 'id' not in s: import uuid; s['id'] = str(uuid.uuid4()); dirty = True
-                if 'auto_best' not in s: s['auto_best'] = True; dirty = True
-            if not self.data.get('current') and self.data['servers']: self.data['current'] = self.data['servers'][0]['id']; dirty = True
-            if dirty: self.save()
-        except: self.add_default()
-    def save(self):
-        try:
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f: json.dump(self.data, f, indent=2, ensure_ascii=False)
-        except: pass
-    def add_default(self):
-        import uuid; uid = str(uuid.uuid4())
-        self.data['servers'] = [{"id": uid, "name": "默认配置", "server": "", "listen": "127.0.0.1:30000", "token": "", "ip_list": "", "routing": "bypass_cn", "auto_best": True}]
-        self.data['current'] = uid; self.save()
-    def get_cur(self):
-        for s in self.data['servers']: 
-            if s['id'] == self.data['current']: return s
-        if self.data['servers']: self.data['current'] = self.data['servers'][0]['id']; return self.data['servers'][0]
-        return {}
-    def update_cur(self, val):
-        for i, s in enumerate(self.data['servers']):
-            if s['id'] == val['id']: self.data['servers'][i] = val
-        self.save()
-    def add_new(self, name):
-        import uuid; new = self.get_cur().copy(); new['id'] = str(uuid.uuid4()); new['name'] = name
-        self.data['servers'].append(new); self.data['current'] = new['id']; self.save()
-    def del_cur(self):
-        if len(self.data['servers']) <= 1: return
-        self.data['servers'] = [s for s in self.data['servers'] if s['id'] != self.data['current']]
-        self.data['current'] = self.data['servers'][0]['id']; self.save()
-    def rename_cur(self, n): s = self.get_cur(); s['name'] = n; self.update_cur(s)
-
 class SingleInstance(QObject):
     signal_wake_up = pyqtSignal()
     def __init__(self, port=56789):
@@ -254,117 +57,33 @@ class SingleInstance(QObject):
 # ==================== 7. 工作线程 ====================
 class WorkerThread(QThread):
     msg = pyqtSignal(str, str); status_change = pyqtSignal(str); latency_result = pyqtSignal(str); geo_result = pyqtSignal(str)
-    error_alert = pyqtSignal(str); finished_safe = pyqtSignal()
-    
-    def __init__(self, cfg): super().__init__(); self.cfg = cfg; self.running = False
-    
+    error_alert = pyqtSignal(str); finished_safe = pyqtSignal(); score_result = pyqtSignal(str)
+
+    def __init__(self, cfg, history=None, logs=None, traces=None):
+        super().__init__()
+        self.core = CoreRunner(cfg, history, logs, msg=self.msg.emit, status=self.status_change.emit, latency=self.latency_result.emit,
+                               geo=self.geo_result.emit, error=self.error_alert.emit, scores=self.score_result.emit, traces=traces)
+
+    @property
+    def running(self): return self.core.running
+
     def run(self):
-        self.running = True
-        if not CORE_PATH.exists(): 
-            self.msg.emit(f"❌ 核心缺失: {CORE_EXE_NAME}", "#ef4444")
-            self.error_alert.emit("核心文件丢失"); self.finished_safe.emit(); return
-        
-        listen_addr = self.cfg.get('listen', '127.0.0.1:30000')
-        if ':' in listen_addr:
-             try:
-                 p = int(listen_addr.split(':')[-1]); s = socket.socket(); 
-                 if s.connect_ex(('127.0.0.1', p)) == 0: ProcessManager.kill_current()
-                 s.close()
-             except: pass
-        
-        ip_list = self.cfg.get('ip_list', ''); sel_ip = None
-        use_auto = self.cfg.get('auto_best', True)
-
-        if ip_list.strip():
-            if use_auto:
-                self.status_change.emit("...")
-                best_ip, lat = SmartSelector.pick_best(ip_list, self.status_change)
-                if best_ip:
-                    self.msg.emit(f"✅ 优选结果: {best_ip} (Lat: {lat:.1f}ms)", "#10b981")
-                    self.latency_result.emit(f"{int(lat)}ms | {best_ip}"); sel_ip = best_ip
-                else: 
-                    self.latency_result.emit("优选失败")
-            else:
-                raw = [l.strip() for l in ip_list.split('\n') if l.strip() and not l.strip().startswith("#")]
-                if raw:
-                    sel_ip = raw[0]
-                    self.msg.emit(f"🔒 使用固定 IP: {sel_ip}", "#6366f1")
-                    self.latency_result.emit(f"固定 | {sel_ip}")
-                else:
-                    self.latency_result.emit("列表为空")
-        else: 
-            self.latency_result.emit("直连模式 (Direct)")
-        
-        cmd = [str(CORE_PATH)]
-        keys = {'-f':'server', '-l':'listen', '-token':'token', '-routing':'routing'}
-        for f, k in keys.items():
-            if v := self.cfg.get(k): cmd.extend([f, str(v).strip()])
-        
-        # [修改] 关键修正：不再剥离端口
-        # 因为新的 Go 核心代码已经更新，可以正确处理 IP:Port 格式
-        # 直接将用户优选出来的结果 (如 47.76.60.217:7548) 传给核心
-        if sel_ip:
-            cmd.extend(['-ip', sel_ip])
-        
-        self.status_change.emit("运行中")
-        try:
-            self.p = ProcessManager.start_process(cmd)
-            if self.p:
-                threading.Thread(target=self.check_geoip, args=(listen_addr,), daemon=True).start()
-                while self.running:
-                    try:
-                        l = self.p.stdout.readline()
-                        if not l: break
-                        t = l.decode('utf-8', 'replace').strip()
-                        if t: 
-                            if "connected" in t.lower(): self.msg.emit(t, "#10b981")
-                            elif "error" in t.lower() or "panic" in t.lower(): self.msg.emit(t, "#ef4444")
-                            else: self.msg.emit(t, "#94a3b8")
-                    except: break
-            else: self.error_alert.emit("启动失败")
-        except Exception as e: self.msg.emit(str(e), "#ef4444")
-        self.running = False; self.finished_safe.emit()
-
-    def check_geoip(self, listen_addr):
-        time.sleep(5) 
-        if not self.running: return
-
-        proxy_url = f"http://{listen_addr}" if "://" not in listen_addr else listen_addr
-        if "127.0.0.1" not in proxy_url and "localhost" not in proxy_url: proxy_url = "http://127.0.0.1:30000"
-        
-        proxy_handler = urllib.request.ProxyHandler({'http': proxy_url, 'https': proxy_url})
-        opener = urllib.request.build_opener(proxy_handler)
-        opener.addheaders = [('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')]
+        self.core.run(); self.finished_safe.emit()
 
-        results = {}
-        
-        def fetch(url, name, parser_func):
-            try:
-                with opener.open(url, timeout=15) as res:
-                    data = json.loads(res.read().decode())
-                    results[name] = parser_func(data)
-            except Exception as e:
-                results[name] = "超时/失败"
-
-        def parse_ipsb(d): return f"{d.get('country_code','')} {d.get('ip','')}"
-        def parse_ipip(d): return f"{''.join(d.get('data',{}).get('location',[]))} {d.get('data',{}).get('ip','')}"
-        def parse_ipinfo(d): return f"{d.get('country','')} {d.get('org','')} {d.get('ip','')}"
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            executor.submit(fetch, "https://api.ip.sb/geoip", "IP.SB", parse_ipsb)
-            executor.submit(fetch, "https://myip.ipip.net/json", "IPIP", parse_ipip)
-            executor.submit(fetch, "https://ipinfo.io/json", "IPINFO", parse_ipinfo)
-        
-        final_text = (
-            f"IPIP: {results.get('IPIP', '--')}\n"
-            f"IPSB: {results.get('IP.SB', '--')}\n"
-            f"INFO: {results.get('IPINFO', '--')}"
-        )
-        
-        self.geo_result.emit(final_text)
-        self.msg.emit(f"🌍 多源检测完成:\n{final_text}", "#3b82f6")
+    def stop(self): self.core.stop()
 
-    def stop(self): self.running = False; ProcessManager.kill_current()
+class ImportThread(QThread):
+    """后台导入候选列表 (粘贴内容/本地文件/在线来源)，规范化去重后写入外置文件"""
+    msg = pyqtSignal(str, str); progress = pyqtSignal(int); done = pyqtSignal(int)
+
+    def __init__(self, sources, dest):
+        super().__init__(); self.sources = sources; self.dest = dest
+
+    def run(self):
+        imp = CandidateImporter(self.sources, log_fn=self.msg.emit); n = 0
+        for n, _ in enumerate(imp.stream(tee=self.dest), 1):
+            if n % 5000 == 0: self.progress.emit(n)
+        self.done.emit(n)
 
 # ==================== 8. UI 组件 ====================
 class SidebarItem(QPushButton):
@@ -393,13 +112,14 @@ class ToggleButton(QPushButton):
 class BigPowerButton(QPushButton):
     def __init__(self, parent=None):
         super().__init__(parent); self.setFixedSize(130, 130); self.setCursor(Qt.PointingHandCursor)
-        self.active = False; self.hover = False; self.pulse = 0; self.pulse_dir = 1
+        self.active = False; self.hover = False; self.pulse = 0; self.pulse_dir = 1; self.paused = False; self.frames = 0
         self.timer = QTimer(self); self.timer.timeout.connect(self.update)
-    def set_active(self, val): self.active = val; self.timer.start(40) if val else self.timer.stop(); self.update()
+    def set_active(self, val): self.active = val; self.timer.start(40) if val and not self.paused else self.timer.stop(); self.update()
+    def set_paused(self, val): self.paused = val; self.set_active(self.active)  # 窗口隐藏时停止呼吸动画
     def enterEvent(self, e): self.hover = True; self.update()
     def leaveEvent(self, e): self.hover = False; self.update()
     def paintEvent(self, e):
-        p = QPainter(self); p.setRenderHint(QPainter.Antialiasing)
+        p = QPainter(self); p.setRenderHint(QPainter.Antialiasing); self.frames += 1
         if not self.isEnabled(): base = QColor("#e2e8f0"); icon_c = QColor("#cbd5e1"); glow = False
         else:
             base = QColor(PALETTE['success']) if self.active else QColor(PALETTE['primary']) if self.hover else QColor("#e2e8f0")
@@ -414,14 +134,99 @@ class BigPowerButton(QPushButton):
         pen = QPen(icon_c, 4, Qt.SolidLine, Qt.RoundCap); p.setPen(pen); p.setBrush(Qt.NoBrush)
         p.drawArc(45,45,40,40,135*16,270*16); p.drawLine(65,38,65,65)
 
+class ScanThread(QThread):
+    """后台运行多方案对比测速，结果分批通过 rows 信号送回界面线程"""
+    rows = pyqtSignal(list); msg = pyqtSignal(str, str)
+
+    def __init__(self, profiles, store_dir, opts=None):
+        super().__init__(); self.scan = ProfileScan(profiles, store_dir, opts, self.rows.emit, self.msg.emit)
+
+    def run(self): self.scan.run()
+    def stop(self): self.scan.stop()
+
+class ScanModel(QAbstractTableModel):
+    """对比测速结果表：只在追加时通知视图，QTableView 按可见区域取数据，上万行也能流畅滚动"""
+    COLS = ["方案", "候选", "延迟 (ms)", "抖动 (ms)", "丢包"]
+    def __init__(self):
+        super().__init__(); self.items = []
+    def rowCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.items)
+    def columnCount(self, parent=QModelIndex()): return len(self.COLS)
+    def headerData(self, i, orient, role=Qt.DisplayRole):
+        if orient == Qt.Horizontal and role == Qt.DisplayRole: return self.COLS[i]
+    def add_rows(self, rows):
+        if not rows: return
+        n = len(self.items); self.beginInsertRows(QModelIndex(), n, n + len(rows) - 1); self.items += rows; self.endInsertRows()
+    def clear(self): self.beginResetModel(); self.items = []; self.endResetModel()
+    def data(self, idx, role=Qt.DisplayRole):
+        r = self.items[idx.row()]; c = idx.column()
+        if role == Qt.UserRole:  # 排序键：不可达的排在最后
+            return (r['profile'], r['target'], r['p50'] if r['p50'] is not None else SmartSelector.FAIL,
+                    r['jitter'] if r['jitter'] is not None else SmartSelector.FAIL, r['loss'])[c]
+        if role == Qt.DisplayRole:
+            if c == 0: return r['profile']
+            if c == 1: return r['target']
+            if c == 4: return f"{r['loss'] * 100:.0f}%"
+            v = r['p50'] if c == 2 else r['jitter']
+            return "超时" if v is None else f"{v:.1f}"
+        if role == Qt.TextAlignmentRole and c >= 2: return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role == Qt.ForegroundRole and r['p50'] is None: return QColor("#94a3b8")
+
+class ScanFilter(QSortFilterProxyModel):
+    """按关键字 (方案/候选)、方案与是否可达过滤"""
+    def __init__(self):
+        super().__init__(); self.text = ""; self.pid = None; self.hide_dead = False; self.setSortRole(Qt.UserRole)
+    def set_filter(self, text=None, pid=False, hide_dead=None):
+        if text is not None: self.text = text.lower()
+        if pid is not False: self.pid = pid
+        if hide_dead is not None: self.hide_dead = hide_dead
+        self.invalidateFilter()
+    def filterAcceptsRow(self, i, parent):
+        r = self.sourceModel().items[i]
+        if self.pid and r['pid'] != self.pid: return False
+        if self.hide_dead and r['p50'] is None: return False
+        return not self.text or self.text in r['target'] or self.text in r['profile'].lower()
+
+class CandidateEdit(QPlainTextEdit):
+    """优选列表编辑框：超过 PASTE_MAX 行的粘贴不放入编辑框，改为导入外置列表，避免界面卡顿"""
+    PASTE_MAX = 2000
+    bulk_paste = pyqtSignal(str)
+    def insertFromMimeData(self, src):
+        t = src.text() if src.hasText() else ""
+        if t.count("\n") >= self.PASTE_MAX: self.bulk_paste.emit(t)
+        else: super().insertFromMimeData(src)
+
+class Sparkline(QWidget):
+    """仪表盘上的迷你折线图：标题 + 当前值 + 最近一段时间的走势"""
+    def __init__(self, title, unit="", scale=1.0, color=None, parent=None):
+        super().__init__(parent); self.title = title; self.unit = unit; self.scale = scale; self.values = []
+        self.color = QColor(color or PALETTE['primary']); self.setMinimumSize(170, 58); self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+    def set_values(self, vals): self.values = [v * self.scale for v in vals]; self.update()
+    def paintEvent(self, e):
+        p = QPainter(self); p.setRenderHint(QPainter.Antialiasing); w, h = self.width(), self.height()
+        p.setPen(QPen(QColor(PALETTE['border']), 1)); p.setBrush(QColor("white")); p.drawRoundedRect(0, 0, w-1, h-1, 8, 8)
+        cur = self.values[-1] if self.values else 0
+        p.setFont(QFont("Segoe UI", 8)); p.setPen(QColor(PALETTE['text_gray'])); p.drawText(10, 16, self.title)
+        txt = f"{cur:.0f}{self.unit}" if cur >= 10 or cur == 0 else f"{cur:.1f}{self.unit}"
+        p.setFont(QFont("Segoe UI", 9, QFont.Bold)); p.setPen(QColor(PALETTE['text_dark'])); p.drawText(0, 4, w-10, 16, Qt.AlignRight, txt)
+        if len(self.values) < 2: return
+        top, bot, n = 24, h - 6, len(self.values); hi = max(self.values) or 1.0; step = (w - 20) / (n - 1)
+        pts = [QPoint(int(10 + i*step), int(bot - (v / hi) * (bot - top))) for i, v in enumerate(self.values)]
+        p.setPen(QPen(self.color, 1.6)); p.drawPolyline(*pts)
+
 # ==================== 9. 主窗口 ====================
 class UltraWindow(QMainWindow):
     def __init__(self):
-        super().__init__(); self.cfg = ConfigManager(); self.worker = None
+        super().__init__(); self.cfg = ConfigManager(); self.history = ProbeHistory(); self.traces = TraceStore(); self.worker = None
+        self.cn_idx = ChinaIndex(); self._idx_lock = threading.Lock()
+        self.pac = PacFile(self.cn_idx, self._idx_lock); self.pac_srv = None; self.pac_url = None
+        self._awake = True; self._pending = {}; self.ticks = 0; self.power = {'fg': [0.0, 0.0, 0], 'bg': [0.0, 0.0, 0]}
+        self._pw = (time.monotonic(), time.process_time(), 0)
+        lf = self.cfg.data.get('log_file'); self.logs = LogPipe(spill_path=(APP_ROOT / lf) if lf else None); self._fmts = {}
         self.resize(920, 620); self.setMinimumSize(850, 550); self.setWindowTitle(f"{APP_TITLE} {VER}")
         if os.path.exists(ICON_PATH): self.setWindowIcon(QIcon(ICON_PATH))
-        self.init_ui(); self.load_data(); self.init_tray()
-        if '-autostart' in sys.argv: self.hide(); self.toggle_run()
+        self.init_ui(); self.load_data(); self.init_tray(); self.refresh_index()
+        self.idle_timer = QTimer(self); self.idle_timer.timeout.connect(self.idle_tick)
+        if '-autostart' in sys.argv: self.hide(); self.set_awake(False); self.toggle_run()
         else: self.show()
         
         self.setStyleSheet(f"""
@@ -456,7 +261,7 @@ class UltraWindow(QMainWindow):
         logo = QLabel(APP_TITLE); logo.setFont(QFont("Segoe UI", 15, QFont.Bold)); logo.setAlignment(Qt.AlignCenter); logo.setStyleSheet(f"color:{PALETTE['primary']}; margin-bottom: 20px;")
         sl.addWidget(logo)
         self.btns = []
-        for i, (txt, ico) in enumerate([("运行状态","⚡"), ("配置管理","⚙️"), ("运行日志","📝")]):
+        for i, (txt, ico) in enumerate([("运行状态","⚡"), ("配置管理","⚙️"), ("运行日志","📝"), ("方案对比","📊")]):
             b = SidebarItem(txt, ico); b.clicked.connect(lambda _,x=i: self.switch_page(x))
             sl.addWidget(b); self.btns.append(b)
         sl.addStretch(); ml.addWidget(sb)
@@ -464,6 +269,7 @@ class UltraWindow(QMainWindow):
         self.pages.addWidget(self.create_dash_page())
         self.pages.addWidget(self.create_conf_page())
         self.pages.addWidget(self.create_logs_page())
+        self.pages.addWidget(self.create_scan_page())
 
     def create_dash_page(self):
         p = QWidget(); l = QVBoxLayout(p); l.setAlignment(Qt.AlignCenter); l.setSpacing(25)
@@ -494,9 +300,27 @@ class UltraWindow(QMainWindow):
         self.btn_auto.clicked.connect(lambda: AutoStartManager.set_autostart(self.btn_auto.isChecked()))
         h_btns.addWidget(self.btn_sys); h_btns.addWidget(self.btn_auto)
         il.addLayout(h1); il.addLayout(h_btns)
-        l.addStretch(); l.addWidget(self.btn_pow, 0, Qt.AlignCenter); l.addWidget(self.lbl_st, 0, Qt.AlignCenter); l.addLayout(meta_layout); l.addWidget(info, 0, Qt.AlignCenter); l.addStretch()
+
+        # 实时流量：数据来自核心 -stats 周期输出，由 CoreStats 汇总
+        self.sparks = {k: Sparkline(t, u, s, c) for k, t, u, s, c in [
+            ('conn_rate', "连接/秒", "", 1, None), ('tunnels', "活动隧道", "", 1, PALETTE['success']),
+            ('down_bps', "下行", " KB/s", 1/1024, "#0ea5e9"), ('direct_ratio', "直连占比", "%", 100, "#f59e0b")]}
+        graphs = QWidget(); graphs.setMaximumWidth(520); gl = QGridLayout(graphs); gl.setContentsMargins(0,0,0,0); gl.setSpacing(10)
+        for i, w in enumerate(self.sparks.values()): gl.addWidget(w, i // 2, i % 2)
+        self.stats_timer = QTimer(self); self.stats_timer.timeout.connect(self.refresh_stats); self.stats_timer.start(1000)
+
+        l.addStretch(); l.addWidget(self.btn_pow, 0, Qt.AlignCenter); l.addWidget(self.lbl_st, 0, Qt.AlignCenter); l.addLayout(meta_layout); l.addWidget(info, 0, Qt.AlignCenter)
+        l.addWidget(graphs, 0, Qt.AlignCenter); l.addStretch()
         return p
 
+    def refresh_stats(self):
+        self.ticks += 1
+        if not (self.worker and self.worker.running and self.worker.core.stats) or not self.isVisible(): return
+        series = self.worker.core.stats.snapshot()
+        for k, w in self.sparks.items(): w.set_values(series.get(k, []))
+        hr = series.get('route_hit_ratio') or [0]; tot = self.worker.core.stats.counts()
+        self.sparks['direct_ratio'].setToolTip(f"分流结论缓存: 命中率 {hr[-1] * 100:.0f}% · 已缓存 {tot['route_cached']} 个域名 · 预取 {tot['route_prefetches']} 次")
+
     def create_conf_page(self):
         p = QWidget(); l = QVBoxLayout(p); l.setContentsMargins(25,25,25,25); l.setSpacing(15)
         top = QFrame(); top.setFixedHeight(50); top.setStyleSheet("background:transparent;")
@@ -517,10 +341,10 @@ class UltraWindow(QMainWindow):
             v1 = QVBoxLayout(); v1.setSpacing(6); v1.addWidget(QLabel(l1_txt, styleSheet=f"color:{PALETTE['text_gray']}; font-size:12px;")); v1.addWidget(w1)
             v2 = QVBoxLayout(); v2.setSpacing(6); v2.addWidget(QLabel(l2_txt, styleSheet=f"color:{PALETTE['text_gray']}; font-size:12px;")); v2.addWidget(w2)
             r.addLayout(v1, 1); r.addLayout(v2, 1); return r
-        self.in_srv = QLineEdit(); self.in_srv.setPlaceholderText("例如: my.worker.dev"); self.in_srv.setClearButtonEnabled(True); self.in_srv.setMinimumHeight(36); self.in_srv.textChanged.connect(self.save)
-        self.in_tk = QLineEdit(); self.in_tk.setPlaceholderText("可选 Token"); self.in_tk.setEchoMode(QLineEdit.PasswordEchoOnEdit); self.in_tk.setClearButtonEnabled(True); self.in_tk.setMinimumHeight(36); self.in_tk.textChanged.connect(self.save)
+        self.in_srv = QLineEdit(); self.in_srv.setPlaceholderText("例如: my.worker.dev"); self.in_srv.setClearButtonEnabled(True); self.in_srv.setMinimumHeight(36); self.in_srv.textChanged.connect(self.debounce_save)
+        self.in_tk = QLineEdit(); self.in_tk.setPlaceholderText("可选 Token"); self.in_tk.setEchoMode(QLineEdit.PasswordEchoOnEdit); self.in_tk.setClearButtonEnabled(True); self.in_tk.setMinimumHeight(36); self.in_tk.textChanged.connect(self.debounce_save)
         fl.addLayout(mk_row(self.in_srv, self.in_tk, "Worker 域名 (-f)", "Token 密钥"))
-        self.in_lst = QLineEdit(); self.in_lst.setPlaceholderText("127.0.0.1:30000"); self.in_lst.setMinimumHeight(36); self.in_lst.textChanged.connect(self.save)
+        self.in_lst = QLineEdit(); self.in_lst.setPlaceholderText("127.0.0.1:30000"); self.in_lst.setMinimumHeight(36); self.in_lst.textChanged.connect(self.debounce_save)
         self.cb_rt = QComboBox(); self.cb_rt.setMinimumHeight(36); self.cb_rt.setView(QListView()); self.cb_rt.addItems(["智能分流 (bypass_cn)", "全局代理 (global)", "仅转发 (none)"]); self.cb_rt.setItemData(0,"bypass_cn"); self.cb_rt.setItemData(1,"global"); self.cb_rt.setItemData(2,"none"); self.cb_rt.currentIndexChanged.connect(self.save)
         fl.addLayout(mk_row(self.in_lst, self.cb_rt, "本地监听 (-l)", "路由模式"))
         
@@ -531,24 +355,131 @@ class UltraWindow(QMainWindow):
         h_ip_head.addWidget(lbl_ip); h_ip_head.addStretch(); h_ip_head.addWidget(self.chk_auto)
 
         # [修改] 更换为 QPlainTextEdit 以去除粘贴格式
-        self.in_ip = QPlainTextEdit(); 
-        self.in_ip.setPlaceholderText("例如: saas.sln.fan\n1.2.3.4:8443"); 
+        self.in_ip = CandidateEdit(); self.in_ip.bulk_paste.connect(lambda t: self.start_import([io.StringIO(t)])); 
+        self.in_ip.setPlaceholderText("例如: saas.sln.fan\n1.2.3.4:8443\n104.16.0.0/13\n1.2.3.10-50"); 
         # 样式已在 setStyleSheet 中定义
         self.in_ip.textChanged.connect(self.debounce_save)
         
-        fl.addLayout(h_ip_head); fl.addWidget(self.in_ip, 1); l.addWidget(form, 1); return p
+        # 外置候选列表 (大批量导入/在线来源) 只显示摘要
+        h_ext = QHBoxLayout(); self.lbl_ext = QLabel(""); self.lbl_ext.setStyleSheet(f"color:{PALETTE['text_gray']}; font-size:12px;")
+        b_imp = QPushButton("导入..."); b_clr = QPushButton("清除外置"); m = QMenu(self)
+        m.addAction("从文件导入...", self.import_files); m.addAction("添加在线来源 (URL)...", self.add_source); b_imp.setMenu(m)
+        b_clr.clicked.connect(self.clear_external)
+        for b in [b_imp, b_clr]: b.setFixedHeight(28); b.setCursor(Qt.PointingHandCursor); b.setStyleSheet(f"background:white; border:1px solid {PALETTE['border']}; border-radius:6px; padding:0 10px;")
+        h_ext.addWidget(self.lbl_ext, 1); h_ext.addWidget(b_imp); h_ext.addWidget(b_clr)
+        fl.addLayout(h_ip_head); fl.addWidget(self.in_ip, 1); fl.addLayout(h_ext); l.addWidget(form, 1); return p
 
     def create_logs_page(self):
         p = QWidget(); l = QVBoxLayout(p); l.setContentsMargins(20,20,20,20)
         h = QHBoxLayout(); h.addWidget(QLabel("运行日志", font=QFont("Segoe UI",11,QFont.Bold))); h.addStretch()
         b_cp = QPushButton("复制"); b_cp.setFixedSize(60,30); b_cp.clicked.connect(lambda: (QApplication.clipboard().setText(self.log_v.toPlainText()), self.statusBar().showMessage("已复制")))
         b_cl = QPushButton("清空"); b_cl.setFixedSize(60,30); b_cl.clicked.connect(lambda: self.log_v.clear())
-        for b in [b_cp, b_cl]: b.setStyleSheet(f"background:white; border:1px solid {PALETTE['border']}; border-radius:6px;")
-        h.addWidget(b_cp); h.addWidget(b_cl)
-        self.log_v = QTextEdit(); self.log_v.setReadOnly(True)
-        self.log_v.setStyleSheet(f"background:#1e293b; color:#cbd5e1; border-radius:8px; border:none; font-family:Consolas, monospace; font-size:12px; padding:10px;")
+        b_tr = QPushButton("追踪"); b_tr.setFixedSize(60,30); b_tr.setToolTip("导出最近一次启动的阶段耗时 (Chrome trace JSON)"); b_tr.clicked.connect(self.export_trace)
+        b_rt = QPushButton("分流"); b_rt.setFixedSize(60,30); b_rt.setToolTip("检测某个域名/IP 在当前分流模式下是否直连"); b_rt.clicked.connect(self.check_route)
+        for b in [b_rt, b_tr, b_cp, b_cl]: b.setStyleSheet(f"background:white; border:1px solid {PALETTE['border']}; border-radius:6px;")
+        h.addWidget(b_rt); h.addWidget(b_tr); h.addWidget(b_cp); h.addWidget(b_cl)
+        self.log_v = QPlainTextEdit(); self.log_v.setReadOnly(True); self.log_v.setMaximumBlockCount(self.LOG_MAX_LINES)
+        self.log_v.setStyleSheet("background:#1e293b; color:#cbd5e1; border-radius:8px; border:none; font-family:Consolas, monospace; font-size:12px; padding:10px;")
+        self.log_timer = QTimer(self); self.log_timer.timeout.connect(self.flush_logs); self.log_timer.start(100)
         l.addLayout(h); l.addWidget(self.log_v); return p
 
+    def export_trace(self):
+        if not self.traces.items: self.statusBar().showMessage("暂无启动追踪记录 (每次停止后记录)", 3000); return
+        path, _ = QFileDialog.getSaveFileName(self, "导出启动追踪", str(APP_ROOT / "ech_trace.json"), "Chrome Trace (*.json)")
+        if not path: return
+        try: self.traces.export(path)
+        except OSError as e: QMessageBox.warning(self, "导出失败", str(e)); return
+        self.log(f"📤 启动追踪已导出: {path} (可在 chrome://tracing 或 ui.perfetto.dev 打开)", "#6366f1")
+        if len(self.traces.items) > 1: self.log("上一次 / 最近一次启动对比 (ms):\n" + "\n".join(self.traces.compare()), "#94a3b8")
+
+    def refresh_index(self):
+        # 后台生成/更新 chn_ip.idx (源列表缺失或未变化时不动)，核心下次启动直接整块读入；系统代理使用 PAC 时同步更新
+        def job():
+            if not self._idx_lock.acquire(blocking=False): return
+            try: self.cn_idx.ensure(self.log)
+            except Exception as e: self.log(f"⚠️ 中国 IP 索引生成失败: {e}", "#f59e0b")
+            finally: self._idx_lock.release()
+            self.sync_pac()
+        threading.Thread(target=job, daemon=True, name="cn_index").start()
+
+    def check_route(self):
+        host, ok = QInputDialog.getText(self, "分流检测", "域名或 IP:")
+        host = host.strip().strip('[]')
+        if not ok or not host: return
+        mode, label = self.cb_rt.currentData() or 'bypass_cn', self.cb_rt.currentText()
+        def job():
+            with self._idx_lock:
+                if mode == 'bypass_cn' and not len(self.cn_idx.v4s): self.cn_idx.ensure(self.log)
+            direct, ips = self.cn_idx.would_bypass(host, mode)
+            self.log(f"🧭 {host} → {', '.join(ips) or '-'} ({label}): {'直连' if direct else '走代理'}", "#22c55e" if direct else "#6366f1")
+        threading.Thread(target=job, daemon=True).start()
+
+    def create_scan_page(self):
+        p = QWidget(); l = QVBoxLayout(p); l.setContentsMargins(20,20,20,20); l.setSpacing(10)
+        h = QHBoxLayout(); h.addWidget(QLabel("方案对比", font=QFont("Segoe UI",11,QFont.Bold)))
+        self.btn_scan = QPushButton("测速全部方案"); self.btn_scan.setFixedHeight(30); self.btn_scan.clicked.connect(self.toggle_scan)
+        self.in_scan_f = QLineEdit(); self.in_scan_f.setPlaceholderText("筛选方案/候选"); self.in_scan_f.setFixedHeight(30); self.in_scan_f.setClearButtonEnabled(True)
+        self.cb_scan_p = QComboBox(); self.cb_scan_p.setFixedHeight(30); self.cb_scan_p.setView(QListView())
+        self.chk_scan_live = QCheckBox("隐藏不可达")
+        self.lbl_scan = QLabel(""); self.lbl_scan.setStyleSheet(f"color:{PALETTE['text_gray']}; font-size:12px;")
+        h.addWidget(self.btn_scan); h.addWidget(self.in_scan_f, 1); h.addWidget(self.cb_scan_p); h.addWidget(self.chk_scan_live)
+        self.scan_model = ScanModel(); self.scan_proxy = ScanFilter(); self.scan_proxy.setSourceModel(self.scan_model)
+        self.in_scan_f.textChanged.connect(lambda t: self.scan_proxy.set_filter(text=t))
+        self.cb_scan_p.currentIndexChanged.connect(lambda _: self.scan_proxy.set_filter(pid=self.cb_scan_p.currentData()))
+        self.chk_scan_live.stateChanged.connect(lambda v: self.scan_proxy.set_filter(hide_dead=bool(v)))
+        t = self.tbl_scan = QTableView(); t.setModel(self.scan_proxy); t.setSortingEnabled(True); t.sortByColumn(2, Qt.AscendingOrder)
+        t.setSelectionBehavior(QAbstractItemView.SelectRows); t.setSelectionMode(QAbstractItemView.SingleSelection); t.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        t.verticalHeader().setVisible(False); t.verticalHeader().setSectionResizeMode(QHeaderView.Fixed); t.verticalHeader().setDefaultSectionSize(26)
+        t.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive); t.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        t.setStyleSheet(f"QTableView {{ background:white; border:1px solid {PALETTE['border']}; border-radius:8px; font-family:Consolas, monospace; font-size:12px; }}")
+        t.doubleClicked.connect(lambda idx: self.promote(idx))
+        f = QHBoxLayout(); b_use = QPushButton("设为当前并启动"); b_use.setFixedHeight(30); b_use.clicked.connect(lambda: self.promote(self.tbl_scan.currentIndex()))
+        for b in [self.btn_scan, b_use]: b.setCursor(Qt.PointingHandCursor); b.setStyleSheet(f"background:white; border:1px solid {PALETTE['border']}; border-radius:6px; padding:0 12px;")
+        f.addWidget(self.lbl_scan, 1); f.addWidget(QLabel("双击行同样生效，无需重新测速", styleSheet=f"color:{PALETTE['text_gray']}; font-size:12px;")); f.addWidget(b_use)
+        l.addLayout(h); l.addWidget(t, 1); l.addLayout(f)
+        self.scanner = None; self.scan_timer = QTimer(self); self.scan_timer.timeout.connect(self.scan_progress); self.pin = None
+        return p
+
+    def fill_scan_profiles(self):
+        self.cb_scan_p.blockSignals(True); self.cb_scan_p.clear(); self.cb_scan_p.addItem("全部方案", None)
+        for s in self.cfg.data['servers']: self.cb_scan_p.addItem(s['name'], s['id'])
+        self.cb_scan_p.blockSignals(False); self.scan_proxy.set_filter(pid=None)
+
+    def toggle_scan(self):
+        if self.scanner and self.scanner.isRunning(): self.scanner.stop(); self.btn_scan.setText("正在停止..."); return
+        self.flush_form(); self.fill_scan_profiles(); self.scan_model.clear()
+        profs = [s for s in self.cfg.data['servers'] if CandidateList(s, self.cfg.ext_dir)]
+        if not profs: self.lbl_scan.setText("没有配置优选列表的方案"); return
+        self.tbl_scan.setSortingEnabled(False)  # 测速期间不重排，结束后按当前列排序
+        self.scanner = ScanThread(profs, self.cfg.ext_dir, self.cfg.data.get('scan'))
+        self.scanner.rows.connect(self.scan_model.add_rows); self.scanner.msg.connect(self.log); self.scanner.finished.connect(self.scan_done)
+        self.btn_scan.setText("停止"); self.scanner.start(); self.scan_timer.start(500)
+
+    def scan_progress(self):
+        sc = self.scanner.scan if self.scanner else None
+        if sc: self.lbl_scan.setText(f"已完成 {sc.finished:,} / {sc.total:,}")
+
+    def scan_done(self):
+        self.scan_timer.stop(); self.btn_scan.setText("测速全部方案"); self.tbl_scan.setSortingEnabled(True)
+        live = sum(1 for r in self.scan_model.items if r['p50'] is not None)
+        self.lbl_scan.setText(f"共 {len(self.scan_model.items):,} 个候选，可用 {live:,} 个")
+        by_pid = {}
+        for r in self.scan_model.items: by_pid.setdefault(r['pid'], []).append((r['target'], r['p50'] if r['p50'] is not None else SmartSelector.FAIL))
+        for pid, res in by_pid.items(): self.history.record_many(pid, res)
+        self.history.save()
+
+    def promote(self, idx):
+        if not idx.isValid(): return
+        r = self.scan_model.items[self.scan_proxy.mapToSource(idx).row()]
+        if r['p50'] is None: self.statusBar().showMessage("该候选不可达", 2000); return
+        # 同一方案的其他可用结果作为备用，供健康检查切换
+        standby = sorted((x for x in self.scan_model.items if x['pid'] == r['pid'] and x['p50'] is not None and x['target'] != r['target']), key=lambda x: x['score'])
+        if self.worker and self.worker.running:
+            if self.btn_sys.isChecked(): self.btn_sys.click()
+            self.worker.stop(); self.worker.wait(); self._ui_stop()
+        self.flush_form(); self.cfg.data['current'] = r['pid']; self.cfg.save(); self.load_data()
+        self.pin = (r['target'], r['p50'], [x['target'] for x in standby[:8]]); self.switch_page(0); self.toggle_run()
+
     def load_data(self):
         self.cb_srv.blockSignals(True); self.cb_srv.clear(); cid = self.cfg.data['current']; sel = 0
         for i, s in enumerate(self.cfg.data['servers']):
@@ -563,11 +494,42 @@ class UltraWindow(QMainWindow):
         self.in_ip.setPlainText(s.get('ip_list','')); idx = self.cb_rt.findData(s.get('routing','bypass_cn')); self.cb_rt.setCurrentIndex(idx if idx>=0 else 0)
         self.chk_auto.setChecked(s.get('auto_best', True))
         self.lbl_cur.setText(s['name']); [w.blockSignals(False) for w in widgets]
-
-    def on_srv_change(self): self.cfg.data['current'] = self.cb_srv.currentData(); self.cfg.save(); self.fill_form()
+        self.update_ext()
+
+    def cands(self): return CandidateList(self.cfg.get_cur(), self.cfg.ext_dir)
+    def update_ext(self):
+        c = self.cands(); src = self.cfg.get_cur().get('ip_sources') or []
+        if not c.external: self.lbl_ext.setText("外置候选: 无 (超过 2000 行的粘贴会自动导入)"); return
+        self.lbl_ext.setText(f"外置候选: {c.count():,} 个" + (f" · 在线来源 {len(src)} 个" + (" (待更新)" if c.stale else "") if src else ""))
+        self.lbl_ext.setToolTip("\n".join(src))
+    def start_import(self, sources, dest=None):
+        if getattr(self, 'importer', None) and self.importer.isRunning(): self.statusBar().showMessage("正在导入，请稍候", 2000); return
+        c = self.cands(); dest = dest or c.store
+        if dest == c.store and c.store.exists(): sources = [str(c.store)] + list(sources)  # 与已导入的列表合并
+        self.importer = ImportThread(sources, dest); self.importer.msg.connect(self.log)
+        self.importer.progress.connect(lambda n: self.lbl_ext.setText(f"正在导入... {n:,}"))
+        self.importer.done.connect(lambda n: (self.update_ext(), self.statusBar().showMessage(f"导入完成: {n:,} 个候选", 3000)))
+        self.lbl_ext.setText("正在导入..."); self.importer.start()
+    def import_files(self):
+        files, _ = QFileDialog.getOpenFileNames(self, "导入候选列表", str(APP_ROOT), "文本 (*.txt *.csv);;所有文件 (*)")
+        if files: self.start_import(files)
+    def add_source(self):
+        url, ok = QInputDialog.getText(self, "在线来源", "候选列表地址 (http/https，每次启动时按需更新):")
+        if not (ok and url.strip()): return
+        with self.cfg.edit() as s: srcs = s['ip_sources'] = list(dict.fromkeys((s.get('ip_sources') or []) + [url.strip()]))
+        self.start_import(srcs, self.cands().cache)
+    def clear_external(self):
+        c = self.cands()
+        if not c.external or QMessageBox.question(self, "清除外置候选", "删除已导入的候选和在线来源？") != QMessageBox.Yes: return
+        for f in (c.store, c.cache):
+            try: f.unlink()
+            except OSError: pass
+        with self.cfg.edit() as s: s.pop('ip_sources', None)
+        self.update_ext()
+
+    def on_srv_change(self): self.flush_form(); self.cfg.data['current'] = self.cb_srv.currentData(); self.cfg.save(); self.fill_form()
     def save(self):
-        s = self.cfg.get_cur()
-        s.update({
+        with self.cfg.edit() as s: s.update({
             'server':self.in_srv.text(), 
             'listen':self.in_lst.text(), 
             'token':self.in_tk.text(), 
@@ -575,16 +537,24 @@ class UltraWindow(QMainWindow):
             'routing':self.cb_rt.currentData(),
             'auto_best': self.chk_auto.isChecked()
         })
-        self.cfg.update_cur(s); self.statusBar().showMessage("配置已保存", 1500)
-    def debounce_save(self): QTimer.singleShot(600, self.save)
+        self.statusBar().showMessage("配置已保存", 1500)
+    def debounce_save(self):
+        # 连续输入时只在停顿后保存一次 (重启同一个定时器，而不是每次按键都排队一次保存)
+        if not hasattr(self, 'save_timer'):
+            self.save_timer = QTimer(self); self.save_timer.setSingleShot(True); self.save_timer.setInterval(400); self.save_timer.timeout.connect(self.save)
+        self.save_timer.start()
+    def flush_form(self):
+        # 切换/增删方案前先落实尚未保存的输入，避免写到其他方案上
+        if getattr(self, 'save_timer', None) and self.save_timer.isActive(): self.save_timer.stop(); self.save()
     def act_add(self):
-        n,ok = QInputDialog.getText(self,"新建配置","输入配置名称:"); 
+        self.flush_form(); n,ok = QInputDialog.getText(self,"新建配置","输入配置名称:"); 
         if ok and n: self.cfg.add_new(n); self.load_data()
     def act_ren(self):
-        cur = self.cfg.get_cur(); n, ok = QInputDialog.getText(self, "重命名", "输入新名称:", text=cur['name'])
+        self.flush_form(); cur = self.cfg.get_cur(); n, ok = QInputDialog.getText(self, "重命名", "输入新名称:", text=cur['name'])
         if ok and n: self.cfg.rename_cur(n); self.load_data()
     def act_del(self): 
-        if QMessageBox.question(self, "确认删除", "确定删除此配置方案吗？") == QMessageBox.Yes: self.cfg.del_cur(); self.load_data()
+        if QMessageBox.question(self, "确认删除", "确定删除此配置方案吗？") == QMessageBox.Yes:
+            self.flush_form(); self.cfg.del_cur(); self.history.prune({s['id'] for s in self.cfg.data['servers']}); self.history.save(); self.load_data()
     def switch_page(self, i): self.pages.setCurrentIndex(i); [b.setChecked(idx==i) for idx,b in enumerate(self.btns)]
 
     def toggle_run(self):
@@ -598,52 +568,146 @@ class UltraWindow(QMainWindow):
             if not s.get('server'): 
                 QMessageBox.warning(self, "提示", "请先在【配置管理】填写 Worker 域名！"); self.switch_page(1); self.btn_pow.setEnabled(True); return
             self.btn_pow.set_active(True); self.lbl_st.setText("正在启动...")
-            self.log_v.clear(); self.log(">>> 初始化中...", "#94a3b8")
-            self.worker = WorkerThread(s); self.worker.msg.connect(self.log)
-            self.worker.status_change.connect(self.lbl_st.setText); self.worker.latency_result.connect(self.lbl_lat.setText)
-            self.worker.geo_result.connect(self.lbl_geo.setText)
+            self.logs.drain(); self.log_v.clear(); self.log(">>> 初始化中...", "#94a3b8")
+            self.worker = WorkerThread(s, self.history, self.logs, self.traces); self.worker.msg.connect(self.log)
+            self.worker.core.pin, self.pin = self.pin, None
+            self.worker.status_change.connect(self.defer(self.lbl_st.setText)); self.worker.latency_result.connect(self.defer(self.lbl_lat.setText))
+            self.worker.status_change.connect(lambda t: self.tray.setToolTip(f"{APP_TITLE} · {t}"))
+            self.worker.geo_result.connect(self.defer(self.lbl_geo.setText)); self.worker.score_result.connect(self.defer(self.lbl_lat.setToolTip))
             self.worker.error_alert.connect(lambda m: (self.lbl_st.setText(f"❌ {m}"), self.lbl_st.setStyleSheet(f"color:{PALETTE['danger']}")))
             self.worker.finished_safe.connect(self._check_abnormal_stop); self.worker.start()
+            QTimer.singleShot(30000, self.refresh_index)  # 核心首次运行可能刚下载了列表
             QTimer.singleShot(1000, lambda: (self.btn_pow.setEnabled(True), self.btn_sys.setEnabled(True)))
 
     def _ui_stop(self):
+        self._pending.clear()  # 丢弃隐藏期间积压的运行状态
         self.btn_pow.set_active(False); self.btn_sys.setEnabled(False)
         if "❌" not in self.lbl_st.text(): self.lbl_st.setText("已断开"); self.lbl_st.setStyleSheet(f"color:{PALETTE['text_gray']}")
-        self.lbl_lat.setText(""); self.lbl_geo.setText("--"); self.btn_pow.setEnabled(True)
+        self.lbl_lat.setText(""); self.lbl_lat.setToolTip(""); self.lbl_geo.setText("--"); self.btn_pow.setEnabled(True)
     def _check_abnormal_stop(self):
         if not self.worker.running: self._ui_stop()
 
+    INET_KEY = r"Software\Microsoft\Windows\CurrentVersion\Internet Settings"
     def toggle_sys(self):
         on = self.btn_sys.isChecked(); self.btn_sys.update_text()
         if sys.platform != 'win32': return
         try:
-            k = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Internet Settings", 0, winreg.KEY_SET_VALUE)
+            import winreg
+            k = winreg.OpenKey(winreg.HKEY_CURRENT_USER, self.INET_KEY, 0, winreg.KEY_SET_VALUE)
             if on:
                 l = self.in_lst.text() or "127.0.0.1:30000"; p = l if ':' in l else f"127.0.0.1:{l}"
-                winreg.SetValueEx(k, "ProxyServer", 0, winreg.REG_SZ, p); winreg.SetValueEx(k, "ProxyEnable", 0, winreg.REG_DWORD, 1)
-                self.log(f"系统代理已开启 ({p})", PALETTE['success'])
+                # 「跳过中国大陆」模式改用本地 PAC：国内流量由浏览器直连，不再经过核心做解析和判定
+                if (self.cb_rt.currentData() or 'bypass_cn') == 'bypass_cn' and (url := self.start_pac(p)):
+                    winreg.SetValueEx(k, "AutoConfigURL", 0, winreg.REG_SZ, url); winreg.SetValueEx(k, "ProxyEnable", 0, winreg.REG_DWORD, 0)
+                    self.log(f"系统代理已开启 (PAC {url}，国内直连)", PALETTE['success'])
+                else:
+                    self.stop_pac(k)
+                    winreg.SetValueEx(k, "ProxyServer", 0, winreg.REG_SZ, p); winreg.SetValueEx(k, "ProxyEnable", 0, winreg.REG_DWORD, 1)
+                    self.log(f"系统代理已开启 ({p})", PALETTE['success'])
             else: 
-                winreg.SetValueEx(k, "ProxyEnable", 0, winreg.REG_DWORD, 0); self.log("系统代理已关闭", "#94a3b8")
+                self.stop_pac(k); winreg.SetValueEx(k, "ProxyEnable", 0, winreg.REG_DWORD, 0); self.log("系统代理已关闭", "#94a3b8")
             import ctypes; ctypes.windll.wininet.InternetSetOptionW(0,39,0,0); ctypes.windll.wininet.InternetSetOptionW(0,37,0,0)
         except: self.btn_sys.setChecked(False); self.btn_sys.update_text(); self.log("系统代理设置失败", PALETTE['danger'])
 
-    def log(self, t, c=None): 
-        if self.log_v.document().lineCount() > 1000: self.log_v.clear()
-        self.log_v.append(f'<font color="{c or "#cbd5e1"}">[{datetime.now().strftime("%H:%M:%S")}] {t}</font>')
-        self.log_v.verticalScrollBar().setValue(self.log_v.verticalScrollBar().maximum())
+    def start_pac(self, proxy):
+        # 默认端口被占用时改用随机端口；失败返回 None，由调用方退回普通代理
+        if not self.pac_srv:
+            port = self.cfg.data.get('pac_port', 39091)
+            for pt in dict.fromkeys((port, 0)):
+                try: self.pac_srv = PacServer(self.pac, proxy, pt, log_fn=self.log); break
+                except OSError as e: err = e
+            else: self.log(f"⚠️ PAC 服务启动失败: {err}", "#f59e0b"); return None
+            self.pac_srv.start()
+        self.pac_srv.proxy = proxy; self.pac_url = self.pac_srv.url(); return self.pac_url
+
+    def stop_pac(self, key=None):
+        self.pac_url = None
+        if key is not None:
+            import winreg
+            try: winreg.DeleteValue(key, "AutoConfigURL")
+            except OSError: pass
+        if self.pac_srv: self.pac_srv.stop(); self.pac_srv = None
+
+    def sync_pac(self):
+        # 列表更新后 PAC 版本号变化，改写 AutoConfigURL 让浏览器重新下载
+        if not (srv := self.pac_srv) or not self.pac_url or (url := srv.url()) == self.pac_url or sys.platform != 'win32': return
+        try:
+            import winreg, ctypes
+            k = winreg.OpenKey(winreg.HKEY_CURRENT_USER, self.INET_KEY, 0, winreg.KEY_SET_VALUE)
+            winreg.SetValueEx(k, "AutoConfigURL", 0, winreg.REG_SZ, url); self.pac_url = url
+            ctypes.windll.wininet.InternetSetOptionW(0,39,0,0); ctypes.windll.wininet.InternetSetOptionW(0,37,0,0)
+            self.log(f"🧾 PAC 已更新: {url}", "#94a3b8")
+        except OSError as e: self.log(f"⚠️ PAC 更新失败: {e}", "#f59e0b")
+
+    LOG_MAX_LINES = 5000
+    def log(self, t, c=None): self.logs.push(t, c)
+
+    def flush_logs(self):
+        # 定时把缓冲中的日志一次性写入视图；仅当原本停在底部时才自动滚动，便于回看
+        self.ticks += 1; lines, dropped = self.logs.drain()
+        if not lines: return
+        sb = self.log_v.verticalScrollBar(); at_end = sb.value() >= sb.maximum() - 4
+        if len(lines) > self.LOG_MAX_LINES: dropped += len(lines) - self.LOG_MAX_LINES; lines = lines[-self.LOG_MAX_LINES:]
+        cur = QTextCursor(self.log_v.document()); cur.movePosition(QTextCursor.End); cur.beginEditBlock()
+        if dropped: lines.insert(0, (lines[0][0], f"... 日志过多，已省略 {dropped} 行 ...", "#fbbf24"))
+        for ts, t, c in lines:
+            c = c or "#cbd5e1"; fmt = self._fmts.get(c)
+            if fmt is None: fmt = self._fmts[c] = QTextCharFormat(); fmt.setForeground(QColor(c))
+            if not self.log_v.document().isEmpty(): cur.insertBlock()
+            cur.insertText(f"[{ts}] {t}", fmt)
+        cur.endEditBlock(); self.logs.flush()
+        if at_end: sb.setValue(sb.maximum())
 
     def init_tray(self):
         self.tray = QSystemTrayIcon(self)
         if os.path.exists(ICON_PATH): self.tray.setIcon(QIcon(ICON_PATH))
         else: self.tray.setIcon(self.style().standardIcon(30))
-        m = QMenu(); m.addAction("显示主界面", self.showNormal); m.addAction("退出程序", self.quit_app)
+        m = QMenu(); m.addAction("显示主界面", self.showNormal); m.addAction("功耗统计", lambda: self.tray.showMessage(APP_TITLE, self.power_report()))
+        m.addAction("退出程序", self.quit_app)
         self.tray.setContextMenu(m); self.tray.show(); self.tray.activated.connect(lambda r: self.showNormal() if r in (2,3) else None)
     def quit_app(self):
         if self.worker: self.worker.stop()
         if self.btn_sys.isChecked(): self.btn_sys.click()
-        ProcessManager.kill_current(); QApplication.quit()
+        self.flush_form(); self.cfg.flush(); ProcessManager.kill_current(); self.logs.flush(); QApplication.quit()
     def closeEvent(self, e): e.ignore(); self.hide()
 
+    # ---- 低功耗模式：窗口隐藏或最小化时停止动画和定时渲染，日志留在 LogPipe，状态只保留最后一次的值 ----
+    def hideEvent(self, e): super().hideEvent(e); self.set_awake(False)
+    def showEvent(self, e): super().showEvent(e); self.set_awake(not self.isMinimized())
+    def changeEvent(self, e):
+        super().changeEvent(e)
+        if e.type() == QEvent.WindowStateChange: self.set_awake(self.isVisible() and not self.isMinimized())
+
+    def defer(self, fn):
+        # 包装界面更新：隐藏期间只记住最后一次参数，恢复显示时统一应用
+        return lambda *a: fn(*a) if self._awake else self._pending.__setitem__(fn, a)
+
+    def idle_tick(self):
+        # 隐藏期间唯一的定时任务：低频落盘日志文件，不渲染
+        self.ticks += 1; self.logs.flush()
+
+    def set_awake(self, on):
+        if on == self._awake: return
+        now, cpu, n = time.monotonic(), time.process_time(), self.ticks + self.btn_pow.frames
+        b = self.power['fg' if self._awake else 'bg']; seg = now - self._pw[0]; b[0] += seg; b[1] += cpu - self._pw[1]; b[2] += n - self._pw[2]
+        self._pw = (now, cpu, n); self._awake = on
+        for t, ms in ((self.log_timer, 100), (self.stats_timer, 1000)): t.start(ms) if on else t.stop()
+        self.idle_timer.stop() if on else self.idle_timer.start(10000)
+        self.btn_pow.set_paused(not on)
+        if not on: return
+        pending, self._pending = self._pending, {}
+        for fn, a in pending.items(): fn(*a)
+        self.flush_logs(); self.refresh_stats()
+        if seg >= 60: self.log(self.power_report(), "#94a3b8")
+
+    def power_report(self):
+        # 前台/后台的界面唤醒次数与进程 CPU 时间 (按每分钟折算)，用于比较低功耗模式的效果
+        pw = {k: list(v) for k, v in self.power.items()}; cur = pw['fg' if self._awake else 'bg']  # 计入当前尚未结束的一段
+        cur[0] += time.monotonic() - self._pw[0]; cur[1] += time.process_time() - self._pw[1]; cur[2] += self.ticks + self.btn_pow.frames - self._pw[2]
+        rate = lambda k: (60 * pw[k][2] / max(pw[k][0], 1e-9), 100 * pw[k][1] / max(pw[k][0], 1e-9))
+        (fw, fc), (bw, bc) = rate('fg'), rate('bg')
+        return f"🔋 前台 {pw['fg'][0] / 60:.1f} 分钟: 界面刷新 {fw:.0f} 次/分, CPU {fc:.2f}% · 后台 {pw['bg'][0] / 60:.1f} 分钟: {bw:.1f} 次/分, CPU {bc:.2f}%"
+
 if __name__ == '__main__':
     if hasattr(Qt, 'AA_EnableHighDpiScaling'):
         QApplication.setAttribute(Qt.AA_EnableHighDpiScaling, True)
@@ -0,0 +1,64 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from ech_core import Balancer
+
+
+def free_port():
+    with socket.socket() as s: s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+
+@pytest.fixture
+def backends():
+    """两个回显自身编号的核心端口，加一个没有监听的端口 (连接被拒绝)"""
+    socks = []
+    def serve(s, tag):
+        while True:
+            try: c, _ = s.accept()
+            except OSError: return
+            def hold(c=c):
+                with c:
+                    c.sendall(tag)
+                    while c.recv(1024): pass
+            threading.Thread(target=hold, daemon=True).start()
+    for tag in (b"a", b"b"):
+        s = socket.socket(); s.bind(("127.0.0.1", 0)); s.listen(16); socks.append(s)
+        threading.Thread(target=serve, args=(s, tag), daemon=True).start()
+    yield [("127.0.0.1", s.getsockname()[1]) for s in socks] + [("127.0.0.1", free_port())]
+    for s in socks: s.close()
+
+
+def start(addrs):
+    b = Balancer(f"127.0.0.1:{free_port()}", [(a, 50) for a in addrs]); b.start()
+    assert b.ready.wait(5) and b.error is None
+    return b
+
+
+def dial(b):
+    c = socket.create_connection(b.listen.split(":"), timeout=5); return c, c.recv(1)
+
+
+def test_least_conn_rotates_and_balances_active(backends):
+    b = start(backends[:2])
+    try:
+        seen = []
+        for _ in range(4):
+            c, tag = dial(b); seen.append(tag); c.close(); time.sleep(0.05)
+        assert seen in ([b"a", b"b"] * 2, [b"b", b"a"] * 2)  # 空闲时按累计连接数轮流
+        held = [dial(b) for _ in range(4)]
+        assert sorted(tag for _, tag in held) == [b"a", b"a", b"b", b"b"]
+        assert [x['active'] for x in b.snapshot()] == [2, 2]
+        for c, _ in held: c.close()
+    finally: b.stop(); b.join(5)
+
+
+def test_refused_core_is_skipped_and_marked_down(backends):
+    b = start([backends[2], backends[0]])
+    try:
+        for _ in range(3):
+            c, tag = dial(b); assert tag == b"a"; c.close()
+        assert b.backends[0]['down_until'] > time.monotonic() and b.backends[0]['total'] == 0
+    finally: b.stop(); b.join(5)
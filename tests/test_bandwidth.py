@@ -0,0 +1,41 @@
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from ech_core import SmartSelector
+
+
+class DualStackServer(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        super().server_bind()
+
+
+class Blob(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = bytes(64 << 10)
+        self.send_response(200); self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body)
+
+    def log_message(self, *a): pass
+
+
+@pytest.fixture
+def http_port():
+    try: srv = DualStackServer(("::", 0), Blob)
+    except OSError: pytest.skip("IPv6 不可用")
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv.server_address[1]
+    srv.shutdown(); srv.server_close()
+
+
+def test_bandwidth_uses_bw_url_port(http_port):
+    # 候选自带的端口 (含 IPv6 的 [addr]:443) 是 Worker 端口，带宽测速应连接 bw_url 的端口
+    o = {**SmartSelector.DEFAULTS, "bw_url": f"http://bench.local:{http_port}/x", "hs_timeout": 2.0, "bw_time": 2.0}
+    targets = [SmartSelector.fmt_addr(1, 6), "127.0.0.1:8443", "127.0.0.1"]
+    res = SmartSelector.bandwidth_test(targets, o)
+    assert set(res) == set(targets)
+    assert all(r["bytes"] == 64 << 10 for r in res.values())
@@ -0,0 +1,33 @@
+import collections
+import ipaddress
+
+import pytest
+
+from ech_core import SmartSelector
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    # 10.0.7.0/24 最快，其余 /24 按序号变慢；记录所有探测过的地址
+    probed = []
+    def probe_many(targets, port, timeout, concurrency, deadline=None, engine=None, acc=None):
+        probed.extend(targets)
+        subs = [(int(ipaddress.ip_address(SmartSelector.split_target(t)[0])) >> 8) & 0xff for t in targets]
+        return [(t, 10 if s == 7 else 100 + s) for t, s in zip(targets, subs)]
+    monkeypatch.setattr(SmartSelector, "probe_many", staticmethod(probe_many))
+    return probed
+
+
+@pytest.mark.parametrize("budget", [10, 40, 200])
+def test_search_blocks_respects_budget(fleet, budget):
+    o = {**SmartSelector.DEFAULTS, "probe_budget": budget, "cidr_samples": 2}
+    res = SmartSelector.search_blocks([SmartSelector.parse_block("10.0.0.0/20")], o)
+    assert len(fleet) <= budget and len(set(fleet)) == len(fleet) == len(res)
+
+
+def test_search_blocks_narrows_to_fastest_subnet(fleet):
+    o = {**SmartSelector.DEFAULTS, "probe_budget": 200, "cidr_samples": 2}
+    res = SmartSelector.search_blocks([SmartSelector.parse_block("10.0.0.0/20")], o)
+    assert min(res, key=lambda r: r[1])[0].startswith("10.0.7.")
+    per = collections.Counter(t.rsplit(".", 1)[0] for t in fleet)
+    assert per.most_common(1)[0][0] == "10.0.7" and per["10.0.7"] > 2 * o['cidr_samples']
@@ -0,0 +1,38 @@
+import os
+
+from ech_core import ChinaIndex
+
+
+def write_sources(base):
+    (base / "chn_ip.txt").write_text("# 注释\n1.0.1.0 1.0.3.255\n1.0.2.0 1.0.8.255\n36.0.0.0 36.0.0.255\nbad line\n", encoding='utf-8')
+    (base / "chn_ip_v6.txt").write_text("2400:3200:: 2400:3200:ffff:ffff:ffff:ffff:ffff:ffff\n", encoding='utf-8')
+
+
+def test_build_load_round_trip(tmp_path):
+    write_sources(tmp_path)
+    assert ChinaIndex(tmp_path).build() == (2, 1)  # 重叠的两段合并
+    idx = ChinaIndex(tmp_path)
+    assert idx.load() and not idx.stale()
+    assert list(idx.v4s) == [0x01000100, 0x24000000] and list(idx.v4e) == [0x010008ff, 0x240000ff]
+    assert idx.contains("1.0.5.1") and idx.contains("36.0.0.9") and not idx.contains("1.0.9.0")
+    assert idx.contains("2400:3200::1") and not idx.contains("2400:3201::1")
+
+
+def test_stale_when_source_changes(tmp_path):
+    write_sources(tmp_path); ChinaIndex(tmp_path).build()
+    src = tmp_path / "chn_ip.txt"; st = src.stat(); os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    idx = ChinaIndex(tmp_path)
+    assert idx.load() and idx.stale()
+    assert idx.ensure() and ChinaIndex(tmp_path).load() and not idx.stale()
+
+
+def test_corrupt_or_foreign_header_rejected(tmp_path):
+    write_sources(tmp_path); ChinaIndex(tmp_path).build()
+    path = tmp_path / "chn_ip.idx"; good = path.read_bytes()
+    for bad in (good[:-1],                                  # 截断
+                good[:100] + bytes([good[100] ^ 1]) + good[101:],  # 数据区损坏，校验和不符
+                b"NOTANIDX" + good[8:],                     # 魔数错误
+                good[:8] + (2).to_bytes(4, 'little') + good[12:]):  # 版本不符
+        path.write_bytes(bad)
+        assert not ChinaIndex(tmp_path).load()
+    assert ChinaIndex(tmp_path).ensure() and path.read_bytes() == good  # 损坏后重建
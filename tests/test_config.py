@@ -0,0 +1,32 @@
+import json
+
+from ech_core import ConfigManager
+
+
+def test_flush_failure_keeps_dirty_and_retries(tmp_path, monkeypatch):
+    cfg = ConfigManager(tmp_path / "config.json")
+    with cfg.edit() as s: s['name'] = "a"; s['bad'] = {1, 2}  # 无法序列化
+    cfg.flush()
+    assert cfg.dirty and cfg._timer is not None
+    with cfg.edit() as s: s.pop('bad')
+    cfg.flush()
+    assert not cfg.dirty and json.loads((tmp_path / "config.json").read_text(encoding='utf-8'))['servers'][0]['name'] == "a"
+
+
+def test_write_error_rearms_timer(tmp_path, monkeypatch):
+    cfg = ConfigManager(tmp_path / "config.json")
+    def fail(path, text): raise OSError("disk full")
+    monkeypatch.setattr(ConfigManager, "_write", staticmethod(fail))
+    cfg.rename_cur("b"); cfg.flush()
+    assert cfg.dirty and cfg._timer is not None
+    monkeypatch.undo(); cfg.flush()
+    assert not cfg.dirty and json.loads((tmp_path / "config.json").read_text(encoding='utf-8'))['servers'][0]['name'] == "b"
+
+
+def test_long_ip_list_stored_externally(tmp_path):
+    cfg = ConfigManager(tmp_path / "config.json"); ips = "\n".join(f"1.1.{i // 256}.{i % 256}" for i in range(1000))
+    with cfg.edit() as s: s['ip_list'] = ips
+    cfg.flush()
+    data = json.loads((tmp_path / "config.json").read_text(encoding='utf-8'))['servers'][0]
+    assert 'ip_list' not in data and (tmp_path / data['ip_list_file']).read_text(encoding='utf-8') == ips
+    assert cfg.get_cur()['ip_list'] == ips
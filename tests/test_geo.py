@@ -0,0 +1,86 @@
+import io
+import json
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import ech_core
+from ech_core import CoreRunner, GeoCache
+
+KEY = "w.example.com:443|1.2.3.4"
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    monkeypatch.setattr(ech_core, "GeoCache", lambda: GeoCache(tmp_path / "geo_cache.json"))
+    out = {"msg": [], "geo": []}
+    r = CoreRunner({"id": "p", "server": "w.example.com:443", "geo": {"ready_timeout": 2, "timeout": 1}},
+                   msg=lambda t, c=None: out["msg"].append(t), geo=lambda t: out["geo"].append(t))
+    r.running = True; r.edge = "1.2.3.4"; r.out = out
+    return r
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """替换出口检测请求：记录代理地址与请求的 URL；reply 为 None 时请求失败"""
+    seen = {"proxy": [], "urls": [], "reply": None}
+    class Opener:
+        addheaders = []
+        def open(self, url, timeout=None):
+            seen["urls"].append(url)
+            if seen["reply"] is None: raise OSError("unreachable")
+            return io.BytesIO(json.dumps(seen["reply"]).encode())
+    real = urllib.request.ProxyHandler
+    monkeypatch.setattr(urllib.request, "ProxyHandler", lambda p: seen["proxy"].append(p['http']) or real(p))
+    monkeypatch.setattr(urllib.request, "build_opener", lambda *h: Opener())
+    return seen
+
+
+def test_ready_by_log_line(runner):
+    threading.Timer(0.1, runner.core_line, args=("2026/01/01 00:00:00 [启动] 服务器启动: 127.0.0.1:30000",)).start()
+    ms = runner.wait_ready([("127.0.0.1", 9)], timeout=2)
+    assert ms is not None and 80 <= ms < 1000 and runner.measured.is_set()
+
+
+def test_ready_by_socket(runner):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); s.listen(4)
+        ms = runner.wait_ready([s.getsockname()], timeout=2)
+    assert ms is not None and ms < 500 and runner.ready.is_set()
+
+
+def test_not_ready_times_out(runner):
+    t0 = time.monotonic()
+    assert runner.wait_ready([("127.0.0.1", 9)], timeout=0.3) is None
+    assert time.monotonic() - t0 < 1 and runner.measured.is_set()
+
+
+def test_cache_hit_skips_requests(runner, fetches, tmp_path):
+    GeoCache(tmp_path / "geo_cache.json").put(KEY, "IPSB: JP 1.2.3.4")
+    runner.ready.set(); runner.check_geoip("127.0.0.1:30000")
+    assert not fetches["urls"] and runner.out["geo"] == ["IPSB: JP 1.2.3.4"]
+    assert GeoCache(tmp_path / "geo_cache.json").get(KEY, ttl=0) is None  # 超过 TTL 的记录不再使用
+
+
+def test_failed_lookup_not_cached(runner, fetches, tmp_path):
+    runner.ready.set(); runner.check_geoip("127.0.0.1:30000")
+    assert len(fetches["urls"]) == 3 and "超时/失败" in runner.out["geo"][0]
+    assert GeoCache(tmp_path / "geo_cache.json").get(KEY, 3600) is None
+    fetches["reply"] = {"country": "JP", "ip": "1.2.3.4"}; runner.check_geoip("127.0.0.1:30000")
+    assert len(fetches["urls"]) == 6 and GeoCache(tmp_path / "geo_cache.json").get(KEY, 3600) == runner.out["geo"][-1]
+    assert not (tmp_path / "geo_cache.json.tmp").exists()
+
+
+@pytest.mark.parametrize("listen, addr, proxy", [
+    ("0.0.0.0:1080", ("127.0.0.1", 1080), "http://127.0.0.1:1080"),
+    ("[::]:1080", ("::1", 1080), "http://[::1]:1080"),
+    ("socks5://:1080", ("127.0.0.1", 1080), "http://127.0.0.1:1080"),
+    ("192.168.1.2:1080", ("192.168.1.2", 1080), "http://192.168.1.2:1080"),
+])
+def test_wildcard_listen_maps_to_loopback(runner, fetches, listen, addr, proxy):
+    assert CoreRunner.local_addr(listen) == addr
+    runner.ready.set(); runner.check_geoip(listen)
+    assert fetches["proxy"] == [proxy]
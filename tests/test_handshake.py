@@ -0,0 +1,75 @@
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+import pytest
+
+from ech_core import SmartSelector
+
+HOST = "worker.test"
+
+
+@pytest.fixture(scope="module")
+def cert(tmp_path_factory):
+    if not shutil.which("openssl"): pytest.skip("需要 openssl 生成自签名证书")
+    d = tmp_path_factory.mktemp("cert"); crt, key = d / "worker.crt", d / "worker.key"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+                    "-keyout", str(key), "-out", str(crt), "-days", "1", "-subj", f"/CN={HOST}",
+                    "-addext", f"subjectAltName=DNS:{HOST}"], check=True, capture_output=True)
+    return crt, key
+
+
+@pytest.fixture
+def workers(cert):
+    """在 127.0.0.1/2/3 的同一端口上模拟 Worker (TLS + WebSocket 升级)：
+    .1 每次都延迟 40ms 后返回 101；.2 立即返回，但每隔一次返回 403；.3 总是返回 403"""
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER); ctx.load_cert_chain(*map(str, cert))
+    plans = {"127.0.0.1": lambda n: (0.04, 101), "127.0.0.2": lambda n: (0, 101 if n % 2 == 0 else 403),
+             "127.0.0.3": lambda n: (0, 403)}
+    socks, port = [], 0
+    def serve(s, plan):
+        n = 0
+        while True:
+            try: c, _ = s.accept()
+            except OSError: return
+            delay, code = plan(n); n += 1
+            def handle(c=c, delay=delay, code=code):
+                try:
+                    with ctx.wrap_socket(c, server_side=True) as t:
+                        buf = b""
+                        while b"\r\n\r\n" not in buf and (d := t.recv(4096)): buf += d
+                        time.sleep(delay)
+                        t.sendall(f"HTTP/1.1 {code} X\r\nConnection: Upgrade\r\n\r\n".encode())
+                except (OSError, ssl.SSLError): pass
+            threading.Thread(target=handle, daemon=True).start()
+    for ip, plan in plans.items():
+        s = socket.socket(); s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((ip, port)); s.listen(16); port = s.getsockname()[1]; socks.append(s)
+        threading.Thread(target=serve, args=(s, plan), daemon=True).start()
+    yield port
+    for s in socks: s.close()
+
+
+def opts(port, **kw):
+    return {**SmartSelector.DEFAULTS, "mode": "handshake", "server": f"{HOST}:{port}/ws", "hs_samples": 2,
+            "hs_timeout": 2.0, **kw}
+
+
+def test_handshake_rank_breakdown_and_failures(workers, cert):
+    top = [("127.0.0.3", 1), ("127.0.0.2", 1), ("127.0.0.1", 1)]
+    scored = SmartSelector.handshake_rank(top, opts(workers, cafile=str(cert[0])))
+    assert [r['target'] for r in scored] == ["127.0.0.1", "127.0.0.2"]  # 升级全部失败的 .3 不参与排名
+    good, flaky = scored
+    assert good['loss'] == 0 and flaky['loss'] == 0.5 and flaky['p50'] < good['p50']
+    for r in scored: assert all(r[k] > 0 for k in ("tcp", "tls", "ws"))
+    assert good['ws'] >= 35 and good['ws'] > good['tls']
+    assert abs(good['p50'] - (good['tcp'] + good['tls'] + good['ws'])) < 5
+
+
+def test_handshake_requires_trusted_cert(workers):
+    assert SmartSelector.handshake_rank([("127.0.0.1", 1)], opts(workers)) == []
+    assert [r['target'] for r in SmartSelector.handshake_rank([("127.0.0.1", 1)], opts(workers, tls_verify=False))] == ["127.0.0.1"]
+
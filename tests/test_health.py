@@ -0,0 +1,39 @@
+import threading
+
+from ech_core import HealthMonitor, SmartSelector
+
+
+def score(t, p50, loss=0.0):
+    return {"target": t, "p50": p50, "loss": loss, "score": p50 + 300 * loss}
+
+
+def run_monitor(monkeypatch, rounds, bad_rounds=2):
+    """rounds: 每轮 {候选: (p50, loss)}，用完后重复最后一轮；运行到第一条日志 (切换或放弃切换) 为止，返回 (监控器, [(切换目标, 延迟, 当时已完成的轮数)], 日志)"""
+    n = [0]; switched = []; logs = []; done = threading.Event()
+    def retest(pairs, o):
+        ts = [t for t, _ in pairs]
+        if len(ts) > 1: n[0] += 1
+        plan = rounds[min(n[0], len(rounds)) - 1]
+        return [score(t, *plan[t]) for t in ts if t in plan]
+    def switch(t, lat):
+        switched.append((t, lat, n[0])); return True
+    monkeypatch.setattr(SmartSelector, "retest", staticmethod(retest))
+    m = HealthMonitor("A", 50, ["A", "B", "C"], switch, lambda text, color=None: (logs.append(text), done.set()),
+                      opts={"interval": 0.01, "bad_rounds": bad_rounds})
+    m.start(); done.wait(2); m.stop(); m.join(2)
+    return m, switched, logs
+
+
+def test_failover_after_bad_rounds(monkeypatch):
+    good = {"A": (50, 0), "B": (80, 0), "C": (60, 0.4)}
+    bad = {"A": (900, 0), "B": (80, 0), "C": (60, 0.6)}  # C 丢包超过 max_loss，不参与切换
+    m, switched, logs = run_monitor(monkeypatch, [good, bad, good, bad, bad, bad], bad_rounds=2)
+    assert switched and switched[0][:2] == ("B", 80)
+    assert switched[0][2] == 5  # 第 2 轮的单次劣化被第 3 轮恢复清零，第 4、5 轮连续劣化才切换
+    assert m.active == "B" and "A" in m.standby and any("自动切换 A" in l for l in logs)
+
+
+def test_no_switch_without_better_standby(monkeypatch):
+    bad = {"A": (900, 0), "B": (950, 0)}
+    m, switched, logs = run_monitor(monkeypatch, [bad], bad_rounds=2)
+    assert not switched and m.active == "A" and any("没有更好的备选" in l for l in logs)
@@ -0,0 +1,45 @@
+import socket
+
+import pytest
+
+from ech_core import ConfigManager, ProbeHistory, Resolver, SmartSelector
+
+
+@pytest.fixture
+def listeners():
+    socks = []
+    for _ in range(2):
+        s = socket.socket(); s.bind(("127.0.0.1", 0)); s.listen(16); socks.append(s)
+    yield [s.getsockname()[1] for s in socks]
+    for s in socks: s.close()
+
+
+def test_warm_start_matches_domain_list(tmp_path, listeners, monkeypatch):
+    # 域名候选展开为地址后写入历史，快速启动时仍应认出这些记录属于当前列表
+    ip_list = "\n".join(f"localhost:{p}" for p in listeners)
+    view = ProbeHistory(tmp_path / "history.json").bind("p")
+    best, lat = SmartSelector.pick_best(ip_list, history=view, good_ms=0)
+    assert best and best.startswith("127.0.0.1:")
+    monkeypatch.setattr(SmartSelector, "resolver", Resolver())  # 模拟重新启动: 解析缓存为空
+    warm = view.best(3); match = SmartSelector.matcher(ip_list)
+    assert warm and all(match(c) for c, _ in warm)
+    assert not SmartSelector.matcher("localhost:1")(warm[0][0])
+
+
+def test_skip_domain_when_all_addresses_fail(tmp_path):
+    view = ProbeHistory(tmp_path / "history.json").bind("p")
+    exp = SmartSelector.expand(["localhost:9"])
+    assert exp != ["localhost:9"]
+    view.record_many([(t, 9999) for t in exp] * ProbeHistory.SKIP_STREAK)
+    assert view.skip("localhost:9") and not view.skip("localhost:10")
+
+
+def test_save_failure_keeps_dirty(tmp_path, monkeypatch):
+    h = ProbeHistory(tmp_path / "history.json"); h.record_many("p", [("1.1.1.1:443", 50)])
+    def fail(path, text): raise OSError("disk full")
+    monkeypatch.setattr(ConfigManager, "_write", staticmethod(fail))
+    h.save()
+    assert h.dirty and not (tmp_path / "history.json").exists()
+    monkeypatch.undo(); h.save()
+    assert not h.dirty and not (tmp_path / "history.json.tmp").exists()
+    assert ProbeHistory(tmp_path / "history.json").best("p") == [("1.1.1.1:443", 50)]
@@ -0,0 +1,28 @@
+import socket
+import urllib.request
+
+from ech_core import CoreRunner
+
+
+def runner(metrics=None):
+    logs = []
+    r = CoreRunner({"id": "p", "server": "w.example.com:443", **({"metrics": metrics} if metrics else {})},
+                   msg=lambda t, c=None: logs.append(t))
+    return r, logs
+
+
+def test_endpoint_off_by_default_but_stats_kept():
+    r, logs = runner(); r.start_metrics()
+    assert r.metrics is None and not logs
+    cmd = r.build_cmd(); assert cmd[cmd.index('-stats') + 1] == "2"
+
+
+def test_busy_port_falls_back():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); s.listen(1); busy = s.getsockname()[1]
+        r, logs = runner({"port": busy}); r.start_metrics()
+        try:
+            assert r.metrics and r.metrics.port != busy
+            assert any(f"端口 {busy} 不可用" in l for l in logs) and f"127.0.0.1:{r.metrics.port}/metrics" in logs[-1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{r.metrics.port}/metrics", timeout=2) as res: assert res.status == 200
+        finally: r.metrics.stop()
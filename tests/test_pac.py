@@ -0,0 +1,51 @@
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from ech_core import ChinaIndex, PacFile
+
+NODE = shutil.which("node")
+# PAC 运行环境的最小替身: isPlainHostName 与 dnsResolve
+SHIM = """
+function isPlainHostName(h) { return h.indexOf(".") < 0; }
+var DNS = %s; function dnsResolve(h) { return DNS[h] || null; }
+var hosts = %s, out = {}; for (var i = 0; i < hosts.length; i++) out[hosts[i]] = FindProxyForURL("http://" + hosts[i] + "/", hosts[i]);
+console.log(JSON.stringify(out));
+"""
+
+
+@pytest.fixture
+def pac(tmp_path):
+    (tmp_path / "chn_ip.txt").write_text("1.0.1.0 1.0.3.255\n36.0.0.0 36.0.255.255\n", encoding='utf-8')
+    (tmp_path / "chn_ip_v6.txt").write_text("2400:3200:: 2400:3200:ffff:ffff:ffff:ffff:ffff:ffff\n", encoding='utf-8')
+    (tmp_path / "chn_domain.txt").write_text("server=/qq.com/114.114.114.114\n", encoding='utf-8')
+    return PacFile(ChinaIndex(tmp_path))
+
+
+def run(pac, hosts, dns=None):
+    _, body = pac.render("127.0.0.1:30000")
+    js = body + SHIM % (json.dumps(dns or {}), json.dumps(hosts))
+    return json.loads(subprocess.run([NODE, "-e", js], capture_output=True, text=True, check=True).stdout)
+
+
+@pytest.mark.skipif(not NODE, reason="需要 node 执行 PAC")
+def test_pac_ip_literals(pac):
+    out = run(pac, ["2001:db8::1", "[2001:db8::1]", "2a00:1450::1", "2400:3200::1", "[2400:3200:1::8]", "1.0.2.3", "8.8.8.8"])
+    proxy = "PROXY 127.0.0.1:30000"
+    assert out["2001:db8::1"] == out["[2001:db8::1]"] == out["2a00:1450::1"] == out["8.8.8.8"] == proxy
+    assert out["2400:3200::1"] == out["[2400:3200:1::8]"] == out["1.0.2.3"] == "DIRECT"
+
+
+@pytest.mark.skipif(not NODE, reason="需要 node 执行 PAC")
+def test_pac_domains(pac):
+    out = run(pac, ["www.qq.com", "cn.example", "us.example", "intranet"], {"cn.example": "36.0.1.1", "us.example": "8.8.4.4"})
+    assert out == {"www.qq.com": "DIRECT", "cn.example": "DIRECT", "us.example": "PROXY 127.0.0.1:30000", "intranet": "DIRECT"}
+
+
+def test_pac_incremental(pac, tmp_path):
+    v1, _ = pac.render("127.0.0.1:30000"); v4 = pac.parts["v4"]
+    (tmp_path / "chn_domain.txt").write_text("qq.com\njd.com\n", encoding='utf-8')
+    v2, body = pac.render("127.0.0.1:30000")
+    assert v1 != v2 and "jd.com" in body and pac.parts["v4"] is v4
@@ -0,0 +1,119 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from ech_core import SmartSelector
+
+FAST = {"good_ms": 0, "fast_ms": 0, "sample_gap": 0.0, "dual_stack": False}
+
+
+class Sim:
+    """替换 _aopen/_connect：按 plan 注入延迟 (毫秒)；"x" 为连接失败，列表按调用次数依次取值 (取完后重复最后一个)
+    超过 timeout 的延迟表现为真实等待后超时；同时记录调用次数和最大并发"""
+    def __init__(self, plan):
+        self.plan = plan; self.calls = {}; self.inflight = self.peak = 0; self.lock = threading.Lock()
+
+    def _next(self, target):
+        with self.lock:
+            n = self.calls[target] = self.calls.get(target, 0) + 1
+            self.inflight += 1; self.peak = max(self.peak, self.inflight)
+        v = self.plan[target]
+        return v[min(n, len(v)) - 1] if isinstance(v, list) else v
+
+    def _done(self):
+        with self.lock: self.inflight -= 1
+
+    async def aopen(self, target, port, timeout):
+        v = self._next(target)
+        try:
+            if v == "x": raise ConnectionRefusedError()
+            if v / 1000 > timeout: await asyncio.sleep(timeout); raise asyncio.TimeoutError()
+            await asyncio.sleep(v / 1000); return socket.socket(), v
+        finally: self._done()
+
+    def connect(self, target, port=443, timeout=1.0):
+        v = self._next(target)
+        try:
+            if v == "x": raise ConnectionRefusedError()
+            if v / 1000 > timeout: time.sleep(timeout); raise socket.timeout()
+            time.sleep(v / 1000); return v
+        finally: self._done()
+
+
+@pytest.fixture
+def sim(monkeypatch):
+    def make(plan):
+        s = Sim(plan)
+        monkeypatch.setattr(SmartSelector, "_aopen", staticmethod(s.aopen))
+        monkeypatch.setattr(SmartSelector, "_connect", staticmethod(s.connect))
+        return s
+    return make
+
+
+def targets(n, base=1):
+    return [f"198.18.0.{base + i}:443" for i in range(n)]
+
+
+@pytest.mark.parametrize("engine", ["async", "thread"])
+def test_deadline_cancels_pending(sim, engine):
+    fast, slow = targets(6), targets(4, 100)
+    sim({**{t: 20 for t in fast}, **{t: 3000 for t in slow}})
+    t0 = time.monotonic()
+    res = SmartSelector.probe_many(fast + slow, 443, timeout=5.0, concurrency=16, deadline=0.3, engine=engine)
+    assert time.monotonic() - t0 < 1.0
+    assert sorted(t for t, _ in res) == sorted(fast)
+
+
+@pytest.mark.parametrize("engine", ["async", "thread"])
+def test_concurrency_cap(sim, engine):
+    ts = targets(40); s = sim({t: 10 for t in ts})
+    res = SmartSelector.probe_many(ts, 443, timeout=1.0, concurrency=4, engine=engine)
+    assert len(res) == 40 and s.peak <= 4
+
+
+@pytest.mark.parametrize("engine", ["async", "thread"])
+def test_loss_and_timeouts_outrank_lower_p50(sim, engine):
+    lossy, slow_to, clean = targets(3)
+    sim({lossy: [10, 10, "x", 10, "x"], slow_to: [12, 12, 5000, 12, 12], clean: 40})
+    rep = {}
+    best, _ = SmartSelector.pick_best([lossy, slow_to, clean], report=rep, engine=engine, samples=4, retest_timeout=0.2, **FAST)
+    assert best == clean
+    by = {r['target']: r for r in rep['scores']}
+    assert by[lossy]['loss'] > 0 and by[slow_to]['timeouts'] == 1
+    assert by[clean]['p50'] > by[lossy]['p50'] and by[clean]['score'] < min(by[lossy]['score'], by[slow_to]['score'])
+
+
+def test_fast_ms_confirms_before_skipping_retest(sim):
+    trap, good = targets(2)
+    sim({trap: [5] + ["x", 5] * 8, good: 25})
+    rep = {}
+    best, _ = SmartSelector.pick_best([trap, good], report=rep, good_ms=0, fast_ms=15, sample_gap=0.0)
+    assert best == good and len(rep['scores']) == 2
+
+
+@pytest.mark.parametrize("engine", ["async", "thread"])
+def test_good_k_cutoff(sim, engine):
+    # 达到 good_k、全部候选都已开始探测，且最后开始的探测满 good_ms 后，取消其余的慢速探测
+    fast, slow = targets(6), targets(4, 100)
+    sim({**{t: 10 for t in fast}, **{t: 2000 for t in slow}})
+    rep = {}; leads = []
+    t0 = time.monotonic()
+    best, lat = SmartSelector.pick_best(slow[:2] + fast + slow[2:], report=rep, engine=engine, timeout=5.0, concurrency=8,
+                                        good_ms=50, good_k=3, fast_ms=0, samples=1, sample_gap=0.0,
+                                        leader=lambda t, l, n: leads.append(t))
+    assert time.monotonic() - t0 < 1.5
+    assert best in fast and leads and leads[-1] in fast
+    cut = rep['cutoff']
+    assert cut['reason'] == "good" and cut['cancelled'] == 4 and cut['done'] == 6
+    assert (cut['good_ms'], cut['good_k']) == (50, 3)
+
+
+def test_cutoff_waits_for_unstarted_candidates(sim):
+    # 候选尚未全部开始探测时不提前结束：最快的候选排在最后也能被选中
+    ts = targets(12); plan = {t: 30 for t in ts}; plan[ts[-1]] = 5
+    sim(plan); rep = {}
+    best, _ = SmartSelector.pick_best(ts, report=rep, concurrency=3, good_ms=50, good_k=3, fast_ms=0, samples=1, sample_gap=0.0)
+    assert best == ts[-1] and 'cutoff' not in rep